@@ -0,0 +1,50 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Test fixtures:
+# The atlases are decoded without display (SDL dummy video driver) and
+# cached in a temporary directory shared by all tests of the session.
+#-------------------------------------------------------------------------------
+""" Test Fixtures Module. """
+
+import argparse
+import os
+
+import pytest
+
+from wfc_src import batch
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+RESOURCES = os.path.join(os.path.dirname(__file__), '..', 'resources')
+
+@pytest.fixture(scope='session')
+def cache_dir(tmp_path_factory):
+    ''' Return the atlas cache directory of the session. '''
+    return str(tmp_path_factory.mktemp('cache'))
+
+@pytest.fixture(scope='session')
+def load_engine(cache_dir):
+    ''' Return a function creating a Tiles Manager of an engine and size
+    with the tiles_64x64_6 atlas loaded.
+    '''
+    def load(engine, size):
+        args = argparse.Namespace(atlas=os.path.join(RESOURCES, 'tiles_64x64_6.png'),
+                                  rows=9, cols=13)
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setenv('WFC_CACHE_DIR', cache_dir)
+            return batch.load_engine(args, engine, size)
+    return load
@@ -0,0 +1,65 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Checkpoint tests:
+# A generation interrupted after a full and a delta checkpoint and resumed
+# in another Tiles Manager gives exactly the map of an uninterrupted run.
+#-------------------------------------------------------------------------------
+""" Checkpoint Tests Module. """
+
+import contextlib
+import io
+
+import pytest
+
+from wfc_src import batch
+from wfc_src.checkpoint import Checkpointer, load_checkpoint
+from wfc_src.constraints import constrain
+
+# Constraints of the maps (the allowed Tiles are part of the solver state)
+ALLOWED = {(3, 4): [36], (9, 2): list(range(0, 200, 3))}
+
+def start(tiles_man, seed):
+    ''' Clear and constrain a seeded generation. '''
+    tiles_man.seed(seed)
+    tiles_man.clear()
+    assert constrain(tiles_man, allowed=ALLOWED)['feasible']
+
+@pytest.mark.parametrize('engine', sorted(batch.ENGINES))
+def test_resume(load_engine, tmp_path, engine):
+    ''' The resumed generation gives the map of the uninterrupted one. '''
+    tiles_man = load_engine(engine, (12, 12))
+    start(tiles_man, 3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tiles_man.generate()
+    expected = batch.get_tiles(tiles_man)
+
+    filename = str(tmp_path / 'run.wfck')
+    start(tiles_man, 3)
+    checkpointer = Checkpointer(tiles_man, filename)
+    for _ in range(2):
+        for _ in range(40):
+            assert tiles_man.next_step()
+        checkpointer.save()
+
+    resumed = load_engine(engine, (1, 1))
+    assert load_checkpoint(resumed, filename) == 2
+    with contextlib.redirect_stdout(io.StringIO()):
+        resumed.generate()
+    assert batch.get_tiles(resumed) == expected
+    assert resumed.is_valid()
+    for (y_idx, x_idx), tiles in ALLOWED.items():
+        assert expected[y_idx][x_idx] in tiles
@@ -0,0 +1,72 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Pre-constraints tests:
+# The seeded maps keep the pinned Tiles, pick the Tiles of the constrained
+# Cells only among the allowed ones, infeasible constraints are reported.
+#-------------------------------------------------------------------------------
+""" Pre-constraints Tests Module. """
+
+import contextlib
+import io
+
+import pytest
+
+from wfc_src import batch
+from wfc_src.constraints import constrain
+
+def generate(tiles_man, seed, **constraints):
+    ''' Generate a seeded map with constraints, return the report and the map. '''
+    tiles_man.seed(seed)
+    tiles_man.clear()
+    report = constrain(tiles_man, **constraints)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tiles_man.generate()
+    return report, batch.get_tiles(tiles_man)
+
+@pytest.mark.parametrize('engine', sorted(batch.ENGINES))
+def test_constraints_kept(load_engine, engine):
+    ''' The pinned and the allowed Tiles are in the generated maps. '''
+    tiles_man = load_engine(engine, (16, 16))
+    tiles_cnt = len(tiles_man.tiles_def)
+    pinned = {(0, 0): 5, (8, 3): 40}
+    allowed = {(11, 11): list(range(0, tiles_cnt, 3)), (4, 9): [36]}
+    for seed in range(1, 4):
+        report, tiles = generate(tiles_man, seed, tiles=pinned, allowed=allowed)
+        assert report['feasible']
+        assert tiles_man.is_valid(), seed
+        for (y_idx, x_idx), tile in pinned.items():
+            assert tiles[y_idx][x_idx] == tile, seed
+        for (y_idx, x_idx), cell_tiles in allowed.items():
+            assert tiles[y_idx][x_idx] in cell_tiles, seed
+
+def test_constraints_infeasible(load_engine):
+    ''' Neighbor Tiles which cannot be connected are reported, the solver
+    is not changed.
+    '''
+    tiles_man = load_engine('list', (4, 4))
+    class_def = tiles_man.class_def
+    right = class_def[tiles_man.tile_class[5]][1]
+    wrong = [tile for tile in range(len(tiles_man.tiles_def))
+             if class_def[tiles_man.tile_class[tile]][3] != right]
+    tiles_man.seed(0)
+    tiles_man.clear()
+    masks = tiles_man.get_masks()
+    report = constrain(tiles_man, tiles={(1, 1): 5}, allowed={(1, 2): wrong})
+    assert not report['feasible']
+    assert report['pair_conflicts'] == [((1, 1), (1, 2))]
+    assert tiles_man.get_masks() == masks
+    assert not tiles_man.pinned and not tiles_man.allowed
@@ -0,0 +1,54 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Engines tests:
+# Every engine generates seeded maps, all Cells collapsed without deadend
+# and all neighbor Tiles connected.
+#-------------------------------------------------------------------------------
+""" Engines Tests Module. """
+
+import contextlib
+import io
+
+import pytest
+
+from wfc_src import batch
+
+@pytest.mark.parametrize('engine', sorted(batch.ENGINES))
+def test_generate_valid(load_engine, engine):
+    ''' Seeded maps of every engine are valid and fully collapsed. '''
+    tiles_man = load_engine(engine, (24, 24))
+    for seed in range(4):
+        tiles_man.seed(seed)
+        tiles_man.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tiles_man.generate()
+        assert not tiles_man.has_contradiction(), seed
+        assert tiles_man.is_valid(), seed
+        assert min(min(row) for row in tiles_man.get_classes()) >= 0, seed
+
+@pytest.mark.parametrize('engine', sorted(batch.ENGINES))
+def test_generate_seeded(load_engine, engine):
+    ''' The same seed generates the same map. '''
+    tiles_man = load_engine(engine, (12, 12))
+    maps = []
+    for _ in range(2):
+        tiles_man.seed(7)
+        tiles_man.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tiles_man.generate()
+        maps.append(batch.get_tiles(tiles_man))
+    assert maps[0] == maps[1]
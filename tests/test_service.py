@@ -0,0 +1,72 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Generation service tests:
+# Validation of the requests and the maps of the constrained requests,
+# solved in the test process (without the pool of workers).
+#-------------------------------------------------------------------------------
+""" Generation Service Tests Module. """
+
+import multiprocessing
+import os
+
+import pytest
+
+from wfc_src import service
+
+RESOURCES = os.path.join(os.path.dirname(__file__), '..', 'resources')
+
+def get_request(data):
+    ''' Return the complete request of a JSON object. '''
+    return service.get_request(data, service.DEFAULTS, RESOURCES, 1 << 16)
+
+@pytest.mark.parametrize('data, error', [
+    ({'rows': 'x'}, 'Invalid request field'),
+    ({'rows': 0}, 'Invalid atlas rows x cols'),
+    ({'cols': 16}, 'Invalid atlas rows x cols'),
+    ({'size': [12]}, 'Invalid size'),
+    ({'size': [12, 12, 12]}, 'Invalid size'),
+    ({'size': 12}, 'Invalid size'),
+    ({'size': [1024, 1024]}, 'Invalid size'),
+    ({'atlas': '../wfc_src/service.py'}, 'Unknown atlas'),
+    ({'engine': 'none'}, 'Unknown engine'),
+])
+def test_invalid_request(data, error):
+    ''' Invalid requests are rejected with a clear message. '''
+    with pytest.raises(ValueError, match=error):
+        get_request(data)
+
+def test_request_defaults():
+    ''' The atlas rows and columns are numbers. '''
+    request = get_request({'rows': '9', 'cols': 13.0, 'size': ['12', 12]})
+    assert (request['rows'], request['cols'], request['size']) == (9, 13, [12, 12])
+
+def test_constrained_request(monkeypatch, cache_dir):
+    ''' The maps keep the pinned and the allowed Tiles. '''
+    monkeypatch.setenv('WFC_CACHE_DIR', cache_dir)
+    monkeypatch.setattr(service, '_SOLVERS', service.OrderedDict())
+    service.init_worker(multiprocessing.Value('i', 0), RESOURCES, [])
+    for seed in range(3):
+        request = get_request({'allowed': [[11, 11, [36]], [2, 3, list(range(0, 234, 3))]],
+                               'pinned': [[0, 0, 5]], 'seed': seed, 'size': [12, 12]})
+        result = service.solve_request(request)
+        assert result['valid'], seed
+        assert 'violations' not in result
+        assert result['tiles'][11][11] == 36
+        assert result['tiles'][2][3] % 3 == 0
+        assert result['tiles'][0][0] == 5
+    request = {'pinned': [(0, 0, 5)], 'allowed': [(1, 1, [36]), (1, 0, [1, 2])]}
+    assert service.get_violations([[5, 1], [2, 3]], request) == [(1, 1)]
@@ -2,12 +2,53 @@
 import sys
 import os
 
-from wfc_src.wfc import WFC
-
 def _real_main(argv=None):
     ''' Real main function.'''
     #print('__init__._real_main()')
 
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # headless batch generation: python -m wfc_src generate ...
+    if argv and argv[0] == 'generate':
+        from wfc_src import batch  # pylint: disable=import-outside-toplevel
+        sys.exit(batch.main(argv[1:]))
+
+    # large map: python -m wfc_src large ...
+    if argv and argv[0] == 'large':
+        from wfc_src import blocks  # pylint: disable=import-outside-toplevel
+        sys.exit(blocks.main(argv[1:]))
+
+    # streaming: python -m wfc_src stream ...
+    if argv and argv[0] == 'stream':
+        from wfc_src import stream  # pylint: disable=import-outside-toplevel
+        sys.exit(stream.main(argv[1:]))
+
+    # one map with checkpoints: python -m wfc_src solve ...
+    if argv and argv[0] == 'solve':
+        from wfc_src import checkpoint  # pylint: disable=import-outside-toplevel
+        sys.exit(checkpoint.main(argv[1:]))
+
+    # first valid map of several seeds: python -m wfc_src race ...
+    if argv and argv[0] == 'race':
+        from wfc_src import race  # pylint: disable=import-outside-toplevel
+        sys.exit(race.main(argv[1:]))
+
+    # generation service: python -m wfc_src serve ...
+    if argv and argv[0] == 'serve':
+        from wfc_src import service  # pylint: disable=import-outside-toplevel
+        sys.exit(service.main(argv[1:]))
+
+    # map image: python -m wfc_src render ...
+    if argv and argv[0] == 'render':
+        from wfc_src import mapimage  # pylint: disable=import-outside-toplevel
+        sys.exit(mapimage.main(argv[1:]))
+
+    # benchmark: python -m wfc_src bench ...
+    if argv and argv[0] == 'bench':
+        from wfc_src import bench  # pylint: disable=import-outside-toplevel
+        sys.exit(bench.main(argv[1:]))
+
     # get the path + filename
     # Example: C:\Users\...\RubikQuat\rubikquat_src\__init__.pyc
     path = os.path.realpath(os.path.abspath(__file__))
@@ -22,6 +63,8 @@ def _real_main(argv=None):
         path = os.path.dirname(path)
         path = os.path.dirname(path)
 
+    # pygame (display) is imported only here, not by the solver modules
+    from wfc_src.wfc import WFC  # pylint: disable=import-outside-toplevel
     wfc = WFC(768, 768, path)
     #wfc = WFC(2000, 2000, path)
     wfc.run()
@@ -0,0 +1,180 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Atlas:
+# Extract the Tiles images from the atlas image and decode the Tiles
+# definitions from their markers (see tilesman.py for the Tile definition).
+#
+# This is the only module (beside render.py and wfc.py) which needs pygame,
+# it is imported by the Tiles Manager only when an atlas is decoded.
+#
+# The atlas is blitted once on a black surface (the colorkey pixels stay
+# black) and read as one pixel array (see get_pixels). The Tiles and their
+# flipped and rotated variants are views of this array: flipping a Tile
+# horizontally and rotating it by 90 degrees is its transposition. The
+# markers of all Tiles are read at once (see decode_tiles), the Tiles
+# surfaces are created from the views (see make_tiles).
+#-------------------------------------------------------------------------------
+""" Tiles Atlas Module. """
+
+import numpy as np
+import pygame
+
+# Size of a Tile (pixels)
+TILE = 64
+# Positions (x, y) of the 4 markers of a Tile: top-left, bottom-left, top-right, bottom-right
+MARKERS = ((1, 1), (1, TILE - 2), (TILE - 2, 1), (TILE - 2, TILE - 2))
+
+def open_atlas(fullname):
+    ''' Open the atlas image file, return its surface.
+    '''
+    try:
+        img_surface = pygame.image.load(fullname)
+    except pygame.error as message:
+        print('Cannot load image:', fullname)
+        raise SystemExit(message)
+
+    # convert to display format (only if there is a display, e.g. not in batch mode)
+    if pygame.display.get_surface() is not None:
+        img_surface = img_surface.convert()
+    #img_rect = img_surface.get_rect()
+
+    # get reference colorkey (point 0, 0)
+    ref_colorkey = img_surface.get_at((0, 0))
+    img_surface.set_colorkey(ref_colorkey, pygame.RLEACCEL)
+    return img_surface
+
+def get_pixels(img_surface):
+    ''' Return the pixels of the atlas as they are copied to the Tiles:
+    the atlas blitted on a black surface, array (x, y, color).
+    '''
+    surface = pygame.Surface(img_surface.get_size())
+    surface.blit(img_surface, (0, 0))
+    return pygame.surfarray.array3d(surface)
+
+def get_tiles_pixels(pixels, ty_cnt, tx_cnt, top=0):
+    ''' Return the pixels of ty_cnt x tx_cnt Tiles (from the Tiles row top),
+    array (ty_cnt, tx_cnt, x, y, color) of views of the atlas pixels.
+    '''
+    width, height = tx_cnt * TILE, (top + ty_cnt) * TILE
+    if pixels.shape[0] < width or pixels.shape[1] < height:
+        # Tiles outside the atlas: black
+        padded = np.zeros((max(width, pixels.shape[0]), max(height, pixels.shape[1]), 3),
+                          dtype=pixels.dtype)
+        padded[:pixels.shape[0], :pixels.shape[1]] = pixels
+        pixels = padded
+    pixels = pixels[:width, top * TILE:height]
+    return pixels.reshape(tx_cnt, TILE, ty_cnt, TILE, 3).transpose(2, 0, 1, 3, 4)
+
+def make_tile(pixels):
+    ''' Create the surface of a Tile from its pixels (x, y, color).
+    '''
+    surface = pygame.Surface((TILE, TILE))
+    pygame.surfarray.blit_array(surface, pixels)
+    surface.set_colorkey((0, 0, 0))
+    return surface
+
+def make_tiles(tiles_pixels):
+    ''' Create the surfaces of all Tiles (and of their flipped and rotated
+    variants) from the Tiles pixels, return a list of (j, i, surface).
+    '''
+    tiles = []
+    for j, row in enumerate(tiles_pixels):
+        for i, pixels in enumerate(row):
+            tiles.append((j, i, make_tile(pixels)))
+            # flipped horizontally and rotated by 90 degrees: transposed
+            tiles.append((j, i, make_tile(pixels.swapaxes(0, 1))))
+    return tiles
+
+def extract_tiles(img_surface, ty_cnt, tx_cnt):
+    ''' Extract every 64x64 Tile (and its flipped and rotated variant)
+    from the atlas surface, return a list of (j, i, surface).
+    '''
+    return make_tiles(get_tiles_pixels(get_pixels(img_surface), ty_cnt, tx_cnt))
+
+def extract_special(img_surface):
+    ''' Extract the special images from the atlas surface.
+    Return (img_many, img_none, img_last, img_entr).
+    '''
+    row = get_tiles_pixels(get_pixels(img_surface), 1, 7, top=9)[0]
+    # many possibilities, no possibilities, last processed, 5 entropy images
+    images = [make_tile(row[i]) for i in (0, 0, 1, 2, 3, 4, 5, 6)]
+    return images[0], images[1], images[2], images[3:]
+
+def decode_tiles(color_dict, tiles_pixels):
+    ''' Decode all Tiles (and their flipped and rotated variants) from the
+    Tiles pixels, return the list of (T, R, B, L) definitions in the order of
+    extract_tiles. The colors are indexed as in decode_tile (in the order they
+    are found, new colors are added to color_dict).
+    '''
+    # marker colors: (ty_cnt, tx_cnt, variant, marker, color) -> (markers, color)
+    markers = np.stack([np.stack([tiles_pixels[:, :, x, y] for x, y in MARKERS], axis=2),
+                        np.stack([tiles_pixels[:, :, y, x] for x, y in MARKERS], axis=2)],
+                       axis=2).reshape(-1, 3).astype(np.int64)
+    keys = (markers[:, 0] << 16) | (markers[:, 1] << 8) | markers[:, 2]
+    colors, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # new colors get their index in the order they are found
+    color_idx = np.empty(len(colors), dtype=np.int64)
+    for idx in np.argsort(first, kind='stable'):
+        key = int(colors[idx])
+        color = (key >> 16, (key >> 8) & 0xFF, key & 0xFF, 255)
+        if color not in color_dict:
+            color_dict[color] = len(color_dict)
+        color_idx[idx] = color_dict[color]
+
+    # (T, R, B, L) from the markers: top-left, bottom-left, top-right, bottom-right
+    c_tl, c_bl, c_tr, c_br = color_idx[inverse.reshape(-1)].reshape(-1, 4).T
+    tiles_def = np.stack([8 * c_tl + c_tr, 8 * c_tr + c_br, 8 * c_bl + c_br, 8 * c_tl + c_bl],
+                         axis=1)
+    return [tuple(tile) for tile in tiles_def.tolist()]
+
+def get_color_idx(color_dict, surface, x_pos, y_pos):
+    ''' Get color index from surface at a specified position (x_pos, y_pos).
+    If color not already in the dictionary, add it and assign a index.'''
+
+    color_test = tuple(surface.get_at((x_pos, y_pos)))
+    if color_test not in color_dict:
+        # Color not in dictionary, add it and assign a index (length)
+        color_dict[color_test] = len(color_dict)
+    return color_dict[color_test]
+
+def decode_tile(color_dict, surface):
+    """ Decode a Tile (surface), return its (T, R, B, L) definition.
+    See decode_tiles for all Tiles of an atlas. """
+    # Tile (T, R, B, L) definitions
+    tile = [0, 0, 0, 0]
+
+    color_idx = get_color_idx(color_dict, surface, 1, 1)
+    if color_idx != 0:
+        tile[0] += (8 * color_idx) # Top
+        tile[3] += (8 * color_idx) # Left
+
+    color_idx = get_color_idx(color_dict, surface, 1, 62)
+    if color_idx != 0:
+        tile[2] += (8 * color_idx)  # Bottom
+        tile[3] += (1 * color_idx)  # Left
+
+    color_idx = get_color_idx(color_dict, surface, 62, 1)
+    if color_idx != 0:
+        tile[0] += (1 * color_idx)  # Top
+        tile[1] += (8 * color_idx)  # Right
+
+    color_idx = get_color_idx(color_dict, surface, 62, 62)
+    if color_idx != 0:
+        tile[1] += (1 * color_idx)  # Right
+        tile[2] += (1 * color_idx)  # Bottom
+
+    return tuple(tile)
@@ -0,0 +1,261 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Backtracking Tiles Manager:
+# Worklist Tiles Manager which does not accept deadends. Instead of creating
+# "artificially" the null-cell, a contradiction (a Cell without any possible
+# Tile) is resolved by:
+#
+#   1. Roll back to the last decision (the last collapse). The Tile selected
+#      at that decision is removed from the possibilities of the Cell and the
+#      propagation continues (retry with another random choice). If the Cell
+#      has no more possibilities, roll back one more decision, etc.
+#   2. After max_backtracks roll backs restart the generation from the
+#      initial state. After max_restarts restarts the generation fails.
+#   3. If there is no decision left to roll back, all choices have been
+#      tried and there is no solution: the generation fails.
+#
+# No copies of the Cells are made. Every change of a Cell's possibilities
+# is recorded in a trail (undo log) as (y, x, previous-mask), together with
+# the previous weights sums (restored exactly, without rounding errors).
+# A decision is the length of the trail at the moment of the collapse, so
+# rolling back to a decision means restoring the masks from the trail until
+# it has that length again:
+#
+#   trail:     [ ... (y,x,mask) (y,x,mask) | (y,x,mask) (y,x,mask) ... ]
+#   decisions:                             ^ (trail length, y, x, tile)
+#
+# The initial state (after clear, set_cell or shift) is not recorded, a
+# restart rolls back the whole trail and propagates again from the "seed"
+# Cells (set or shifted Cells).
+#-------------------------------------------------------------------------------
+""" Backtracking Tiles Manager Module. """
+
+from collections import deque
+
+from .tilesman import TX_OUT, TY_OUT
+from .worklist import WorklistTilesManager
+
+# ##############################################################################
+class BacktrackTilesManager(WorklistTilesManager):
+    """ Worklist Tiles Manager with backtracking on contradictions """
+
+    TIMED = WorklistTilesManager.TIMED + ('backtrack', 'undo')
+    STATE = WorklistTilesManager.STATE + ('seeds', 'conflict', 'failed', 'backtracks',
+                                          'restarts', 'attempt_backtracks')
+    LOGS = ('trail', 'decisions')
+
+    def __init__(self, path, ty_out=TY_OUT, tx_out=TX_OUT,
+                 max_backtracks=1000, max_restarts=10):
+        """ Init Backtracking Tiles Manager """
+        self.max_backtracks = max_backtracks    # roll backs before restart
+        self.max_restarts = max_restarts        # restarts before failure
+        self.trail = []         # undo log: (y, x, previous mask, sum_w, sum_wlogw)
+        self.decisions = []     # (trail length, y, x, tile)
+        self.seeds = []         # cells to propagate from after a restart
+        self.conflict = False   # contradiction detected during propagation
+        self.failed = False     # generation failed (budget exhausted)
+        # statistics
+        self.backtracks = 0
+        self.restarts = 0
+        self.attempt_backtracks = 0
+        super().__init__(path, ty_out, tx_out)
+
+    def set_mask(self, y_idx, x_idx, mask):
+        ''' Set the possibilities mask of a cell and record the change in the trail.
+        '''
+        cell = self.cell_arr[y_idx][x_idx]
+        self.trail.append((y_idx, x_idx, cell.poss_mask, cell.sum_w, cell.sum_wlogw))
+        removed = cell.poss_mask & ~mask
+        cell.poss_mask = mask
+        cell.entropy = bin(mask).count('1')
+        self.remove_weights(cell, removed)
+        if cell.entropy == 1:
+            cell.processed = True
+        else:
+            self.index_push(y_idx, x_idx)
+        if self.dirty is not None:
+            self.dirty.add((y_idx, x_idx))
+
+    def undo(self, trail_len):
+        ''' Roll back all changes recorded in the trail after trail_len.
+        '''
+        while len(self.trail) > trail_len:
+            y_idx, x_idx, mask, cell_w, cell_wlogw = self.trail.pop()
+            cell = self.cell_arr[y_idx][x_idx]
+            cell.poss_mask = mask
+            cell.sum_w, cell.sum_wlogw = cell_w, cell_wlogw
+            cell.entropy = bin(mask).count('1')
+            cell.processed = (cell.entropy == 1)
+            if not cell.processed:
+                self.index_push(y_idx, x_idx)
+            if self.dirty is not None:
+                self.dirty.add((y_idx, x_idx))
+        self.queue = deque()
+        self.queued = set()
+        self.conflict = False
+
+    def process_neighbor_cell(self, y_pos, x_pos, y_rel, x_rel, side_idx, main_set):
+        """ Process neighbor cell. Remove from the neighbor cell all Tiles
+            which are not in main_set, queue the neighbor if it changed.
+            y_pos - y-position of the main cell
+            x_pos - x-position of the main cell
+            y_rel - y-relative-position of the neighbor cell
+            x_rel - x-relative-position of the neighbor cell
+            side_idx - index of the neighbor side to be cheked (0=top, 1=right, 2=bottom, 3=left)
+            main_set - bitmask of Tiles which can be connected to the main cell
+        """
+        y_nb, x_nb = y_pos + y_rel, x_pos + x_rel
+        cell = self.cell_arr[y_nb][x_nb]
+        # collapsed cells are checked too, they can conflict with the main cell
+        if not self.conflict:
+            mask = cell.poss_mask & main_set
+            # contradiction detected? (no more valid possibilities)
+            if mask == 0:
+                self.conflict = True
+                self.contradiction(y_nb, x_nb)
+            elif mask != cell.poss_mask:
+                self.set_mask(y_nb, x_nb, mask)
+                self.enqueue(y_nb, x_nb)
+
+    def restart(self):
+        ''' Restart the generation from the initial state.
+        Return False if no more restarts are allowed.
+        '''
+        if self.restarts >= self.max_restarts:
+            return False
+        self.restarts += 1
+        self.attempt_backtracks = 0
+        self.undo(0)
+        self.decisions = []
+        for y_idx, x_idx in self.seeds:
+            self.enqueue(y_idx, x_idx)
+        print("Restart: ", self.restarts)
+        return True
+
+    def backtrack(self):
+        ''' Resolve a contradiction: roll back to the last decision and remove
+        the selected Tile from the possibilities of the collapsed cell.
+        Return False if the generation failed.
+        '''
+        while self.decisions:
+            # too many roll backs, try a restart
+            if self.attempt_backtracks >= self.max_backtracks:
+                if self.restart():
+                    return True
+                break
+            trail_len, y_idx, x_idx, tile = self.decisions.pop()
+            self.undo(trail_len)
+            self.backtracks += 1
+            self.attempt_backtracks += 1
+            # retry with another choice (the change belongs to the previous decision)
+            mask = self.cell_arr[y_idx][x_idx].poss_mask & ~(1 << tile)
+            if mask != 0:
+                self.set_mask(y_idx, x_idx, mask)
+                self.enqueue(y_idx, x_idx)
+                return True
+        # all choices tried (no solution) or restarts budget exhausted
+        print("Unsolvable!")
+        self.failed = True
+        return False
+
+    def next_step(self):
+        ''' Next step in collapsing the wave-function: process the next cell
+        from the worklist or (if empty) collapse the cell with min entropy.
+        On contradiction roll back to the last decision.
+        '''
+        if self.failed:
+            return False
+
+        if self.queue:
+            min_y, min_x = self.queue.popleft()
+            self.queued.discard((min_y, min_x))
+            self.process_cell(min_y, min_x)
+            self.last_x = min_x
+            self.last_y = min_y
+            if self.conflict:
+                return self.backtrack()
+            return True
+
+        # Find cell with minimal number of possibilities
+        # and collapse it (select a random Tile for it).
+        min_y, min_x = self.find_min_entropy_cell(changed = False)
+        if (min_y is not None) and (min_x is not None):
+            self.collapse_cell(min_y, min_x)
+            return True
+
+        print("Finish!")
+        self.last_x = None
+        self.last_y = None
+        return False
+
+    def collapse_cell(self, y_idx, x_idx):
+        ''' Collapse the cell (select a random Tile for it), record the decision.
+        '''
+        tile = self.choose_class(self.cell_arr[y_idx][x_idx])
+        self.decisions.append((len(self.trail), y_idx, x_idx, tile))
+        self.set_mask(y_idx, x_idx, 1 << tile)
+        self.enqueue(y_idx, x_idx)
+        if self.stats is not None:
+            self.stats.count('collapses')
+
+    # ##########################################################################
+    # Extern methods
+    # ##########################################################################
+
+    def reset_trail(self, seeds):
+        ''' The current state becomes the initial state (nothing to roll back).
+        '''
+        self.trail = []
+        self.decisions = []
+        self.seeds = seeds
+        self.conflict = False
+        self.failed = False
+        self.attempt_backtracks = 0
+
+    def clear(self):
+        """ Clear all cells
+        """
+        super().clear()
+        self.reset_trail([])
+        self.backtracks = 0
+        self.restarts = 0
+
+    def has_contradiction(self):
+        ''' Return True if a contradiction could not be resolved by
+        backtracking.
+        '''
+        return self.failed
+
+    def set_class(self, y_pos, x_pos, val):
+        """ Set class for a cell at specified position
+        """
+        super().set_class(y_pos, x_pos, val)
+        self.seeds.append((y_pos, x_pos))
+
+    def shift_down(self):
+        """ Shift all cells one row down, the bottom row is lost,
+        a new row appears on top.
+        """
+        super().shift_down()
+        self.reset_trail([(1, x_idx) for x_idx in range(self.tx_out)])
+
+    def shift_up(self):
+        """ Shift all cells one row up, the upper row is lost,
+        a new row appears on bottom.
+        """
+        super().shift_up()
+        self.reset_trail([(self.ty_out - 2, x_idx) for x_idx in range(self.tx_out)])
@@ -0,0 +1,201 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Headless batch generation:
+#
+#   python -m wfc_src generate --atlas resources/tiles_64x64_9.png \
+#       --size 12 12 --count 1000 --seed 0 --out out_dir --jobs 8
+#
+# The maps are generated in a pool of worker processes, every worker loads
+# the atlas once (one warm Tiles Manager per worker) and generates the maps
+# for the seeds it receives. No display is needed (SDL dummy video driver).
+# Every map is written to the output directory as PNG image, as text file
+# (one line per row, tile indexes separated by spaces) or as binary map file
+# (uint16 Tile indexes with atlas and seed description, see mapfile.py).
+#
+# The Tiles weights (frequencies) can be set with --weights weights.json,
+# a JSON list (weight of every Tile) or object {"tile index": weight}.
+#-------------------------------------------------------------------------------
+""" Headless Batch Generation Module. """
+
+import argparse
+import importlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Available engines: name -> (module, Tiles Manager class)
+ENGINES = {
+    'list': ('tilesman', 'TilesManager'),
+    'bitset': ('bitset', 'BitsetTilesManager'),
+    'vector': ('vector', 'VectorTilesManager'),
+    'worklist': ('worklist', 'WorklistTilesManager'),
+    'backtrack': ('backtrack', 'BacktrackTilesManager'),
+}
+
+# Tiles Manager of the worker process (see init_worker)
+_WORKER = None
+
+def get_engine(name):
+    ''' Import and return the Tiles Manager class of an engine.
+    '''
+    module, cls = ENGINES[name]
+    return getattr(importlib.import_module('wfc_src.' + module), cls)
+
+def add_atlas_args(parser, weights=True):
+    ''' Add the atlas arguments (--atlas, --rows, --cols) and the Tiles
+    weights (--weights) to the parser of a command.
+    '''
+    parser.add_argument('--atlas', default=os.path.join(os.path.dirname(__file__),
+                                                        '..', 'resources', 'tiles_64x64_9.png'),
+                        help='tiles atlas image')
+    parser.add_argument('--rows', type=int, default=9, help='rows of tiles in the atlas')
+    parser.add_argument('--cols', type=int, default=13, help='columns of tiles in the atlas')
+    if weights:
+        parser.add_argument('--weights',
+                            help='Tiles weights file (JSON list or {"tile": weight})')
+
+def load_weights(args):
+    ''' Return the Tiles weights of the --weights file (None = not set).
+    '''
+    if not getattr(args, 'weights', None):
+        return None
+    with open(args.weights, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def load_engine(args, engine=None, size=(1, 1)):
+    ''' Return a Tiles Manager of the engine (default: --engine) and size,
+    with the atlas and the Tiles weights of the command line arguments.
+    '''
+    tiles_man = get_engine(engine or args.engine)('', *size)
+    stdout, sys.stdout = sys.stdout, io.StringIO()
+    try:
+        tiles_man.load_tiles(os.path.abspath(args.atlas), False,
+                             ty_cnt=args.rows, tx_cnt=args.cols)
+    finally:
+        sys.stdout = stdout
+    weights = load_weights(args)
+    if weights is not None:
+        tiles_man.set_weights(weights)
+    return tiles_man
+
+def init_worker(engine, atlas, ty_cnt, tx_cnt, size, weights=None):
+    ''' Worker process initializer: create the Tiles Manager, load the atlas
+    and set the Tiles weights.
+    '''
+    global _WORKER  # pylint: disable=global-statement
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    _WORKER = get_engine(engine)('', *size)
+    # atlas decoding is verbose, do not flood the output of the batch
+    stdout, sys.stdout = sys.stdout, io.StringIO()
+    try:
+        _WORKER.load_tiles(os.path.abspath(atlas), True, ty_cnt=ty_cnt, tx_cnt=tx_cnt)
+    finally:
+        sys.stdout = stdout
+    if weights is not None:
+        _WORKER.set_weights(weights)
+
+def get_worker():
+    ''' Return the Tiles Manager of the worker process (see init_worker).
+    '''
+    return _WORKER
+
+def get_tiles(tiles_man):
+    ''' Return the generated map as list of rows of Tile indexes (-1 = not collapsed).
+    '''
+    tiles = tiles_man.get_tiles()
+    # numpy array (vector engine) or list of rows
+    return tiles.tolist() if hasattr(tiles, 'tolist') else tiles
+
+def write_map(tiles_man, filename, fmt, seed=None):
+    ''' Write the generated map as PNG image, text file or binary map file.
+    '''
+    if fmt == 'wfcm':
+        from . import mapfile  # pylint: disable=import-outside-toplevel
+        mapfile.save_map(filename, tiles_man.get_tiles(), mapfile.get_meta(tiles_man, seed))
+    elif fmt == 'png':
+        import pygame  # pylint: disable=import-outside-toplevel
+        surface = pygame.Surface((tiles_man.tx_out * 64, tiles_man.ty_out * 64))
+        tiles_man.draw(surface)
+        pygame.image.save(surface, filename)
+    else:
+        with open(filename, 'w', encoding='utf-8') as file:
+            for row in get_tiles(tiles_man):
+                file.write(' '.join(str(val) for val in row) + '\n')
+
+def generate_map(seed, out_dir, fmt):
+    ''' Generate one map (in worker process). Return (seed, filename, valid, time).
+    '''
+    tiles_man = _WORKER
+    stdout, sys.stdout = sys.stdout, io.StringIO()
+    try:
+        start = time.time()
+        tiles_man.seed(seed)
+        tiles_man.clear()
+        tiles_man.generate()
+        elapsed = time.time() - start
+    finally:
+        sys.stdout = stdout
+    valid = tiles_man.is_valid()
+
+    filename = os.path.join(out_dir, f'map_{seed:06d}.{fmt}')
+    write_map(tiles_man, filename, fmt, seed)
+    return seed, filename, valid, elapsed
+
+def run(args):
+    ''' Generate all maps in a pool of worker processes. Return number of invalid maps.
+    '''
+    os.makedirs(args.out, exist_ok=True)
+    weights = load_weights(args)
+    seeds = range(args.seed, args.seed + args.count)
+    invalid = 0
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                             initargs=(args.engine, args.atlas, args.rows, args.cols,
+                                       tuple(args.size), weights)) as pool:
+        futures = [pool.submit(generate_map, seed, args.out, args.format) for seed in seeds]
+        for future in as_completed(futures):
+            seed, filename, valid, elapsed = future.result()
+            invalid += (not valid)
+            print(f'{seed} {filename} {"ok" if valid else "invalid"} {elapsed:.3f}')
+    total = time.time() - start
+    print(f'Generated {args.count} maps ({invalid} invalid) in {total:.2f}s, '
+          f'{args.count / total:.2f} maps/s')
+    return invalid
+
+def main(argv):
+    ''' Parse command line arguments and run the batch generation.
+    '''
+    parser = argparse.ArgumentParser(prog='python -m wfc_src generate',
+                                     description='Headless batch generation of maps.')
+    add_atlas_args(parser)
+    parser.add_argument('--size', type=int, nargs=2, default=(12, 12), metavar=('H', 'W'),
+                        help='grid size (cells)')
+    parser.add_argument('--count', type=int, default=1, help='number of maps')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='first seed (seeds: seed..seed+count-1)')
+    parser.add_argument('--out', default='out', help='output directory')
+    parser.add_argument('--format', choices=('png', 'txt', 'wfcm'), default='png',
+                        help='output format (wfcm: binary map file)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='backtrack',
+                        help='solver engine')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    args = parser.parse_args(argv)
+    return 1 if run(args) else 0
@@ -0,0 +1,201 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Benchmark:
+#
+#   python -m wfc_src bench --sizes 8 16 32 --seeds 3 --out bench.json
+#   python -m wfc_src bench --compare bench.json    (compare with older results)
+#
+# Runs the solvers headless and seeded for every bundled atlas, every engine
+# and every grid size. For every case (atlas, engine, size) the results are:
+#
+#   load_time       atlas loading and decoding time (s), atlas_cached = loaded from cache
+#   time            total generation time of all seeds (s)
+#   steps           number of next_step calls
+#   propagations    number of Cells propagated to their neighbors
+#   collapses       number of Cells collapsed to a random Tile
+#   contradictions  number of deadends (contradictions for backtracking engine)
+#   peak_mem_kb     peak memory allocated by clear + generate (first seed, tracemalloc)
+#   timings         calls, time and histogram of the solver methods (see stats.py)
+#
+# plus steps_per_sec and propagations_per_sec. The counters and timings are
+# measured in a second (not timed) run with the instrumentation enabled. All
+# results are written to a JSON file (with the commit and python version),
+# the same seeds give the same steps/propagations on every run, only the
+# times vary.
+#-------------------------------------------------------------------------------
+""" Benchmark Module. """
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from .batch import ENGINES, get_engine
+
+RESOURCES = os.path.join(os.path.dirname(__file__), '..', 'resources')
+
+# Bundled atlases: file -> (ty_cnt, tx_cnt), rows and columns of Tiles
+ATLASES = {
+    'tiles_64x64_2.png': (9, 10),
+    'tiles_64x64_3.png': (9, 10),
+    'tiles_64x64_4.png': (9, 10),
+    'tiles_64x64_5.png': (9, 10),
+    'tiles_64x64_6.png': (9, 13),
+    'tiles_64x64_7.png': (9, 13),
+    'tiles_64x64_8.png': (9, 13),
+    'tiles_64x64_9.png': (9, 13),
+}
+
+def load(engine, atlas, size):
+    ''' Create a Tiles Manager and load the atlas. Return (tiles_man, load_time).
+    '''
+    ty_cnt, tx_cnt = ATLASES[atlas]
+    tiles_man = get_engine(engine)('', *size)
+    start = time.perf_counter()
+    tiles_man.load_tiles(os.path.abspath(os.path.join(RESOURCES, atlas)), False,
+                         ty_cnt=ty_cnt, tx_cnt=tx_cnt)
+    return tiles_man, time.perf_counter() - start
+
+def generate(tiles_man, seed):
+    ''' Generate one map, return (steps, generation time).
+    '''
+    tiles_man.seed(seed)
+    start = time.perf_counter()
+    tiles_man.clear()
+    steps = 0
+    while tiles_man.next_step():
+        steps += 1
+    return steps, time.perf_counter() - start
+
+def run_case(engine, atlas, size, seeds):
+    ''' Benchmark one case, return the results dictionary.
+    '''
+    # the solvers print the end of every generation, do not show it
+    stdout, sys.stdout = sys.stdout, io.StringIO()
+    try:
+        tiles_man, load_time = load(engine, atlas, size)
+        atlas_cached = tiles_man.atlas_pending is not None
+        steps = 0
+        elapsed = 0.0
+        for seed in seeds:
+            seed_steps, seed_time = generate(tiles_man, seed)
+            steps += seed_steps
+            elapsed += seed_time
+
+        # counters (the instrumentation slows down, the same seeds are not timed again)
+        stats = tiles_man.enable_stats()
+        for seed in seeds:
+            generate(tiles_man, seed)
+        tiles_man.disable_stats()
+
+        # memory of the first seed (tracemalloc slows down, not timed)
+        tracemalloc.start()
+        generate(tiles_man, seeds[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+
+    propagations = stats.counters.get('propagated', 0)
+    return {
+        'atlas': atlas, 'engine': engine, 'size': list(size), 'seeds': list(seeds),
+        'tiles': len(tiles_man.tiles_def), 'classes': len(tiles_man.class_def),
+        'load_time': round(load_time, 6), 'atlas_cached': atlas_cached,
+        'time': round(elapsed, 6), 'steps': steps,
+        'steps_per_sec': round(steps / elapsed, 1) if elapsed else None,
+        'propagations': propagations,
+        'propagations_per_sec': round(propagations / elapsed, 1) if elapsed else None,
+        'collapses': stats.counters.get('collapses', 0),
+        'contradictions': stats.counters.get('contradictions', 0),
+        'peak_mem_kb': round(peak / 1024, 1),
+        'timings': stats.as_dict()['timings'],
+    }
+
+def get_meta():
+    ''' Return the description of the benchmark environment.
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(), 'platform': platform.platform()}
+
+def case_key(result):
+    ''' Key of a benchmark case (to compare results).
+    '''
+    return (result['atlas'], result['engine'], tuple(result['size']))
+
+def compare(results, filename):
+    ''' Print the speedup of results compared to the results stored in filename.
+    '''
+    with open(filename, 'r', encoding='utf-8') as file:
+        old = {case_key(res): res for res in json.load(file)['results']}
+    print(f'{"atlas":20} {"engine":10} {"size":>9} {"old s":>9} {"new s":>9} {"speedup":>8}')
+    for res in results:
+        old_res = old.get(case_key(res))
+        if old_res is None or not res['time']:
+            continue
+        size = 'x'.join(str(val) for val in res['size'])
+        print(f'{res["atlas"]:20} {res["engine"]:10} {size:>9} {old_res["time"]:9.3f} '
+              f'{res["time"]:9.3f} {old_res["time"] / res["time"]:8.2f}')
+
+def main(argv):
+    ''' Parse command line arguments and run the benchmark.
+    '''
+    parser = argparse.ArgumentParser(prog='python -m wfc_src bench',
+                                     description='Benchmark the solvers.')
+    parser.add_argument('--atlas', nargs='+', choices=sorted(ATLASES), default=sorted(ATLASES),
+                        help='bundled atlases (default: all)')
+    parser.add_argument('--engine', nargs='+', choices=sorted(ENGINES), default=sorted(ENGINES),
+                        help='solver engines (default: all)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=(8, 16, 32),
+                        help='grid sizes (square grids)')
+    parser.add_argument('--seeds', type=int, default=3, help='number of seeds (0..n-1)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the atlas cache')
+    parser.add_argument('--out', default='bench.json', help='results file (JSON)')
+    parser.add_argument('--compare', help='older results file (JSON) to compare with')
+    args = parser.parse_args(argv)
+
+    if args.no_cache:
+        os.environ['WFC_CACHE_DIR'] = ''
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    results = []
+    for atlas in args.atlas:
+        for engine in args.engine:
+            for size in args.sizes:
+                res = run_case(engine, atlas, (size, size), list(range(args.seeds)))
+                results.append(res)
+                print(f'{atlas:20} {engine:10} {size:4}x{size:<4} {res["time"]:8.3f}s '
+                      f'{res["steps_per_sec"] or 0:10.0f} steps/s '
+                      f'{res["propagations_per_sec"] or 0:10.0f} prop/s '
+                      f'{res["contradictions"]:4} contr. {res["peak_mem_kb"]:9.1f} KB')
+
+    with open(args.out, 'w', encoding='utf-8') as file:
+        json.dump({'meta': get_meta(), 'results': results}, file, indent=1)
+    print('Results written to', args.out)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
@@ -0,0 +1,261 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Bitset Tiles Manager:
+# Same algorithm as TilesManager, but the possibilities of a Cell are stored
+# as an integer bitmask instead of a list of Tile indexes:
+#
+#   poss_list = [0, 2, 3]   ->   poss_mask = 0b1101
+#                                              ^^ ^
+#                                  class3 -----+| +---- class0
+#                                  class2 ------+
+#
+# At load time, for every side and every edge definition, the mask of all
+# Tiles classes having this definition on this side is precomputed:
+#
+#   edge_masks[side_idx][edge] = mask of classes with class_def[x][side_idx] == edge
+#
+# The Tiles of a neighbor cell which can be connected to the main cell are:
+#
+#   OR( edge_masks[neighbor_side][edge] ) for every edge where
+#       edge_masks[main_side][edge] & main_mask != 0
+#
+# so the propagation costs a few AND/OR operations per edge definition,
+# independent of the number of Tiles. The weights of the removed classes
+# (old_mask & ~new_mask) are subtracted from the Cell's weights sums.
+#-------------------------------------------------------------------------------
+""" Bitset Tiles Manager Module. """
+
+from .tilesman import TilesManager, TX_OUT, TY_OUT
+
+def get_dir_masks(class_def):
+    ''' Return for every direction (top, right, bottom, left) the list of
+    (main-cell-mask, neighbor-cell-mask) pairs, one per edge definition.
+    '''
+    edge_masks = [{}, {}, {}, {}]
+    for tile_idx, tile in enumerate(class_def):
+        for side_idx in range(4):
+            edge = tile[side_idx]
+            edge_masks[side_idx][edge] = edge_masks[side_idx].get(edge, 0) | (1 << tile_idx)
+
+    # (main cell side, neighbor cell side) for every direction
+    return [[(main_mask, edge_masks[nb_side].get(edge, 0))
+             for edge, main_mask in sorted(edge_masks[main_side].items())]
+            for main_side, nb_side in ((0, 2), (1, 3), (2, 0), (3, 1))]
+
+# ##############################################################################
+class BitCell:
+    """ Tiles Cell definition, possibilities stored as bitmask """
+
+    __slots__ = ('processed', 'changed', 'poss_mask', 'entropy', 'sum_w', 'sum_wlogw')
+
+    def __init__(self, p_mask, sum_w, sum_wlogw, changed = False):
+        self.processed = False          # the cell has been processed
+        self.changed = changed          # the cell has been changed
+        self.poss_mask = p_mask         # bitmask of possibilities for this cell
+        self.entropy = bin(p_mask).count('1')
+        self.sum_w = sum_w              # sum of weights of the possible classes
+        self.sum_wlogw = sum_wlogw      # sum of weight * log(weight)
+
+    def get_entropy(self):
+        ''' Return Cell's entropy (number of possible Tiles for this Cell).
+        '''
+        return self.entropy
+
+    @property
+    def poss_list(self):
+        ''' List of possibilities for this cell (decoded from bitmask).
+        '''
+        mask = self.poss_mask
+        lst = []
+        idx = 0
+        while mask:
+            if mask & 1:
+                lst.append(idx)
+            mask >>= 1
+            idx += 1
+        return lst
+
+    @poss_list.setter
+    def poss_list(self, p_list):
+        mask = 0
+        for idx in p_list:
+            mask |= (1 << idx)
+        self.poss_mask = mask
+        self.entropy = bin(mask).count('1')
+
+# ##############################################################################
+class BitsetTilesManager(TilesManager):
+    """ Tiles Manager using bitmasks for Cell possibilities """
+
+    CACHED = TilesManager.CACHED + ('dir_masks',)
+
+    def __init__(self, path, ty_out=TY_OUT, tx_out=TX_OUT):
+        """ Init Bitset Tiles Manager """
+        # for every direction (top, right, bottom, left) a list of
+        # (main-cell-mask, neighbor-cell-mask) pairs, one per edge definition
+        self.dir_masks = [[], [], [], []]
+        self.full_mask = 0      # mask of all Tiles (shared by all new cells)
+        self.byte_weights = []  # (sum_w, sum_wlogw) of every byte value (see build_weights)
+        super().__init__(path, ty_out, tx_out)
+
+    def new_cell(self):
+        ''' Create a new Cell with all possibilities.
+        '''
+        return BitCell(self.full_mask, self.full_w, self.full_wlogw)
+
+    def clear(self):
+        """ Clear all cells
+        """
+        self.full_mask = (1 << len(self.tl_idx_list)) - 1
+        super().clear()
+
+    def build_masks(self):
+        ''' Precompute the edge masks for all loaded Tiles.
+        '''
+        self.dir_masks = get_dir_masks(self.class_def)
+
+    def build_weights(self):
+        ''' Precompute the weights tables, plus for every byte of the masks
+        the weights sums of all 256 combinations of its 8 classes.
+        '''
+        super().build_weights()
+        self.byte_weights = []
+        for base in range(0, len(self.class_weight), 8):
+            byte_w = [0.0] * 256
+            byte_wlogw = [0.0] * 256
+            for byte in range(1, 256):
+                idx = base + (byte & -byte).bit_length() - 1
+                if idx < len(self.class_weight):
+                    byte_w[byte] = byte_w[byte & (byte - 1)] + self.class_weight[idx]
+                    byte_wlogw[byte] = byte_wlogw[byte & (byte - 1)] + self.class_wlogw[idx]
+                else:
+                    byte_w[byte] = byte_w[byte & (byte - 1)]
+                    byte_wlogw[byte] = byte_wlogw[byte & (byte - 1)]
+            self.byte_weights.append((byte_w, byte_wlogw))
+
+    def build_tables(self):
+        ''' Precompute the tables derived from the Tiles definitions.
+        '''
+        super().build_tables()
+        self.build_masks()
+
+    def remove_weights(self, cell, removed):
+        ''' Subtract the weights of the removed classes (bitmask) from the
+        Cell's weights sums (call after the Cell's mask was updated).
+        The cost is O(1) per removed byte of the mask.
+        '''
+        if cell.entropy == 1:
+            self.set_sums(cell, cell.poss_mask.bit_length() - 1)
+            return
+        sum_w, sum_wlogw = cell.sum_w, cell.sum_wlogw
+        # 8 classes at once (see build_weights)
+        for byte_w, byte_wlogw in self.byte_weights:
+            byte = removed & 0xFF
+            if byte:
+                sum_w -= byte_w[byte]
+                sum_wlogw -= byte_wlogw[byte]
+            removed >>= 8
+            if not removed:
+                break
+        cell.sum_w, cell.sum_wlogw = sum_w, sum_wlogw
+
+    def allowed_mask(self, dir_idx, main_mask):
+        ''' Return the mask of Tiles which can be connected in direction dir_idx
+        (0=top, 1=right, 2=bottom, 3=left) to a cell with main_mask possibilities.
+        '''
+        allowed = 0
+        for edge_mask, nb_mask in self.dir_masks[dir_idx]:
+            if main_mask & edge_mask:
+                allowed |= nb_mask
+        return allowed
+
+    def process_neighbor_cell(self, y_pos, x_pos, y_rel, x_rel, side_idx, main_set):
+        """ Process neighbor cell. Remove from the neighbor cell all Tiles
+            which are not in main_set.
+            y_pos - y-position of the main cell
+            x_pos - x-position of the main cell
+            y_rel - y-relative-position of the neighbor cell
+            x_rel - x-relative-position of the neighbor cell
+            side_idx - index of the neighbor side to be cheked (0=top, 1=right, 2=bottom, 3=left)
+            main_set - bitmask of Tiles which can be connected to the main cell
+        """
+        cell = self.cell_arr[y_pos + y_rel][x_pos + x_rel]
+        # process only cells with more than one possibility
+        if cell.entropy > 1:
+            mask = cell.poss_mask & main_set
+            # deadend detected? (no more valid possibilities)
+            if mask == 0:
+                # create "artificially" the null-cell
+                mask = 1
+                self.contradiction(y_pos + y_rel, x_pos + x_rel)
+            # mark neighbor as changed if list of possible Tiles for this cell changed
+            if mask != cell.poss_mask:
+                removed = cell.poss_mask & ~mask
+                cell.poss_mask = mask
+                cell.entropy = bin(mask).count('1')
+                self.remove_weights(cell, removed)
+                cell.changed = True
+                self.touched.add((y_pos + y_rel, x_pos + x_rel))
+                self.index_push(y_pos + y_rel, x_pos + x_rel)
+                if self.dirty is not None:
+                    self.dirty.add((y_pos + y_rel, x_pos + x_rel))
+
+    def process_cell(self, y_idx:int, x_idx:int):
+        ''' Process cell with coordinates y_idx, x_idx .
+            Check four neighbor cells (top, right, bottom, left) and remove Tiles
+            which cannot be connected to this (center) cell.
+        '''
+        cell = self.cell_arr[y_idx][x_idx]
+        mask = cell.poss_mask
+
+        # check neighbor cell on top side (j-1,i+0)
+        if y_idx > 0:
+            self.process_neighbor_cell(y_idx, x_idx, -1, 0, 2, self.allowed_mask(0, mask))
+
+        # check neighbor cell on right side (j+0,i+1)
+        if x_idx < (self.tx_out - 1):
+            self.process_neighbor_cell(y_idx, x_idx, 0, 1, 3, self.allowed_mask(1, mask))
+
+        # check neighbor cell on bottom side (j+1,i+0)
+        if y_idx < (self.ty_out - 1):
+            self.process_neighbor_cell(y_idx, x_idx, 1, 0, 0, self.allowed_mask(2, mask))
+
+        # check neighbor cell on left side (j+0,i-1)
+        if x_idx > 0:
+            self.process_neighbor_cell(y_idx, x_idx, 0, -1, 1, self.allowed_mask(3, mask))
+
+        # mark cell as processed
+        cell.processed = True
+        self.touched.add((y_idx, x_idx))
+        if self.stats is not None:
+            self.stats.count('propagated')
+
+    def cell_mask(self, cell):
+        ''' Return the possibilities of a Cell as bitmask.
+        '''
+        return cell.poss_mask
+
+    def mask_cell(self, mask, sum_w, sum_wlogw):
+        ''' Create a Cell with the possibilities of a bitmask.
+        '''
+        return BitCell(mask, sum_w, sum_wlogw)
+
+    def get_classes(self):
+        ''' Return the classes of the Cells as list of rows (-1 = not collapsed).
+        '''
+        return [[cell.poss_mask.bit_length() - 1 if cell.entropy == 1 else -1 for cell in row]
+                for row in self.cell_arr]
@@ -0,0 +1,236 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Block-wise parallel generation of large maps:
+#
+#   python -m wfc_src large --size 4000 4000 --block 64 --jobs 64 --out map.wfcm
+#
+# The map is divided in blocks of block x block Cells. Every block is solved
+# by a Tiles Manager (worker process of a pool) in a window containing the
+# block and a ring of one Cell around it. The already solved Cells of the
+# ring are set with set_cell (border seeding), so the block connects to its
+# solved neighbors.
+#
+# The blocks are solved in four phases (by row and column parity). The
+# blocks of a phase are not neighbors, so they are solved concurrently:
+#
+#   +---+---+---+---+
+#   | 0 | 1 | 0 | 1 |   phase 0: free blocks (no solved neighbors)
+#   +---+---+---+---+   phase 1: seeded on left / right sides
+#   | 2 | 3 | 2 | 3 |   phase 2: seeded on top / bottom sides
+#   +---+---+---+---+   phase 3: seeded on all sides
+#   | 0 | 1 | 0 | 1 |
+#   +---+---+---+---+
+#
+# Seams: a block seeded on several sides can have no solution. The block is
+# then retried with another seed and, if it still fails, re-solved in a
+# larger window: the margin Cells of the neighbors around the block (block/4
+# Cells by default) are released and solved again together with the block,
+# the ring of the larger window is seeded. The windows of the blocks of the
+# same phase do not overlap (margin < block/2), so the reconciled seams
+# never conflict.
+#
+# The map is a uint16 array (see mapfile.py), with the output file map.wfcm
+# (or map.npy) it is memory-mapped: the blocks are written directly into
+# the file, the map is never held in memory (map.txt: text file).
+#-------------------------------------------------------------------------------
+""" Block-wise Parallel Generation Module. """
+
+import argparse
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from . import batch
+from .batch import ENGINES
+from .mapfile import NONE, create_map, get_meta, to_uint16
+
+def get_windows(core, release, bounds):
+    ''' Return the region (core expanded by release Cells) and the window
+    (region and its ring), both clipped to bounds. Rectangles: (y0, y1, x0, x1).
+    '''
+    y_0, y_1, x_0, x_1 = core
+    b_y0, b_y1, b_x0, b_x1 = bounds
+    region = (max(y_0 - release, b_y0), min(y_1 + release, b_y1),
+              max(x_0 - release, b_x0), min(x_1 + release, b_x1))
+    window = (max(region[0] - 1, b_y0), min(region[1] + 1, b_y1),
+              max(region[2] - 1, b_x0), min(region[3] + 1, b_x1))
+    return region, window
+
+def solve_block(task):
+    ''' Solve one block (in worker process).
+    task: (seed, core rectangle, patch origin (y, x), patch, margin, retries)
+    where patch is the part of the map around the block (-1 = not solved).
+    Return (region rectangle, Tiles of the region, valid, attempts).
+    '''
+    seed, core, (p_y, p_x), patch, margin, retries = task
+    tiles_man = batch.get_worker()
+    bounds = (p_y, p_y + patch.shape[0], p_x, p_x + patch.shape[1])
+    # first retries in the block window, then in the larger window
+    releases = [0] * retries + [margin] * retries
+    for attempt, release in enumerate(releases):
+        region, window = get_windows(core, release, bounds)
+        w_y0, w_y1, w_x0, w_x1 = window
+        tiles_man.seed(f'{seed}:{core[0]}:{core[2]}:{attempt}')
+        tiles_man.resize(w_y1 - w_y0, w_x1 - w_x0)
+
+        # border seeding: the solved Cells of the ring (and of the block,
+        # solved by the larger window of a neighbor)
+        for y_idx in range(w_y0, w_y1):
+            for x_idx in range(w_x0, w_x1):
+                tile = int(patch[y_idx - p_y, x_idx - p_x])
+                inside = (region[0] <= y_idx < region[1]) and (region[2] <= x_idx < region[3])
+                if tile >= 0 and (release == 0 or not inside):
+                    tiles_man.set_cell(y_idx - w_y0, x_idx - w_x0, tile)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            while tiles_man.next_step():
+                pass
+        tiles = np.asarray(tiles_man.get_tiles(), dtype=np.int32)
+        tiles = tiles[region[0] - w_y0:region[1] - w_y0, region[2] - w_x0:region[3] - w_x0]
+        if tiles_man.is_valid():
+            return region, tiles, True, attempt + 1
+    return region, tiles, False, len(releases)
+
+def get_phases(size, block):
+    ''' Return the cores (y0, y1, x0, x1) of all blocks, grouped in four phases.
+    '''
+    ty_out, tx_out = size
+    phases = [[], [], [], []]
+    for b_y, y_0 in enumerate(range(0, ty_out, block)):
+        for b_x, x_0 in enumerate(range(0, tx_out, block)):
+            core = (y_0, min(y_0 + block, ty_out), x_0, min(x_0 + block, tx_out))
+            phases[(b_y % 2) * 2 + (b_x % 2)].append(core)
+    return phases
+
+def check_map(grid, tiles_def, rows=1024):
+    ''' Return the number of not connected neighbor Cells (and not solved Cells)
+    of a map (uint16 array), checked in parts of rows.
+    '''
+    defs = np.asarray(tiles_def, dtype=np.int64)
+    bad = 0
+    for y_0 in range(0, grid.shape[0], rows):
+        # one more row for the connections to the next part
+        part = np.asarray(grid[y_0:y_0 + rows + 1])
+        bad += int((part[:rows] == NONE).sum())
+        tiles = defs[np.where(part == NONE, 0, part)]
+        bad += int((tiles[:rows, :-1, 1] != tiles[:rows, 1:, 3]).sum())
+        bad += int((tiles[:-1, :, 2] != tiles[1:, :, 0]).sum())
+    return bad
+
+def solve_large(engine, atlas, ty_cnt, tx_cnt, size, block=64, jobs=None, seed=0,
+                weights=None, margin=None, retries=2, verbose=False, out=None):
+    ''' Generate a large map block-wise in a pool of worker processes.
+    out - (H, W) uint16 array for the map (e.g. memory-mapped, see mapfile.create_map)
+    Return (map as (H, W) uint16 array of Tile indexes, number of invalid
+    blocks, number of blocks solved in the larger window).
+    '''
+    if margin is None:
+        margin = block // 4
+    if not 0 <= 2 * margin < block:
+        raise ValueError(f'Invalid margin {margin} (must be less than block / 2)')
+    if retries < 1:
+        raise ValueError(f'Invalid retries {retries} (must be at least 1)')
+
+    grid = np.full(size, NONE, dtype='<u2') if out is None else out
+    invalid = 0
+    reconciled = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=batch.init_worker,
+                             initargs=(engine, atlas, ty_cnt, tx_cnt, (block, block),
+                                       weights)) as pool:
+        for phase, cores in enumerate(get_phases(size, block)):
+            start = time.time()
+            futures = []
+            for core in cores:
+                # the part of the map which can be read by the block
+                _, patch_win = get_windows(core, margin, (0, size[0], 0, size[1]))
+                patch = grid[patch_win[0]:patch_win[1], patch_win[2]:patch_win[3]].astype(np.int32)
+                patch[patch == NONE] = -1
+                futures.append(pool.submit(solve_block, (seed, core, (patch_win[0], patch_win[2]),
+                                                         patch, margin, retries)))
+            # all patches of the phase are copied before the first result is written
+            for future in as_completed(futures):
+                region, tiles, valid, attempts = future.result()
+                grid[region[0]:region[1], region[2]:region[3]] = to_uint16(tiles)
+                invalid += (not valid)
+                reconciled += (attempts > retries)
+            if verbose:
+                print(f'Phase {phase}: {len(cores)} blocks in {time.time() - start:.2f}s')
+    return grid, invalid, reconciled
+
+def write_text(grid, filename, rows=1024):
+    ''' Write the map as text file (one line per row, Tile indexes separated
+    by spaces, -1 = not solved), in parts of rows.
+    '''
+    with open(filename, 'w', encoding='utf-8') as file:
+        for y_0 in range(0, grid.shape[0], rows):
+            part = np.asarray(grid[y_0:y_0 + rows]).astype(np.int32)
+            part[part == NONE] = -1
+            np.savetxt(file, part, fmt='%d', delimiter=' ')
+
+def main(argv):
+    ''' Parse command line arguments and generate a large map.
+    '''
+    parser = argparse.ArgumentParser(prog='python -m wfc_src large',
+                                     description='Block-wise parallel generation of a large map.')
+    batch.add_atlas_args(parser)
+    parser.add_argument('--size', type=int, nargs=2, default=(1024, 1024), metavar=('H', 'W'),
+                        help='map size (cells)')
+    parser.add_argument('--block', type=int, default=64, help='block size (cells)')
+    parser.add_argument('--margin', type=int, help='cells released around a failed block '
+                                                   '(default: block/4)')
+    parser.add_argument('--retries', type=int, default=2, help='attempts per window size')
+    parser.add_argument('--seed', type=int, default=0, help='seed')
+    parser.add_argument('--out', default='map.wfcm',
+                        help='output file: .wfcm / .npy (binary, memory-mapped) or .txt (text)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='backtrack',
+                        help='solver engine')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--check', action='store_true', help='check the connections of all Cells')
+    args = parser.parse_args(argv)
+
+    weights = batch.load_weights(args)
+    # the atlas (for the map description and the check)
+    tiles_man = batch.load_engine(args, 'list')
+    out = None
+    if not args.out.endswith('.txt'):
+        out = create_map(args.out, tuple(args.size),
+                         get_meta(tiles_man, args.seed, engine=args.engine, block=args.block))
+
+    start = time.time()
+    grid, invalid, reconciled = solve_large(args.engine, os.path.abspath(args.atlas),
+                                            args.rows, args.cols, tuple(args.size),
+                                            args.block, args.jobs, args.seed, weights,
+                                            args.margin, args.retries, verbose=True, out=out)
+    total = time.time() - start
+    print(f'Generated {args.size[0]}x{args.size[1]} cells in {total:.2f}s '
+          f'({grid.size / total:.0f} cells/s), {reconciled} blocks reconciled, '
+          f'{invalid} invalid blocks')
+    if out is None:
+        write_text(grid, args.out)
+    else:
+        grid.flush()
+    print('Map written to', args.out)
+
+    if args.check:
+        bad = check_map(grid, tiles_man.tiles_def)
+        print('Not connected cells:', bad)
+        return 1 if bad else 0
+    return 1 if invalid else 0
@@ -0,0 +1,81 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Atlas cache:
+# Decoding a Tiles atlas (extracting, flipping and rotating every Tile and
+# reading its markers) is slow compared to generating a small map. The
+# decoded Tiles definitions, the colors dictionary and the tables derived
+# from them (see TilesManager.CACHED) are stored in a cache file and loaded
+# in one read on the next runs.
+#
+# The cache file name is the hash of the atlas file content and of the
+# decode parameters, a modified atlas gets a new cache file:
+#
+#   <cache_dir>/<sha1(atlas content + parameters)>.pickle
+#
+# The cache directory is ~/.cache/wfc, it can be changed with the
+# environment variable WFC_CACHE_DIR (an empty value disables the cache).
+#-------------------------------------------------------------------------------
+""" Atlas Cache Module. """
+
+import hashlib
+import os
+import pickle
+
+# Increment if the format of the cached data changes
+CACHE_VERSION = 2
+
+def cache_dir():
+    ''' Return the cache directory ('' = cache disabled).
+    '''
+    return os.environ.get('WFC_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'wfc'))
+
+def atlas_key(filename, params):
+    ''' Return the cache key of an atlas file decoded with params (tuple).
+    '''
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        sha.update(file.read())
+    sha.update(repr((CACHE_VERSION, params)).encode())
+    return sha.hexdigest()
+
+def load(key):
+    ''' Return the cached data (dictionary) or None if not in cache.
+    '''
+    if not cache_dir():
+        return None
+    try:
+        with open(os.path.join(cache_dir(), key + '.pickle'), 'rb') as file:
+            return pickle.load(file)
+    except (OSError, pickle.PickleError, EOFError):
+        return None
+
+def save(key, data):
+    ''' Store data (dictionary) in cache. The cache is optional, errors are ignored.
+    '''
+    if not cache_dir():
+        return
+    filename = os.path.join(cache_dir(), key + '.pickle')
+    # write to a temporary file first, parallel workers may read the same file
+    tmp_name = f'{filename}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(tmp_name, 'wb') as file:
+            pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, filename)
+    except OSError:
+        pass
@@ -0,0 +1,279 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Checkpoints:
+# Save the full solver state of a Tiles Manager during a long generation and
+# resume exactly from it (the same steps and the same result as without
+# interruption):
+#
+#   checkpointer = Checkpointer(tiles_man, 'run.wfck', interval=60)
+#   checkpointer.generate()         # saves a checkpoint every 60 seconds
+#
+#   load_checkpoint(tiles_man, 'run.wfck')      # after a crash: resume
+#   Checkpointer(tiles_man, 'run.wfck').generate()
+#
+#   python -m wfc_src solve --size 1000 1000 --checkpoint run.wfck --out map.wfcm
+#
+# The pre-constraints of a level template (see constraints.py) are applied
+# once at the start, then they are part of the saved state.
+#
+# The state consists of:
+#   rows    the Cells, one bytes object per row (see get_state_rows of the
+#           engines: possibilities, flags, weights sums)
+#   state   the other attributes of the solver (see STATE of the engines),
+#           the state of its random generator
+#   logs    lists which change only at their end (see LOGS, e.g. the trail of
+#           the backtracking engine)
+# The entropy index is not saved, it is rebuilt from the Cells.
+#
+# The checkpoint file is a sequence of records:
+#
+#   magic b'WFCK', kind (1 byte), length, CRC-32 (uint32), zlib(pickle(data))
+#
+# The first record is a full checkpoint, the next ones are deltas: only the
+# rows changed since the previous checkpoint and the new end of the logs
+# (the common begin of a log is found by object identity, the entries are
+# immutable tuples). A record is appended and flushed, an interrupted write
+# leaves an incomplete last record which is ignored when loading. When the
+# deltas are larger than the full checkpoint, the file is rewritten with a
+# new full checkpoint (written to a temporary file, then replaced).
+#-------------------------------------------------------------------------------
+""" Solver Checkpoint Module. """
+
+import argparse
+import contextlib
+import io
+import os
+import pickle
+import struct
+import time
+import zlib
+
+MAGIC = b'WFCK'
+VERSION = 3
+# Record kinds
+FULL = 0
+DELTA = 1
+# Record header: magic, kind, data length, CRC-32 of the data
+HEADER = struct.Struct('<4sBII')
+
+def get_ident(tiles_man):
+    ''' Return the identification of a solver (engine, size, Tiles classes),
+    a checkpoint can be loaded only by an identical solver.
+    '''
+    return {'engine': type(tiles_man).__name__, 'size': (tiles_man.ty_out, tiles_man.tx_out),
+            'classes': zlib.crc32(repr(tiles_man.class_def).encode())}
+
+def common_length(old, new):
+    ''' Return the length of the common begin of two lists (same objects).
+    The entries after a change are all new objects, the binary search is valid.
+    '''
+    low, high = 0, min(len(old), len(new))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[mid - 1] is new[mid - 1]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+def write_record(file, kind, data):
+    ''' Write a record, return its size.
+    '''
+    payload = zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 1)
+    file.write(HEADER.pack(MAGIC, kind, len(payload), zlib.crc32(payload)) + payload)
+    return HEADER.size + len(payload)
+
+def read_records(filename):
+    ''' Yield (kind, data) of the complete records of a checkpoint file.
+    '''
+    with open(filename, 'rb') as file:
+        while True:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            magic, kind, length, crc = HEADER.unpack(header)
+            payload = file.read(length)
+            if magic != MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                # incomplete (interrupted) record
+                return
+            yield kind, pickle.loads(zlib.decompress(payload))
+
+def load_checkpoint(tiles_man, filename):
+    ''' Restore the solver state of tiles_man (engine and Tiles loaded, any
+    size) from a checkpoint file. Return the number of records read.
+    '''
+    rows = None
+    logs = {}
+    state = None
+    records = 0
+    for kind, data in read_records(filename):
+        if kind == FULL:
+            if data['version'] != VERSION:
+                raise ValueError(f'Unsupported checkpoint version: {data["version"]}')
+            tiles_man.ty_out, tiles_man.tx_out = data['ident']['size']
+            if data['ident'] != get_ident(tiles_man):
+                raise ValueError(f'Checkpoint of another solver: {data["ident"]}')
+            rows = list(data['rows'])
+            logs = data['logs']
+        elif rows is not None:
+            for y_idx, row in data['rows'].items():
+                rows[y_idx] = row
+            for name, (start, entries) in data['logs'].items():
+                logs[name] = logs[name][:start] + entries
+        state = data['state']
+        records += 1
+    if rows is None:
+        raise ValueError(f'No checkpoint in {filename}')
+
+    # derived tables of the size (the random state is restored by set_state)
+    tiles_man.clear()
+    tiles_man.set_state_rows(rows)
+    tiles_man.set_state(state)
+    for name in tiles_man.LOGS:
+        setattr(tiles_man, name, logs[name])
+    return records
+
+# ##############################################################################
+class Checkpointer:
+    """ Periodic checkpoints of the solver state of a Tiles Manager """
+
+    def __init__(self, tiles_man, filename, interval=60.0):
+        """ Init Checkpointer
+            tiles_man - Tiles Manager to be saved
+            filename - checkpoint file
+            interval - min. time between two checkpoints (s)
+        """
+        self.tiles_man = tiles_man
+        self.filename = filename
+        self.interval = interval
+        self.next_save = time.perf_counter() + interval
+        # the last saved state (to write only the changes)
+        self.rows = None
+        self.logs = {}
+        self.full_size = 0
+        self.delta_size = 0
+        # statistics
+        self.saves = 0
+        self.save_time = 0.0
+        self.written = 0
+
+    def save(self):
+        ''' Save a checkpoint (full or delta).
+        '''
+        start = time.perf_counter()
+        tiles_man = self.tiles_man
+        rows = tiles_man.get_state_rows()
+        logs = {name: list(getattr(tiles_man, name)) for name in tiles_man.LOGS}
+
+        if self.rows is None or len(rows) != len(self.rows) or self.delta_size > self.full_size:
+            data = {'version': VERSION, 'ident': get_ident(tiles_man), 'rows': rows,
+                    'logs': logs, 'state': tiles_man.get_state()}
+            temp = self.filename + '.tmp'
+            with open(temp, 'wb') as file:
+                size = write_record(file, FULL, data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp, self.filename)
+            self.full_size, self.delta_size = size, 0
+        else:
+            changed = {y_idx: row for y_idx, (row, old) in enumerate(zip(rows, self.rows))
+                       if row != old}
+            log_delta = {}
+            for name, entries in logs.items():
+                start_idx = common_length(self.logs[name], entries)
+                log_delta[name] = (start_idx, entries[start_idx:])
+            data = {'rows': changed, 'logs': log_delta, 'state': tiles_man.get_state()}
+            with open(self.filename, 'ab') as file:
+                size = write_record(file, DELTA, data)
+                file.flush()
+                os.fsync(file.fileno())
+            self.delta_size += size
+
+        self.rows = rows
+        self.logs = logs
+        self.saves += 1
+        self.written += size
+        self.save_time += time.perf_counter() - start
+        self.next_save = time.perf_counter() + self.interval
+
+    def generate(self):
+        ''' Generate (next_step until finished), save a checkpoint every interval.
+        '''
+        tiles_man = self.tiles_man
+        while tiles_man.next_step():
+            if time.perf_counter() >= self.next_save:
+                self.save()
+
+    def remove(self):
+        ''' Remove the checkpoint file (the generation is finished).
+        '''
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+def main(argv):
+    ''' Parse command line arguments and generate one map with checkpoints.
+    '''
+    from . import batch  # pylint: disable=import-outside-toplevel
+    from . import mapfile  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(prog='python -m wfc_src solve',
+                                     description='Generate one map, with checkpoints (resumable).')
+    batch.add_atlas_args(parser)
+    parser.add_argument('--size', type=int, nargs=2, default=(256, 256), metavar=('H', 'W'),
+                        help='map size (cells)')
+    parser.add_argument('--seed', type=int, default=0, help='seed')
+    parser.add_argument('--engine', choices=sorted(batch.ENGINES), default='backtrack',
+                        help='solver engine')
+    parser.add_argument('--template', help='map of pinned Tiles (.wfcm, .npy, .txt; '
+                                           'not collapsed / -1 = free Cell)')
+    parser.add_argument('--checkpoint', default='solve.wfck',
+                        help='checkpoint file (resumed if it exists)')
+    parser.add_argument('--interval', type=float, default=60.0, help='seconds between checkpoints')
+    parser.add_argument('--out', default='map.wfcm', help='output map file (.wfcm, .npy)')
+    args = parser.parse_args(argv)
+
+    tiles_man = batch.load_engine(args, size=args.size)
+    if os.path.exists(args.checkpoint):
+        records = load_checkpoint(tiles_man, args.checkpoint)
+        print(f'Resumed from {args.checkpoint} ({records} records)')
+    else:
+        tiles_man.seed(args.seed)
+        tiles_man.clear()
+        if args.template:
+            from .constraints import constrain  # pylint: disable=import-outside-toplevel
+            from .mapimage import load_tiles  # pylint: disable=import-outside-toplevel
+            report = constrain(tiles_man, tiles=load_tiles(args.template)[0])
+            print(f'Template: {report["pinned"]} pinned Cells, {report["reduced"]} Cells '
+                  f'constrained in {report["time"]:.2f}s')
+            if not report['feasible']:
+                print(f'Infeasible template, {len(report["conflicts"])} Cells without possibility:',
+                      report['conflicts'][:10])
+                print('Neighbor Cells which cannot be connected:', report['pair_conflicts'][:10])
+                return 1
+
+    checkpointer = Checkpointer(tiles_man, args.checkpoint, args.interval)
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        checkpointer.generate()
+    total = time.time() - start
+    print(f'Generated {args.size[0]}x{args.size[1]} cells in {total:.2f}s, '
+          f'{checkpointer.saves} checkpoints in {checkpointer.save_time:.2f}s '
+          f'({checkpointer.written / 1024:.0f} KB written)')
+    mapfile.save_map(args.out, tiles_man.get_tiles(), mapfile.get_meta(tiles_man, args.seed))
+    checkpointer.remove()
+    print('Map written to', args.out)
+    return 0 if tiles_man.is_valid() else 1
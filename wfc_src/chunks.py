@@ -0,0 +1,159 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Chunk cache:
+# LRU cache of solved chunks (the classes of the not collapsed Cells of a
+# grid), keyed by their boundary constraints:
+#
+#   tiles_man.set_chunk_cache(ChunkCache(max_size=1024, seed_classes=4))
+#   tiles_man.generate()            # drops in a cached chunk, if any
+#   print(tiles_man.chunk_cache.get_stats())
+#
+# The key of a grid is computed from the not collapsed Cells (the chunk) and
+# the edges of their collapsed neighbors facing them:
+#
+#   chunk Cell (y, x) -> (y, x, T, R, B, L)     edge of the neighbor above
+#                                               (its B), right (its L), ...
+#                                               -1 = no collapsed neighbor
+#
+# plus the possibilities (classes bitmask) of every chunk Cell, the grid size
+# and a seed class. Only the edges are used (not the classes), so all
+# boundaries allowing the same Tiles give the same key. The possibilities
+# keep the Cells already reduced (e.g. allowed Tiles, see constraints.py) out
+# of the solutions of less constrained chunks.
+# The seed class is a random number in range(seed_classes) chosen for every
+# generate (by the random generator of the solver): the same boundary has up
+# to seed_classes different cached solutions (1 = always the same solution
+# for the same boundary).
+#
+# On a hit, the cached classes are set with set_class (they fit the boundary,
+# the possibilities and each other), the solver only processes the collapsed
+# Cells: no collapse, no contradiction, no backtracking. The Tiles of the
+# classes are picked as usual (see pick_tile). On a miss, the grid is solved
+# and the solution is stored if it is valid (no deadend, all neighbor Cells
+# connected, see is_valid). The cache belongs to one set of Tiles
+# definitions (class_def); it is not shared between processes.
+#-------------------------------------------------------------------------------
+""" Chunk Cache Module. """
+
+import array
+import hashlib
+from collections import OrderedDict
+
+# ##############################################################################
+class ChunkCache:
+    """ LRU cache of solved chunks keyed by boundary constraints """
+
+    def __init__(self, max_size=1024, seed_classes=1):
+        """ Init Chunk Cache
+            max_size - max. number of cached chunks (least recently used are evicted)
+            seed_classes - number of different solutions per boundary
+        """
+        if max_size < 1 or seed_classes < 1:
+            raise ValueError('max_size and seed_classes must be at least 1')
+        self.max_size = max_size
+        self.seed_classes = seed_classes
+        self.chunks = OrderedDict()     # key -> classes of the chunk Cells (array)
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def clear(self):
+        ''' Remove all cached chunks (the statistics are kept).
+        '''
+        self.chunks.clear()
+
+    def get(self, key):
+        ''' Return the classes of a cached chunk (None = not cached).
+        '''
+        classes = self.chunks.get(key)
+        if classes is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.chunks.move_to_end(key)
+        return classes
+
+    def put(self, key, classes):
+        ''' Store the classes of a solved chunk.
+        '''
+        self.chunks[key] = array.array('i', classes)
+        self.chunks.move_to_end(key)
+        self.stores += 1
+        while len(self.chunks) > self.max_size:
+            self.chunks.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self):
+        ''' Return the statistics (dictionary).
+        '''
+        lookups = self.hits + self.misses
+        return {'size': len(self.chunks), 'max_size': self.max_size,
+                'seed_classes': self.seed_classes, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'stores': self.stores, 'evictions': self.evictions}
+
+    def get_key(self, tiles_man, classes, masks):
+        ''' Return (key, chunk Cells) of a grid (classes: rows of Tiles classes,
+        -1 = not collapsed, masks: rows of possibilities bitmasks), see the
+        module description.
+        '''
+        class_def = tiles_man.class_def
+        size = (len(class_def) + 7) // 8
+        ty_out = len(classes)
+        tx_out = len(classes[0]) if ty_out else 0
+        cells = []
+        possible = bytearray()
+        codes = array.array('i', (ty_out, tx_out, tiles_man.random.randrange(self.seed_classes)))
+        for y_idx, row in enumerate(classes):
+            for x_idx, class_idx in enumerate(row):
+                if class_idx >= 0:
+                    continue
+                cells.append((y_idx, x_idx))
+                possible += masks[y_idx][x_idx].to_bytes(size, 'little')
+                top = classes[y_idx - 1][x_idx] if y_idx > 0 else -1
+                right = row[x_idx + 1] if x_idx + 1 < tx_out else -1
+                bottom = classes[y_idx + 1][x_idx] if y_idx + 1 < ty_out else -1
+                left = row[x_idx - 1] if x_idx > 0 else -1
+                codes.extend((y_idx, x_idx,
+                              class_def[top][2] if top >= 0 else -1,
+                              class_def[right][3] if right >= 0 else -1,
+                              class_def[bottom][0] if bottom >= 0 else -1,
+                              class_def[left][1] if left >= 0 else -1))
+        # the boundaries of large chunks are long, the key is their digest
+        return hashlib.blake2b(codes.tobytes() + possible, digest_size=16).digest(), cells
+
+    def solve(self, tiles_man):
+        ''' Solve the not collapsed Cells of a Tiles Manager, drop in the
+        cached chunk of the same boundary or store the new solution.
+        '''
+        key, cells = self.get_key(tiles_man, tiles_man.get_classes(), tiles_man.get_masks())
+        cached = self.get(key) if cells else None
+        if cached is not None:
+            for (y_idx, x_idx), class_idx in zip(cells, cached):
+                tiles_man.set_class(y_idx, x_idx, class_idx)
+        while tiles_man.next_step():
+            pass
+        if cells and cached is None and tiles_man.is_valid():
+            classes = tiles_man.get_classes()
+            solved = [classes[y_idx][x_idx] for y_idx, x_idx in cells]
+            if min(solved) >= 0:
+                self.put(key, solved)
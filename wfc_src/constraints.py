@@ -0,0 +1,195 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Pre-constraints:
+# Pin many Cells (borders, roads, pre-placed rooms of a level template) at
+# once, before the first collapse:
+#
+#   tiles_man.clear()
+#   report = constrain(tiles_man, tiles=template)      # -1 = free Cell
+#   report = constrain(tiles_man, allowed={(0, 5): [3, 4, 7]})
+#   if not report['feasible']:
+#       print(report['conflicts'])
+#
+#   python -m wfc_src solve --size 256 256 --template level.wfcm --out map.wfcm
+#
+# Constraints:
+#   tiles     pinned Tiles, (H, W) array or list of rows of Tile indexes,
+#             -1 or mapfile.NONE = free Cell (or mask: True = pinned Cell),
+#             or dictionary {(y, x): Tile}
+#   allowed   allowed Tiles per Cell, dictionary {(y, x): Tiles}
+#
+# The solver works with Tiles classes (see tilesman.py): an allowed Tile
+# allows its class, the pinned Tiles are kept in the map and the Tiles of
+# the Cells with allowed Tiles are picked only among them (see pick_tile).
+#
+# The constraints are applied in bulk to bitmasks of classes (one int per
+# constrained Cell), then propagated once to a fixed point (worklist, every
+# Cell whose possibilities changed is processed again):
+#
+#   queue = constrained Cells
+#   while queue:
+#       cell = queue.pop()
+#       for every neighbor: neighbor &= allowed(direction, cell)
+#                           changed -> queue.append(neighbor)
+#
+# Only the Cells reached by the propagation are stored (dictionary), the
+# free Cells far from the constraints keep all possibilities. The result is
+# set in the solver (set_masks of the engines) as if it had propagated the
+# constraints itself: the first step is the first random collapse.
+#
+# A Cell left without possibility makes the constraints infeasible: the
+# solver is not changed and the report lists the Cells without possibility
+# and the pairs of neighbor constrained Cells which cannot be connected.
+#-------------------------------------------------------------------------------
+""" Pre-constraints Module. """
+
+import time
+
+from .bitset import get_dir_masks
+from .mapfile import NONE
+
+# Neighbors: (y_rel, x_rel) in the order of the directions (top, right, bottom, left)
+NEIGHBORS = ((-1, 0), (0, 1), (1, 0), (0, -1))
+
+def allowed_mask(dir_masks, dir_idx, mask):
+    ''' Return the mask of classes which can be connected in direction dir_idx
+    to a Cell with the possibilities mask (see BitsetTilesManager.allowed_mask).
+    '''
+    allowed = 0
+    for edge_mask, nb_mask in dir_masks[dir_idx]:
+        if mask & edge_mask:
+            allowed |= nb_mask
+    return allowed
+
+def get_pinned(tiles, mask=None):
+    ''' Return the pinned Tiles {(y, x): Tile} of an array (list of rows or
+    dictionary), see the module description.
+    '''
+    if isinstance(tiles, dict):
+        return {(int(y_idx), int(x_idx)): int(tile) for (y_idx, x_idx), tile in tiles.items()}
+    pinned = {}
+    for y_idx, row in enumerate(tiles):
+        row = row.tolist() if hasattr(row, 'tolist') else row
+        for x_idx, tile in enumerate(row):
+            if (tile >= 0 and tile != NONE) if mask is None else mask[y_idx][x_idx]:
+                pinned[(y_idx, x_idx)] = tile
+    return pinned
+
+def get_masks(tiles_man, pinned, allowed):
+    ''' Return the class bitmasks {(y, x): mask} of the constrained Cells.
+    '''
+    tile_class = tiles_man.tile_class
+    tiles_cnt = len(tile_class)
+    masks = {}
+    for (y_idx, x_idx), tiles in [(pos, (tile,)) for pos, tile in pinned.items()] + \
+                                 list((allowed or {}).items()):
+        if not (0 <= y_idx < tiles_man.ty_out and 0 <= x_idx < tiles_man.tx_out):
+            raise ValueError(f'Cell ({y_idx}, {x_idx}) outside of the map '
+                             f'{tiles_man.ty_out}x{tiles_man.tx_out}')
+        mask = 0
+        for tile in tiles:
+            if not 0 <= tile < tiles_cnt:
+                raise ValueError(f'Invalid Tile {tile} of Cell ({y_idx}, {x_idx})')
+            mask |= 1 << tile_class[tile]
+        # a Cell pinned and restricted: both constraints
+        masks[(y_idx, x_idx)] = masks.get((y_idx, x_idx), mask) & mask
+    return masks
+
+def propagate(masks, dir_masks, full, size):
+    ''' Propagate the constraints (masks, changed in place) to a fixed point.
+    Return the number of processed Cells.
+    '''
+    ty_out, tx_out = size
+    # allowed neighbor masks, memoized per direction (few different masks)
+    allowed = [{}, {}, {}, {}]
+    queue = list(masks)
+    queued = set(queue)
+    processed = 0
+    while queue:
+        y_idx, x_idx = queue.pop()
+        queued.discard((y_idx, x_idx))
+        mask = masks[(y_idx, x_idx)]
+        # a Cell without possibility does not constrain its neighbors
+        if mask == 0:
+            continue
+        processed += 1
+        for dir_idx, (y_rel, x_rel) in enumerate(NEIGHBORS):
+            y_nb, x_nb = y_idx + y_rel, x_idx + x_rel
+            if not (0 <= y_nb < ty_out and 0 <= x_nb < tx_out):
+                continue
+            nb_allowed = allowed[dir_idx].get(mask)
+            if nb_allowed is None:
+                nb_allowed = allowed[dir_idx][mask] = allowed_mask(dir_masks, dir_idx, mask)
+            nb_old = masks.get((y_nb, x_nb), full)
+            nb_new = nb_old & nb_allowed
+            if nb_new != nb_old:
+                masks[(y_nb, x_nb)] = nb_new
+                if nb_new and (y_nb, x_nb) not in queued:
+                    queued.add((y_nb, x_nb))
+                    queue.append((y_nb, x_nb))
+    return processed
+
+def get_pair_conflicts(dir_masks, constrained):
+    ''' Return the pairs of neighbor constrained Cells which cannot be connected.
+    '''
+    pairs = []
+    for (y_idx, x_idx), mask in constrained.items():
+        # right and bottom neighbors (every pair once)
+        for dir_idx in (1, 2):
+            y_nb, x_nb = y_idx + NEIGHBORS[dir_idx][0], x_idx + NEIGHBORS[dir_idx][1]
+            nb_mask = constrained.get((y_nb, x_nb))
+            if mask and nb_mask and not allowed_mask(dir_masks, dir_idx, mask) & nb_mask:
+                pairs.append(((y_idx, x_idx), (y_nb, x_nb)))
+    return pairs
+
+def constrain(tiles_man, tiles=None, allowed=None, mask=None):
+    ''' Apply the constraints to a cleared solver (Tiles loaded) and propagate
+    them, see the module description. Return the report (dictionary), the
+    solver is not changed if the constraints are infeasible.
+    '''
+    start = time.perf_counter()
+    size = (tiles_man.ty_out, tiles_man.tx_out)
+    if tiles is not None and not isinstance(tiles, dict):
+        shape = (len(tiles), len(tiles[0]) if len(tiles) else 0)
+        if shape != size:
+            raise ValueError(f'Constraints of another size than the map {size[0]}x{size[1]}')
+    pinned = get_pinned(tiles, mask) if tiles is not None else {}
+    masks = get_masks(tiles_man, pinned, allowed)
+    constrained = dict(masks)
+    dir_masks = get_dir_masks(tiles_man.class_def)
+    full = (1 << len(tiles_man.class_def)) - 1
+    processed = propagate(masks, dir_masks, full, size)
+    conflicts = sorted(pos for pos, cell_mask in masks.items() if cell_mask == 0)
+
+    report = {'pinned': len(pinned), 'constrained': len(constrained),
+              'reduced': sum(1 for cell_mask in masks.values() if cell_mask != full),
+              'collapsed': sum(1 for cell_mask in masks.values()
+                               if cell_mask and not cell_mask & (cell_mask - 1)),
+              'processed': processed, 'feasible': not conflicts,
+              'conflicts': conflicts}
+    if conflicts:
+        report['pair_conflicts'] = get_pair_conflicts(dir_masks, constrained)
+    else:
+        for (y_idx, x_idx), tile in pinned.items():
+            tiles_man.pinned[(y_idx + tiles_man.row_offset, x_idx)] = tile
+        for (y_idx, x_idx), cell_tiles in (allowed or {}).items():
+            tiles_man.allowed[(int(y_idx) + tiles_man.row_offset, int(x_idx))] = \
+                frozenset(int(tile) for tile in cell_tiles)
+        tiles_man.set_masks({pos: cell_mask for pos, cell_mask in masks.items()
+                             if cell_mask != full})
+    report['time'] = round(time.perf_counter() - start, 4)
+    return report
@@ -0,0 +1,142 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Map file:
+# Binary file of the Tile indexes of a generated map (2 bytes per Cell):
+#
+#   offset  size
+#   0       4       magic b'WFCM'
+#   4       2       format version (little-endian uint16)
+#   6       4       header length N (little-endian uint32)
+#   10      N       header: JSON (utf-8), padded with spaces to a data
+#                   offset multiple of 16
+#   10+N    H*W*2   Tile indexes, little-endian uint16, row by row
+#                   (0xFFFF = not collapsed Cell)
+#
+# The header contains the map size (height, width) and the description of
+# the map: atlas file names and SHA-1 of their content, number of Tiles,
+# engine, seed (see get_meta).
+#
+#   save_map('map.wfcm', tiles, get_meta(tiles_man, seed))
+#   tiles, meta = load_map('map.wfcm', mmap=True)
+#
+# create_map returns a writable memory-mapped array of a new map file, the
+# map can be written directly into the file (e.g. block by block) without
+# holding it in memory. Files with the extension .npy are written in numpy
+# format instead (uint16, without the header description).
+#-------------------------------------------------------------------------------
+""" Map File Module. """
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'WFCM'
+VERSION = 1
+# Tile index of the not collapsed Cells
+NONE = 0xFFFF
+
+def file_sha1(filename):
+    ''' Return the SHA-1 (hex) of a file content.
+    '''
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        sha.update(file.read())
+    return sha.hexdigest()
+
+def get_meta(tiles_man, seed=None, **extra):
+    ''' Return the description of a map generated by tiles_man.
+    '''
+    meta = {
+        'atlas': [os.path.basename(name) for name in tiles_man.atlas_files],
+        'atlas_sha1': [file_sha1(name) for name in tiles_man.atlas_files],
+        'tiles': len(tiles_man.tiles_def),
+        'engine': type(tiles_man).__name__,
+        'seed': seed,
+    }
+    meta.update(extra)
+    return meta
+
+def to_uint16(tiles):
+    ''' Return the Tile indexes (array or list of rows, -1 = not collapsed) as uint16 array.
+    '''
+    tiles = np.asarray(tiles)
+    if tiles.size and tiles.max() >= NONE:
+        raise ValueError(f'Too many Tiles for the map file (max. {NONE - 1})')
+    return np.where(tiles < 0, NONE, tiles).astype('<u2')
+
+def write_header(file, shape, meta):
+    ''' Write the header of a map file, return the data offset.
+    '''
+    header = dict(meta or {}, height=int(shape[0]), width=int(shape[1]), dtype='<u2')
+    text = json.dumps(header).encode('utf-8')
+    text += b' ' * (-(10 + len(text)) % 16)
+    file.write(MAGIC + struct.pack('<HI', VERSION, len(text)) + text)
+    return 10 + len(text)
+
+def read_header(file):
+    ''' Read the header of a map file, return (header, data offset).
+    '''
+    start = file.read(10)
+    if len(start) != 10 or start[:4] != MAGIC:
+        raise ValueError('Not a map file')
+    version, length = struct.unpack('<HI', start[4:])
+    if version != VERSION:
+        raise ValueError(f'Unsupported map file version: {version}')
+    return json.loads(file.read(length).decode('utf-8')), 10 + length
+
+def save_map(filename, tiles, meta=None):
+    ''' Write the map (Tile indexes, array or list of rows) to a map file.
+    '''
+    data = to_uint16(tiles)
+    if filename.endswith('.npy'):
+        np.save(filename, data)
+        return
+    with open(filename, 'wb') as file:
+        write_header(file, data.shape, meta)
+        file.write(data.tobytes())
+
+def create_map(filename, shape, meta=None):
+    ''' Create a map file of shape (height, width) with all Cells not collapsed,
+    return its writable memory-mapped uint16 array.
+    '''
+    if filename.endswith('.npy'):
+        data = np.lib.format.open_memmap(filename, mode='w+', dtype='<u2', shape=tuple(shape))
+    else:
+        with open(filename, 'wb') as file:
+            offset = write_header(file, shape, meta)
+            file.truncate(offset + shape[0] * shape[1] * 2)
+        data = np.memmap(filename, dtype='<u2', mode='r+', offset=offset, shape=tuple(shape))
+    data[:] = NONE
+    return data
+
+def load_map(filename, mmap=False):
+    ''' Read a map file, return (uint16 array of Tile indexes, header).
+    With mmap the array is memory-mapped (read-only), not read in memory.
+    '''
+    if filename.endswith('.npy'):
+        data = np.load(filename, mmap_mode='r' if mmap else None)
+        return data, {'height': data.shape[0], 'width': data.shape[1], 'dtype': '<u2'}
+    with open(filename, 'rb') as file:
+        header, offset = read_header(file)
+        shape = (header['height'], header['width'])
+        if not mmap:
+            data = np.fromfile(file, dtype='<u2', count=shape[0] * shape[1]).reshape(shape)
+            return data, header
+    return np.memmap(filename, dtype='<u2', mode='r', offset=offset, shape=shape), header
@@ -0,0 +1,239 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Off-screen map image:
+# Renders a map of Tile indexes (e.g. a memory-mapped map file, see
+# mapfile.py) to a PNG image of any size, without a display surface:
+#
+#   python -m wfc_src render map.wfcm --out map.png
+#
+#   save_png('map.png', tiles, tiles_man.tiles_img)
+#
+# The image is composed in horizontal strips of map rows. Every strip is
+# encoded (zlib) and written to the file before the next one is composed,
+# the memory is bounded by the strip size (STRIP_BYTES), not by the map size:
+#
+#   +---------------------+
+#   | strip 0 (rows 0..n) |  -> composed, compressed, written, dropped
+#   +---------------------+
+#   | strip 1             |
+#   +---------------------+
+#   | ...                 |
+#
+# The Tile images (pygame surfaces) are converted to pixel arrays once, when
+# a Tile is used the first time, every Cell of a strip is then only a copy
+# of its Tile pixels (numpy indexing).
+#-------------------------------------------------------------------------------
+""" Off-screen Map Image Module. """
+
+import argparse
+import struct
+import time
+import zlib
+
+import numpy as np
+
+# Max. size of a strip (pixels of the composed map rows)
+STRIP_BYTES = 64 * 1024 * 1024
+# Max. size of a PNG IDAT chunk
+CHUNK_BYTES = 1024 * 1024
+
+# ##############################################################################
+class PngWriter:
+    """ PNG file (RGB, 8 bits) written row by row """
+
+    def __init__(self, filename, width, height, level=6):
+        """ Init PNG Writer
+            filename - PNG file name or binary file object (not closed)
+            width, height - image size (pixels)
+            level - zlib compression level
+        """
+        self.width = width
+        self.height = height
+        self.written = 0
+        self.compressor = zlib.compressobj(level)
+        self.pending = []       # compressed data not written yet
+        self.pending_len = 0
+        self.own_file = not hasattr(filename, 'write')
+        if self.own_file:
+            filename = open(filename, 'wb')  # pylint: disable=consider-using-with
+        self.file = filename
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bits, color type 2 (RGB), default compression, filter and no interlace
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_chunk(self, name, data):
+        ''' Write a PNG chunk.
+        '''
+        self.file.write(struct.pack('>I', len(data)) + name + data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(name))))
+
+    def flush_data(self):
+        ''' Write the pending compressed data as IDAT chunk.
+        '''
+        if self.pending_len:
+            self.write_chunk(b'IDAT', b''.join(self.pending))
+            self.pending = []
+            self.pending_len = 0
+
+    def write_rows(self, pixels):
+        ''' Append rows of pixels, uint8 array (rows, width, 3).
+        '''
+        rows = pixels.shape[0]
+        if pixels.shape[1:] != (self.width, 3) or self.written + rows > self.height:
+            raise ValueError(f'Invalid rows {pixels.shape} for image {self.width}x{self.height}')
+        # every row starts with its filter type (0 = none)
+        lines = np.zeros((rows, 1 + self.width * 3), dtype=np.uint8)
+        lines[:, 1:] = pixels.reshape(rows, -1)
+        data = self.compressor.compress(lines.tobytes())
+        self.written += rows
+        if data:
+            self.pending.append(data)
+            self.pending_len += len(data)
+            if self.pending_len >= CHUNK_BYTES:
+                self.flush_data()
+
+    def close(self):
+        ''' Finish the image and close the file.
+        '''
+        if self.file is None:
+            return
+        try:
+            if self.written != self.height:
+                raise ValueError(f'Incomplete image: {self.written} of {self.height} rows')
+            self.pending.append(self.compressor.flush())
+            self.pending_len += len(self.pending[-1])
+            self.flush_data()
+            self.write_chunk(b'IEND', b'')
+        finally:
+            if self.own_file:
+                self.file.close()
+            self.file = None
+
+# ##############################################################################
+class MapRenderer:
+    """ Composes the image of a map of Tile indexes, strip by strip """
+
+    def __init__(self, tiles_img, background=(0, 0, 0)):
+        """ Init Map Renderer
+            tiles_img - Tiles images (pygame surfaces, all of the same size)
+            background - color of the not collapsed Cells
+        """
+        if not tiles_img:
+            raise ValueError('No Tiles images')
+        self.tiles_img = tiles_img
+        self.tile_w, self.tile_h = tiles_img[0].get_size()
+        # pixels of every Tile (converted when used), the last one: not collapsed Cell
+        count = len(tiles_img)
+        self.pixels = np.empty((count + 1, self.tile_h, self.tile_w, 3), dtype=np.uint8)
+        self.pixels[count] = background
+        self.converted = np.zeros(count + 1, dtype=bool)
+        self.converted[count] = True
+
+    def get_indexes(self, tiles):
+        ''' Return the indexes of the pixels of a part of a map (Tile indexes,
+        -1 or mapfile.NONE = not collapsed).
+        '''
+        tiles = np.asarray(tiles, dtype=np.int64)
+        count = len(self.tiles_img)
+        return np.where((tiles < 0) | (tiles >= count), count, tiles)
+
+    def convert(self, indexes):
+        ''' Convert the images of the Tiles not converted yet to pixel arrays.
+        '''
+        import pygame  # pylint: disable=import-outside-toplevel
+        for idx in np.unique(indexes):
+            if not self.converted[idx]:
+                # surfarray: (x, y, color) -> (y, x, color)
+                self.pixels[idx] = pygame.surfarray.array3d(self.tiles_img[idx]).swapaxes(0, 1)
+                self.converted[idx] = True
+
+    def render_strip(self, tiles):
+        ''' Return the image of map rows, uint8 array (rows * tile height, width * tile width, 3).
+        '''
+        indexes = self.get_indexes(tiles)
+        self.convert(indexes)
+        rows, cols = indexes.shape
+        # (rows, cols, tile_h, tile_w, 3) -> (rows, tile_h, cols, tile_w, 3)
+        strip = self.pixels[indexes].transpose(0, 2, 1, 3, 4)
+        return strip.reshape(rows * self.tile_h, cols * self.tile_w, 3)
+
+    def strip_rows(self, width):
+        ''' Return the number of map rows of a strip (map width in Cells).
+        '''
+        return max(1, STRIP_BYTES // (width * self.tile_w * self.tile_h * 3))
+
+    def save_png(self, filename, tiles, strip_rows=None, level=6):
+        ''' Write the image of a map (array or list of rows of Tile indexes) to a
+        PNG file (name or binary file object).
+        '''
+        if isinstance(tiles, list):
+            tiles = np.asarray(tiles)
+        height, width = tiles.shape
+        if strip_rows is None:
+            strip_rows = self.strip_rows(width)
+        with PngWriter(filename, width * self.tile_w, height * self.tile_h, level) as png:
+            for y_0 in range(0, height, strip_rows):
+                png.write_rows(self.render_strip(tiles[y_0:y_0 + strip_rows]))
+
+def save_png(filename, tiles, tiles_img, strip_rows=None, background=(0, 0, 0)):
+    ''' Write the image of a map (Tile indexes) to a PNG file, see MapRenderer.
+    '''
+    MapRenderer(tiles_img, background).save_png(filename, tiles, strip_rows)
+
+def load_tiles(filename):
+    ''' Read a map of Tile indexes: map file (.wfcm, .npy, memory-mapped) or
+    text file (.txt). Return (tiles, header).
+    '''
+    if filename.endswith('.txt'):
+        tiles = np.loadtxt(filename, dtype=np.int64, ndmin=2)
+        return tiles, {'height': tiles.shape[0], 'width': tiles.shape[1]}
+    from . import mapfile  # pylint: disable=import-outside-toplevel
+    return mapfile.load_map(filename, mmap=True)
+
+def main(argv):
+    ''' Parse command line arguments and render a map to a PNG image.
+    '''
+    from . import batch  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(prog='python -m wfc_src render',
+                                     description='Render a map of Tile indexes to a PNG image.')
+    parser.add_argument('map', help='map file: .wfcm, .npy or .txt')
+    batch.add_atlas_args(parser, weights=False)
+    parser.add_argument('--strip', type=int,
+                        help='map rows per strip (default: strip of max. 64 MB)')
+    parser.add_argument('--out', default='map.png', help='PNG image')
+    args = parser.parse_args(argv)
+
+    tiles, header = load_tiles(args.map)
+    tiles_man = batch.load_engine(args, 'list')
+    tiles_man.load_images()
+    if header.get('atlas_sha1'):
+        from .mapfile import file_sha1  # pylint: disable=import-outside-toplevel
+        if header['atlas_sha1'][0] != file_sha1(tiles_man.atlas_files[0]):
+            print('Warning: the map was generated with another atlas:', header['atlas'][0])
+
+    start = time.time()
+    save_png(args.out, tiles, tiles_man.tiles_img, args.strip)
+    print(f'Rendered {tiles.shape[0]}x{tiles.shape[1]} cells in {time.time() - start:.2f}s '
+          f'to {args.out}')
+    return 0
@@ -0,0 +1,227 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Speculative multi-seed solving:
+# The same map request is solved with several seeds at once, in a pool of
+# worker processes. The first map finished without a contradiction wins, the
+# other solves are cancelled:
+#
+#   with Racer('list', atlas, 9, 13, (48, 48), jobs=8) as racer:
+#       seed, tiles, stats = racer.solve(seed=0, count=64)
+#
+#   python -m wfc_src race --size 48 48 --engine list --jobs 8 --out map.wfcm
+#
+# Without backtracking a solve ends with an invalid map when it hits a
+# contradiction, the larger the map the more often. Instead of repeating the
+# solve with the next seed until one is valid, up to jobs seeds are solved
+# concurrently and a solve is stopped at its first contradiction (it cannot
+# win anymore): the worker takes the next seed. A finished map wins only if
+# all its neighbor Cells are connected (blocks.check_map): the engines without
+# backtracking do not check a collapsed Cell again and can finish with not
+# connected Cells, such a map is counted as a contradiction.
+#
+# Seeds: every solve has an explicit seed (seed, seed + 1, ... seed + count - 1)
+# for the random generator of its solver (tiles_man.seed, not the random
+# module). The winning map depends only on its seed, not on the worker or on
+# the order the solves finish, it is reproduced with:
+#
+#   tiles_man.seed(seed)
+#   tiles_man.clear()
+#   tiles_man.generate()
+#
+# Cancellation: the workers stay loaded between the races (one warm Tiles
+# Manager per worker, see batch.init_worker). Every race has an id, the id
+# of the current race is a value shared with the workers. A worker checks it
+# every CHECK_STEPS steps and stops its solve when the race is over; the
+# solves not started yet are cancelled in the pool.
+#-------------------------------------------------------------------------------
+""" Speculative Multi-seed Solving Module. """
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from . import batch
+from .batch import ENGINES
+from .blocks import check_map
+from .mapfile import get_meta, save_map, to_uint16
+
+# Steps between two checks of the race id (in worker process)
+CHECK_STEPS = 32
+
+# Id of the current race, shared with the workers (see init_worker)
+_RACE_ID = None
+
+def init_worker(race_id, *args):
+    ''' Worker process initializer: keep the shared race id, load the
+    Tiles Manager (see batch.init_worker).
+    '''
+    global _RACE_ID  # pylint: disable=global-statement
+    _RACE_ID = race_id
+    batch.init_worker(*args)
+
+def solve_seed(race, seed, size):
+    ''' Solve one seed of a race (in worker process). Return (seed, map as
+    uint16 array, steps, time, conflict), map None: contradiction, not connected
+    Cells (conflict True) or the race is over.
+    '''
+    tiles_man = batch.get_worker()
+    start = time.perf_counter()
+    tiles_man.seed(seed)
+    tiles_man.resize(*size)
+    steps = 0
+    finished = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        # stop at the first contradiction or when the race is over
+        while not tiles_man.has_contradiction() and \
+                (steps % CHECK_STEPS or _RACE_ID.value == race):
+            if not tiles_man.next_step():
+                finished = True
+                break
+            steps += 1
+    if not finished or tiles_man.has_contradiction():
+        return seed, None, steps, time.perf_counter() - start, False
+    tiles = to_uint16(tiles_man.get_tiles())
+    if check_map(tiles, tiles_man.tiles_def):
+        return seed, None, steps, time.perf_counter() - start, True
+    return seed, tiles, steps, time.perf_counter() - start, False
+
+# ##############################################################################
+class Racer:
+    """ Pool of warm worker processes racing seeds of the same request """
+
+    def __init__(self, engine, atlas, ty_cnt, tx_cnt, size, jobs=None, weights=None):
+        """ Init Racer
+            engine - solver engine (see batch.ENGINES)
+            atlas, ty_cnt, tx_cnt - tiles atlas image and its rows, columns of tiles
+            size - default map size (H, W)
+            jobs - worker processes (None = number of CPUs)
+            weights - Tiles weights (see set_weights)
+        """
+        self.size = tuple(size)
+        self.jobs = jobs or os.cpu_count()
+        self.race_id = multiprocessing.Value('i', 0)
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker,
+                                        initargs=(self.race_id, engine, os.path.abspath(atlas),
+                                                  ty_cnt, tx_cnt, self.size, weights))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def next_race(self):
+        ''' End the current race (its running solves stop), return the new race id.
+        '''
+        with self.race_id.get_lock():
+            self.race_id.value += 1
+            return self.race_id.value
+
+    def solve(self, seed=0, count=64, size=None):
+        ''' Race the seeds seed..seed+count-1 (at most jobs at once), return
+        (winning seed, map as uint16 array, statistics dictionary); seed and
+        map None if no seed gave a map without contradiction.
+        '''
+        size = self.size if size is None else tuple(size)
+        race = self.next_race()
+        seeds = iter(range(seed, seed + count))
+        pending = {self.pool.submit(solve_seed, race, s, size)
+                   for s in itertools.islice(seeds, self.jobs)}
+        stats = {'solves': 0, 'contradictions': 0, 'conflicts': 0, 'cancelled': 0, 'steps': 0}
+        winner = (None, None)
+        start = time.perf_counter()
+        try:
+            while pending and winner[0] is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # several finished at once: the lowest seed wins
+                for future in sorted(done, key=lambda fut: fut.result()[0]):
+                    r_seed, tiles, steps, elapsed, conflict = future.result()
+                    stats['solves'] += 1
+                    stats['steps'] += steps
+                    stats['conflicts'] += conflict
+                    if tiles is None:
+                        stats['contradictions'] += 1
+                    elif winner[0] is None:
+                        winner = (r_seed, tiles)
+                        stats['win_steps'] = steps
+                        stats['win_time'] = round(elapsed, 4)
+                if winner[0] is None:
+                    for r_seed in itertools.islice(seeds, len(done)):
+                        pending.add(self.pool.submit(solve_seed, race, r_seed, size))
+        finally:
+            # stop the running solves, drop the not started ones
+            self.next_race()
+            for future in pending:
+                stats['cancelled'] += 1
+                future.cancel()
+        stats['time'] = round(time.perf_counter() - start, 4)
+        return winner[0], winner[1], stats
+
+    def close(self):
+        ''' Stop the running solves and the worker processes.
+        '''
+        self.next_race()
+        self.pool.shutdown(cancel_futures=True)
+
+def main(argv):
+    ''' Parse command line arguments, race seeds and write the winning map.
+    '''
+    parser = argparse.ArgumentParser(prog='python -m wfc_src race',
+                                     description='Solve a map with several seeds at once, '
+                                                 'keep the first one without contradiction.')
+    batch.add_atlas_args(parser)
+    parser.add_argument('--size', type=int, nargs=2, default=(32, 32), metavar=('H', 'W'),
+                        help='map size (cells)')
+    parser.add_argument('--seed', type=int, default=0, help='first seed')
+    parser.add_argument('--count', type=int, default=64, help='max. number of seeds tried')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='list', help='solver engine')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--out', default='map.wfcm', help='output map file (.wfcm, .npy)')
+    parser.add_argument('--verify', action='store_true',
+                        help='solve the winning seed again (in this process), compare the maps')
+    args = parser.parse_args(argv)
+
+    weights = batch.load_weights(args)
+
+    start = time.time()
+    with Racer(args.engine, args.atlas, args.rows, args.cols, args.size, args.jobs,
+               weights) as racer:
+        seed, tiles, stats = racer.solve(args.seed, args.count)
+    print(f'Race finished in {time.time() - start:.2f}s:', json.dumps(stats))
+    if seed is None:
+        print('No map without contradiction')
+        return 1
+
+    tiles_man = batch.load_engine(args, size=args.size)
+    save_map(args.out, tiles, get_meta(tiles_man, seed, engine=args.engine))
+    print(f'Seed {seed} won, map written to', args.out)
+
+    if args.verify:
+        tiles_man.seed(seed)
+        tiles_man.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tiles_man.generate()
+        same = (to_uint16(tiles_man.get_tiles()) == tiles).all() and tiles_man.is_valid()
+        print('Reproduced:', 'identical' if same else 'DIFFERENT')
+        return 0 if same else 1
+    return 0
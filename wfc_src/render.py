@@ -0,0 +1,106 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Render:
+# Draw the Cells of a Tiles Manager on a pygame surface. Imported by the
+# Tiles Manager only when something is drawn (see TilesManager.draw), and
+# by the solver thread viewer (see solver.py).
+#-------------------------------------------------------------------------------
+""" Render Module. """
+
+import pygame
+
+def draw(tiles_man, surface, background=None):
+    """ Draw the Tiles changed since the last call on a surface (all Tiles
+    on the first call and after clear/shift). If background is specified,
+    the area of every Tile is filled with it first.
+    Return the list of updated rectangles.
+    """
+    tiles_man.load_images()
+    full = tiles_man.dirty is None
+    if full:
+        # redraw all
+        cells = [(j, i) for j in range(tiles_man.ty_out) for i in range(tiles_man.tx_out)]
+        if background is not None:
+            surface.fill(background)
+        background = None
+    else:
+        cells = tiles_man.dirty
+        # remove the previous "last processed" image
+        if tiles_man.drawn_last is not None:
+            cells.add(tiles_man.drawn_last)
+    tiles_man.dirty = set()
+
+    # debug text (see below)
+    #pygame.font.init()
+    #myfont = pygame.font.SysFont('Courier New', 16)
+
+    rects = []
+    for j, i in cells:
+        rect = pygame.Rect((i * 64), (j * 64), 64, 64)
+        if background is not None:
+            surface.fill(background, rect)
+        img = tiles_man.get_cell_image(j, i)
+        if img is not None:
+            surface.blit(img, rect)
+        rects.append(rect)
+
+        # text: possibilities
+        #textsurface = myfont.render(str(lst_len), False, (200, 200, 200))
+        #if lst_len <= 0:
+        #    textsurface = myfont.render("X", False, (200, 200, 200))
+        #elif lst_len > 1:
+        #    textsurface = myfont.render("?", False, (200, 200, 200))
+        #else:
+        #    textsurface = myfont.render(str(lst[0]), False, (200, 200, 200))
+        #surface.blit(textsurface, ((i * 64) + 4, (j * 64)))
+
+        # text: processed
+        #if(cell.processed):
+        #    textsurface = myfont.render("P", False, (150, 150, 150))
+        #    surface.blit(textsurface, ((i * 64), (j * 64) + 16))
+
+        # text: changed
+        #if(cell.changed):
+        #    textsurface = myfont.render("C", False, (150, 150, 150))
+        #    surface.blit(textsurface, ((i * 64), (j * 64) + 32))
+
+    # Last processed
+    tiles_man.drawn_last = None
+    if (tiles_man.last_x is not None) and (tiles_man.last_y is not None):
+        rect = pygame.Rect((tiles_man.last_x * 64), (tiles_man.last_y * 64), 64, 64)
+        surface.blit(tiles_man.img_last, rect)
+        rects.append(rect)
+        tiles_man.drawn_last = (tiles_man.last_y, tiles_man.last_x)
+
+    if full:
+        return [surface.get_rect()]
+    return rects
+
+def draw_images(surface, images, background=None):
+    """ Draw the images of Cells {(y, x): image or None} on a surface.
+    If background is specified, the area of every Cell is filled with it first.
+    Return the list of updated rectangles.
+    """
+    rects = []
+    for (j, i), img in images.items():
+        rect = pygame.Rect((i * 64), (j * 64), 64, 64)
+        if background is not None:
+            surface.fill(background, rect)
+        if img is not None:
+            surface.blit(img, rect)
+        rects.append(rect)
+    return rects
@@ -0,0 +1,525 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Local generation service:
+# A long-running HTTP server (localhost or Unix socket) generating maps in a
+# pool of warm worker processes:
+#
+#   python -m wfc_src serve --port 8765 --jobs 8
+#   python -m wfc_src serve --socket /tmp/wfc.sock
+#
+#   curl localhost:8765/generate -d '{"size": [32, 32], "seed": 7}'
+#   curl localhost:8765/generate -d '{"size": [32, 32], "seed": 7, "format": "png"}' > map.png
+#   curl localhost:8765/batch -d '{"requests": [{"seed": 1}, {"seed": 2}]}'
+#   curl localhost:8765/metrics
+#   curl --unix-socket /tmp/wfc.sock http://wfc/metrics
+#
+# Request (JSON object, all fields optional):
+#   atlas, rows, cols   atlas image (PNG) in the atlas directory, its rows and
+#                       columns of Tiles (default: tiles_64x64_9.png, 9, 13)
+#   engine, weights     solver engine (see batch.ENGINES), Tiles weights
+#   size                [H, W] map size (Cells)
+#   seed                seed of the solver: the same request and seed give
+#                       the same map
+#   pinned              [[y, x, tile], ...] pinned Cells (see constraints.py)
+#   allowed             [[y, x, [tiles]], ...] allowed Tiles per Cell
+#   format              json (Tile indexes, -1 = not collapsed) or png (image)
+#
+# Every worker keeps its Tiles Managers (decoded atlas, adjacency and weights
+# tables) for the last MAX_SOLVERS atlas / engine / weights combinations, a
+# request only resizes, seeds and solves. The requests of a batch are sent
+# to the workers in groups (fewer transfers for many small maps), the
+# requests of concurrent clients are queued in the same pool.
+#
+# Metrics (GET /metrics, JSON): maps submitted, queued (not started by a
+# worker yet), running, completed, failed, and for the last maps the queue
+# wait, solve and total latencies (percentiles and a histogram of power of
+# two buckets, see stats.py).
+#-------------------------------------------------------------------------------
+""" Local Generation Service Module. """
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import batch
+from .stats import HIST_BUCKETS
+
+# Tiles Managers kept by a worker (atlas / engine / weights combinations)
+MAX_SOLVERS = 8
+# Groups of a batch per worker (load balancing vs. fewer transfers)
+GROUPS_PER_WORKER = 4
+# Maps in the latency window of the metrics
+LATENCY_WINDOW = 1024
+# Size of a Tile in the atlas (pixels, see atlas.py)
+TILE = 64
+# Default request
+DEFAULTS = {'atlas': 'tiles_64x64_9.png', 'rows': 9, 'cols': 13, 'engine': 'backtrack',
+            'weights': None, 'size': [32, 32], 'seed': 0, 'pinned': [], 'allowed': [],
+            'format': 'json'}
+FORMATS = ('json', 'png')
+
+# Worker process state (see init_worker)
+_SOLVERS = OrderedDict()    # (engine, atlas, rows, cols, weights) -> (Tiles Manager, renderer)
+_STARTED = None             # maps started by the workers (shared value)
+_ATLAS_DIR = None
+
+def get_atlas_size(filename):
+    ''' Return the (width, height) of a PNG atlas image (from its header),
+    None if it is not a PNG image.
+    '''
+    with open(filename, 'rb') as file:
+        header = file.read(24)
+    if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        return None
+    return int.from_bytes(header[16:20], 'big'), int.from_bytes(header[20:24], 'big')
+
+def get_request(data, defaults, atlas_dir, max_cells):
+    ''' Return the complete request (defaults added) of a JSON object, raise
+    ValueError if it is invalid.
+    '''
+    if not isinstance(data, dict):
+        raise ValueError('The request must be a JSON object')
+    unknown = set(data) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown request fields: {sorted(unknown)}')
+    request = dict(defaults, **data)
+    if request['engine'] not in batch.ENGINES:
+        raise ValueError(f'Unknown engine: {request["engine"]}')
+    if request['format'] not in FORMATS:
+        raise ValueError(f'Unknown format: {request["format"]}')
+    weights = request['weights']
+    if weights is not None:
+        # list (weight of every Tile) or object {"Tile index": weight}, see set_weights
+        if not isinstance(weights, (list, dict)) or \
+                (isinstance(weights, dict) and not all(key.isdigit() for key in weights)):
+            raise ValueError(f'Invalid weights: {weights!r} (list or object of numbers)')
+        values = weights.values() if isinstance(weights, dict) else weights
+        if not all(isinstance(val, (int, float)) and not isinstance(val, bool) and val > 0
+                   for val in values):
+            raise ValueError('Invalid weights: the weights must be positive numbers')
+    # only the atlases of the atlas directory
+    atlas = os.path.basename(str(request['atlas']))
+    if atlas != request['atlas'] or not os.path.isfile(os.path.join(atlas_dir, atlas)):
+        raise ValueError(f'Unknown atlas: {request["atlas"]}')
+    atlas_size = get_atlas_size(os.path.join(atlas_dir, atlas))
+    if atlas_size is None:
+        raise ValueError(f'Unknown atlas: {request["atlas"]} (not a PNG image)')
+    if not isinstance(request['size'], list) or len(request['size']) != 2:
+        raise ValueError(f'Invalid size: {request["size"]!r} ([H, W] expected)')
+    try:
+        request['rows'], request['cols'] = int(request['rows']), int(request['cols'])
+        height, width = (int(val) for val in request['size'])
+        request['seed'] = int(request['seed'])
+        request['pinned'] = [(int(y_idx), int(x_idx), int(tile))
+                             for y_idx, x_idx, tile in request['pinned']]
+        request['allowed'] = [(int(y_idx), int(x_idx), [int(tile) for tile in tiles])
+                              for y_idx, x_idx, tiles in request['allowed']]
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f'Invalid request field: {exc}') from exc
+    # the Tiles must be in the atlas (every rows x cols combination is decoded)
+    max_rows, max_cols = atlas_size[1] // TILE, atlas_size[0] // TILE
+    if not (1 <= request['rows'] <= max_rows and 1 <= request['cols'] <= max_cols):
+        raise ValueError(f'Invalid atlas rows x cols {request["rows"]}x{request["cols"]} '
+                         f'(max. {max_rows}x{max_cols})')
+    if height < 1 or width < 1 or height * width > max_cells:
+        raise ValueError(f'Invalid size {height}x{width} (max. {max_cells} Cells)')
+    request['size'] = [height, width]
+    return request
+
+def init_worker(started, atlas_dir, preload):
+    ''' Worker process initializer: keep the shared counter, load the
+    Tiles Managers of the preload requests.
+    '''
+    global _STARTED, _ATLAS_DIR  # pylint: disable=global-statement
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    _STARTED = started
+    _ATLAS_DIR = atlas_dir
+    for request in preload:
+        get_solver(request)
+
+def get_solver(request):
+    ''' Return the (Tiles Manager, map renderer) of a request (in worker
+    process), loaded at the first use and kept for the next requests.
+    '''
+    key = (request['engine'], request['atlas'], request['rows'], request['cols'],
+           json.dumps(request['weights'], sort_keys=True))
+    solver = _SOLVERS.get(key)
+    if solver is None:
+        tiles_man = batch.get_engine(request['engine'])('', 1, 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            tiles_man.load_tiles(os.path.join(_ATLAS_DIR, request['atlas']), False,
+                                 ty_cnt=request['rows'], tx_cnt=request['cols'])
+        if request['weights'] is not None:
+            tiles_man.set_weights(request['weights'])
+        solver = _SOLVERS[key] = [tiles_man, None]
+        while len(_SOLVERS) > MAX_SOLVERS:
+            _SOLVERS.popitem(last=False)
+    _SOLVERS.move_to_end(key)
+    return solver
+
+def get_violations(tiles, request):
+    ''' Return the Cells of the map (list of rows of Tile indexes) without
+    their pinned or allowed Tiles.
+    '''
+    cells = [(y_idx, x_idx) for y_idx, x_idx, tile in request['pinned']
+             if tiles[y_idx][x_idx] != tile]
+    cells += [(y_idx, x_idx) for y_idx, x_idx, cell_tiles in request['allowed']
+              if tiles[y_idx][x_idx] not in cell_tiles]
+    return cells
+
+def solve_request(request):
+    ''' Generate the map of a request (in worker process), return the result
+    dictionary (the map as tiles or png).
+    '''
+    from .constraints import constrain  # pylint: disable=import-outside-toplevel
+    with _STARTED.get_lock():
+        _STARTED.value += 1
+    started = time.time()
+    solver = get_solver(request)
+    tiles_man = solver[0]
+    tiles_man.seed(request['seed'])
+    tiles_man.resize(*request['size'])
+    result = {'seed': request['seed'], 'size': request['size'], 'started': started}
+    if request['pinned'] or request['allowed']:
+        report = constrain(tiles_man, tiles={(y_idx, x_idx): tile
+                                             for y_idx, x_idx, tile in request['pinned']},
+                           allowed={(y_idx, x_idx): tiles
+                                    for y_idx, x_idx, tiles in request['allowed']})
+        if not report['feasible']:
+            result.update(valid=False, error='infeasible constraints',
+                          conflicts=report['conflicts'][:100],
+                          pair_conflicts=report['pair_conflicts'][:100])
+            result['solve'] = time.time() - started
+            return result
+    with contextlib.redirect_stdout(io.StringIO()):
+        tiles_man.generate()
+    tiles = batch.get_tiles(tiles_man)
+    # the constraints kept in the map (see pick_tile)
+    violations = get_violations(tiles, request)
+    if violations:
+        result['violations'] = violations[:100]
+    result['valid'] = tiles_man.is_valid() and not violations
+    if request['format'] == 'png':
+        if solver[1] is None:
+            from .mapimage import MapRenderer  # pylint: disable=import-outside-toplevel
+            tiles_man.load_images()
+            solver[1] = MapRenderer(tiles_man.tiles_img)
+        png = io.BytesIO()
+        solver[1].save_png(png, tiles)
+        result['png'] = png.getvalue()
+    else:
+        result['tiles'] = tiles
+    result['solve'] = time.time() - started
+    return result
+
+def solve_requests(requests):
+    ''' Generate the maps of a group of requests (in worker process).
+    '''
+    results = []
+    for request in requests:
+        try:
+            results.append(solve_request(request))
+        except Exception as exc:  # pylint: disable=broad-except
+            # one bad request does not fail the whole group
+            results.append({'seed': request['seed'], 'valid': False, 'error': repr(exc),
+                            'started': time.time(), 'solve': 0.0})
+    return results
+
+def percentile(values, fraction):
+    ''' Return the percentile (nearest rank) of sorted values.
+    '''
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))], 6)
+
+# ##############################################################################
+class Metrics:
+    """ Counters and latencies of the service """
+
+    def __init__(self, started, workers):
+        """ Init Metrics
+            started - maps started by the workers (shared value)
+            workers - number of worker processes
+        """
+        self.lock = threading.Lock()
+        self.started = started
+        self.workers = workers
+        self.start_time = time.time()
+        self.requests = 0       # HTTP requests (generate, batch)
+        self.submitted = 0      # maps
+        self.completed = 0
+        self.failed = 0         # errors and infeasible constraints
+        self.invalid = 0        # generated with deadends or not connected Cells
+        # (wait, solve, total) of the last maps
+        self.latency = deque(maxlen=LATENCY_WINDOW)
+        self.hist = [0] * HIST_BUCKETS     # total latency, bucket b: < 2^b ns
+
+    def submit(self, count):
+        ''' Count a request of count maps.
+        '''
+        with self.lock:
+            self.requests += 1
+            self.submitted += count
+
+    def done(self, submitted, result):
+        ''' Count a finished map (submitted: time of the request).
+        '''
+        finished = time.time()
+        wait = max(result['started'] - submitted, 0.0)
+        total = finished - submitted
+        with self.lock:
+            if 'error' in result:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self.invalid += (not result['valid'])
+            self.latency.append((wait, result['solve'], total))
+            self.hist[min(int(total * 1e9).bit_length(), HIST_BUCKETS - 1)] += 1
+
+    def as_dict(self):
+        ''' Return the metrics as a dictionary (e.g. for JSON export).
+        '''
+        with self.lock:
+            finished = self.completed + self.failed
+            started = self.started.value
+            metrics = {
+                'uptime_s': round(time.time() - self.start_time, 3),
+                'workers': self.workers,
+                'requests': self.requests,
+                'submitted': self.submitted,
+                'queued': max(self.submitted - started, 0),
+                'running': max(started - finished, 0),
+                'completed': self.completed,
+                'failed': self.failed,
+                'invalid': self.invalid,
+                'latency_hist': {1 << idx: cnt for idx, cnt in enumerate(self.hist) if cnt},
+            }
+            for idx, name in enumerate(('wait', 'solve', 'total')):
+                values = sorted(entry[idx] for entry in self.latency)
+                metrics[name + '_s'] = {
+                    'mean': round(sum(values) / len(values), 6) if values else None,
+                    **{f'p{round(fraction * 100)}': percentile(values, fraction)
+                       for fraction in (0.5, 0.9, 0.99)},
+                    'max': round(values[-1], 6) if values else None}
+        return metrics
+
+# ##############################################################################
+class Service:
+    """ Pool of warm worker processes generating the maps of requests """
+
+    def __init__(self, atlas_dir, jobs=None, max_cells=1 << 22, defaults=None):
+        """ Init Service
+            atlas_dir - directory of the atlases which can be requested
+            jobs - worker processes (None = number of CPUs)
+            max_cells - max. map size (Cells)
+            defaults - default request fields (see DEFAULTS), its Tiles
+                       Manager is loaded by every worker at start
+        """
+        self.atlas_dir = os.path.abspath(atlas_dir)
+        self.jobs = jobs or os.cpu_count()
+        self.max_cells = max_cells
+        self.defaults = dict(DEFAULTS, **(defaults or {}))
+        started = multiprocessing.Value('q', 0)
+        self.metrics = Metrics(started, self.jobs)
+        preload = [self.get_request({})]
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker,
+                                        initargs=(started, self.atlas_dir, preload))
+
+    def get_request(self, data):
+        ''' Return the complete request of a JSON object (see get_request).
+        '''
+        return get_request(data, self.defaults, self.atlas_dir, self.max_cells)
+
+    def solve(self, requests):
+        ''' Generate the maps of the requests (JSON objects), in groups across
+        the workers. Return the results, in the order of the requests.
+        '''
+        requests = [self.get_request(request) for request in requests]
+        submitted = time.time()
+        self.metrics.submit(len(requests))
+        size = max(1, -(-len(requests) // (self.jobs * GROUPS_PER_WORKER)))
+        futures = [self.pool.submit(solve_requests, requests[idx:idx + size])
+                   for idx in range(0, len(requests), size)]
+        results = []
+        for future in futures:
+            for result in future.result():
+                self.metrics.done(submitted, result)
+                results.append(result)
+        return results
+
+    def close(self):
+        ''' Stop the worker processes.
+        '''
+        self.pool.shutdown(cancel_futures=True)
+
+# ##############################################################################
+class Handler(BaseHTTPRequestHandler):
+    """ HTTP requests of the service (see the module description) """
+
+    server_version = 'WFC'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket: no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_data(self, code, data, content_type='application/json', headers=None):
+        ''' Send a response (data: bytes or JSON object).
+        '''
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        ''' GET /metrics, /health
+        '''
+        if self.path == '/metrics':
+            self.send_data(200, self.server.service.metrics.as_dict())
+        elif self.path == '/health':
+            self.send_data(200, {'status': 'ok'})
+        else:
+            self.send_data(404, {'error': f'Unknown path: {self.path}'})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        ''' POST /generate (one request), /batch ({"requests": [...]})
+        '''
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/generate':
+                requests = [data]
+            elif self.path == '/batch':
+                requests = data.get('requests') if isinstance(data, dict) else None
+                if not isinstance(requests, list):
+                    raise ValueError('A batch must be a JSON object {"requests": [...]}')
+            else:
+                self.send_data(404, {'error': f'Unknown path: {self.path}'})
+                return
+            results = self.server.service.solve(requests)
+        except ValueError as exc:   # also invalid JSON
+            self.send_data(400, {'error': str(exc)})
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            # e.g. a worker process died
+            self.send_data(500, {'error': repr(exc)})
+            return
+
+        for result in results:
+            result.pop('started', None)
+        if self.path == '/generate':
+            result = results[0]
+            if 'png' in result:
+                self.send_data(200, result['png'], 'image/png',
+                               {'X-WFC-Seed': str(result['seed']),
+                                'X-WFC-Valid': str(int(result['valid'])),
+                                'X-WFC-Solve-Time': f'{result["solve"]:.6f}'})
+            else:
+                self.send_data(422 if 'error' in result else 200, result)
+        else:
+            # the images of a batch as base64 strings
+            for result in results:
+                if 'png' in result:
+                    result['png'] = base64.b64encode(result['png']).decode()
+            self.send_data(200, {'results': results})
+
+class LocalHTTPServer(ThreadingHTTPServer):
+    """ HTTP server of the service on host:port """
+
+    def __init__(self, address, service, verbose=False):
+        """ Init Local HTTP Server
+            address - (host, port)
+            service - Service generating the maps
+            verbose - log every HTTP request
+        """
+        super().__init__(address, Handler)
+        self.service = service
+        self.verbose = verbose
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ HTTP server of the service on a Unix socket """
+
+    daemon_threads = True
+
+    def __init__(self, path, service, verbose=False):
+        """ Init Unix HTTP Server
+            path - Unix socket path
+            service - Service generating the maps
+            verbose - log every HTTP request
+        """
+        super().__init__(path, Handler)
+        self.service = service
+        self.verbose = verbose
+
+def main(argv):
+    ''' Parse command line arguments and run the service.
+    '''
+    parser = argparse.ArgumentParser(prog='python -m wfc_src serve',
+                                     description='Local map generation service (HTTP).')
+    parser.add_argument('--host', default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=8765, help='listen port')
+    parser.add_argument('--socket', help='listen on a Unix socket instead of host:port')
+    parser.add_argument('--atlas-dir', default=os.path.join(os.path.dirname(__file__),
+                                                            '..', 'resources'),
+                        help='directory of the atlases which can be requested')
+    parser.add_argument('--engine', choices=sorted(batch.ENGINES), default=DEFAULTS['engine'],
+                        help='default solver engine')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--max-cells', type=int, default=1 << 22, help='max. map size (Cells)')
+    parser.add_argument('--verbose', action='store_true', help='log every HTTP request')
+    args = parser.parse_args(argv)
+
+    service = Service(args.atlas_dir, args.jobs, args.max_cells, {'engine': args.engine})
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, service, args.verbose)
+        where = args.socket
+    else:
+        server = LocalHTTPServer((args.host, args.port), service, args.verbose)
+        where = f'http://{args.host}:{server.server_address[1]}'
+    print(f'Serving on {where} with {service.jobs} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
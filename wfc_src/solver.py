@@ -0,0 +1,175 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Solver thread:
+# Runs the solver (next_step) of a Tiles Manager in a background thread, so
+# the viewer stays responsive during long generations:
+#
+#   solver = SolverThread(tiles_man)
+#   solver.start()                  # solve in background
+#   solver.draw(surface)            # every frame: draw the published changes
+#   solver.cancel()                 # stop (the partial map is kept)
+#   solver.restart(action)          # stop, action(tiles_man), solve again
+#
+# While the thread runs, only the thread uses the Tiles Manager. At most
+# every publish_interval seconds it publishes the images of the Cells
+# changed since the last publication (change set: {(y, x): image}), the
+# viewer takes the published changes in draw and blits them. The change set
+# is the only data shared by the two threads (protected by a lock), so the
+# viewer never waits for a step.
+#
+# Between two runs (thread stopped) the Tiles Manager can be used directly
+# (clear, set_cell, shift, next_step), draw publishes the changes itself.
+#-------------------------------------------------------------------------------
+""" Background Solver Thread Module. """
+
+import threading
+import time
+
+# ##############################################################################
+class SolverThread:
+    """ Solver of a Tiles Manager running in a background thread """
+
+    def __init__(self, tiles_man, publish_interval=1/60):
+        """ Init Solver Thread
+            tiles_man - Tiles Manager to be solved
+            publish_interval - min. time between two publications (s)
+        """
+        self.tiles_man = tiles_man
+        self.publish_interval = publish_interval
+        self.thread = None
+        self.cancel_event = threading.Event()
+        self.steps = 0          # steps since the last start
+        self.finished = False   # the last run ended (all Cells collapsed)
+
+        # published change set (see publish), protected by lock
+        self.lock = threading.Lock()
+        self.images = {}        # (y, x) -> image of the Cells changed since the last draw
+        self.full = True        # redraw all
+        self.last = None        # (y, x) of the last processed Cell
+
+        # viewer side (see draw)
+        self.shown = {}         # (y, x) -> image currently drawn
+        self.drawn_last = None  # position of the drawn "last processed" image
+
+    def running(self):
+        ''' Return True if the solver thread is running.
+        '''
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        ''' Start solving in background (from the current state).
+        '''
+        if self.running():
+            return
+        # the images are extracted in the calling (main) thread
+        self.tiles_man.load_images()
+        self.cancel_event.clear()
+        self.steps = 0
+        self.finished = False
+        self.thread = threading.Thread(target=self.run, name='wfc-solver', daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        ''' Stop solving (after the current step) and wait for the thread.
+        The Tiles Manager keeps the partially generated map.
+        '''
+        if self.thread is not None:
+            self.cancel_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def restart(self, action=None):
+        ''' Stop solving, call action(tiles_man) (e.g. clear, set_cell or shift)
+        and start solving again.
+        '''
+        self.cancel()
+        if action is not None:
+            action(self.tiles_man)
+        self.start()
+
+    def run(self):
+        ''' Solver thread: call next_step until finished or cancelled.
+        '''
+        tiles_man = self.tiles_man
+        next_publish = time.perf_counter() + self.publish_interval
+        while not self.cancel_event.is_set():
+            if not tiles_man.next_step():
+                self.finished = True
+                break
+            self.steps += 1
+            if time.perf_counter() >= next_publish:
+                self.publish()
+                next_publish = time.perf_counter() + self.publish_interval
+        self.publish()
+
+    def publish(self):
+        ''' Publish the images of the Cells changed since the last publication.
+        Called by the solver thread (or by draw if the thread is stopped).
+        '''
+        tiles_man = self.tiles_man
+        full = tiles_man.dirty is None
+        if full:
+            cells = [(j, i) for j in range(tiles_man.ty_out) for i in range(tiles_man.tx_out)]
+        else:
+            cells = tiles_man.dirty
+        tiles_man.dirty = set()
+        images = {(j, i): tiles_man.get_cell_image(j, i) for j, i in cells}
+        last = None
+        if (tiles_man.last_y is not None) and (tiles_man.last_x is not None):
+            last = (tiles_man.last_y, tiles_man.last_x)
+
+        with self.lock:
+            if full:
+                self.images = images
+                self.full = True
+            else:
+                self.images.update(images)
+            self.last = last
+
+    def draw(self, surface, background=None):
+        """ Draw the published changes on a (pygame) surface.
+        Return the list of updated rectangles.
+        """
+        from . import render  # pylint: disable=import-outside-toplevel
+        if not self.running():
+            self.tiles_man.load_images()
+            self.publish()
+        with self.lock:
+            images, full, last = self.images, self.full, self.last
+            self.images = {}
+            self.full = False
+
+        if full:
+            self.shown = images
+            self.drawn_last = None
+            if background is not None:
+                surface.fill(background)
+        else:
+            self.shown.update(images)
+            # remove the previous "last processed" image
+            if self.drawn_last is not None and self.drawn_last not in images:
+                images[self.drawn_last] = self.shown.get(self.drawn_last)
+        rects = render.draw_images(surface, images, None if full else background)
+
+        # Last processed
+        self.drawn_last = last
+        if last is not None:
+            rects += render.draw_images(surface, {last: self.tiles_man.img_last})
+
+        if full:
+            return [surface.get_rect()]
+        return rects
@@ -0,0 +1,137 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Stats:
+# Instrumentation of a Tiles Manager (solver), enabled with:
+#
+#   stats = tiles_man.enable_stats(on_step=..., on_contradiction=...)
+#   tiles_man.generate()
+#   print(stats)                # or stats.as_dict() for a metrics system
+#
+# Timings: the methods listed in TilesManager.TIMED (process_cell,
+# find_min_entropy_cell, collapse_cell, propagate, ...) are replaced on the
+# instance with wrappers counting the calls, the total time and a histogram
+# of the call durations (power of two buckets: bucket b counts the calls
+# shorter than 2^b ns). disable_stats removes the wrappers, so a disabled
+# Tiles Manager runs the original methods without any overhead.
+#
+# Counters: events counted by the solver (only if stats are enabled):
+#   collapses       Cells collapsed to a random Tile
+#   propagated      Cells propagated to their neighbors
+#   contradictions  deadends / contradictions
+#   undone          multi-Cell collapses undone after a deadend (vector engine)
+#
+# Callbacks:
+#   on_step(tiles_man, result)          after every next_step
+#   on_contradiction(tiles_man, y, x)   for every contradiction at Cell (y, x)
+#-------------------------------------------------------------------------------
+""" Solver Stats Module. """
+
+import time
+
+# Number of histogram buckets (the last one counts all longer calls, > 2^38 ns = 4.5 min)
+HIST_BUCKETS = 40
+
+# ##############################################################################
+class Stats:
+    """ Solver counters, timing histograms and callbacks """
+
+    def __init__(self, on_step=None, on_contradiction=None):
+        self.on_step = on_step
+        self.on_contradiction = on_contradiction
+        self.counters = {}      # event name -> count
+        self.timings = {}       # method name -> [calls, total ns, histogram]
+
+    def reset(self):
+        ''' Reset all counters and timings.
+        '''
+        self.counters.clear()
+        for timing in self.timings.values():
+            timing[0] = 0
+            timing[1] = 0
+            timing[2][:] = [0] * HIST_BUCKETS
+
+    def count(self, name, value=1):
+        ''' Count an event.
+        '''
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def contradiction(self, tiles_man, y_idx, x_idx):
+        ''' Count a contradiction at Cell (y_idx, x_idx), call the callback.
+        '''
+        self.count('contradictions')
+        if self.on_contradiction is not None:
+            self.on_contradiction(tiles_man, y_idx, x_idx)
+
+    def calls(self, name):
+        ''' Return the number of calls of a timed method.
+        '''
+        return self.timings[name][0] if name in self.timings else 0
+
+    def timed(self, name, method):
+        ''' Return a wrapper of method measuring its calls.
+        '''
+        timing = self.timings.setdefault(name, [0, 0, [0] * HIST_BUCKETS])
+        hist = timing[2]
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            result = method(*args, **kwargs)
+            elapsed = time.perf_counter_ns() - start
+            timing[0] += 1
+            timing[1] += elapsed
+            hist[min(elapsed.bit_length(), HIST_BUCKETS - 1)] += 1
+            return result
+        return wrapper
+
+    def attach(self, tiles_man):
+        ''' Replace the timed methods of tiles_man with the measuring wrappers.
+        '''
+        for name in tiles_man.TIMED:
+            setattr(tiles_man, name, self.timed(name, getattr(tiles_man, name)))
+
+        # step callback (checked on every call, it can be set later)
+        next_step = tiles_man.next_step
+        def step_wrapper():
+            result = next_step()
+            if self.on_step is not None:
+                self.on_step(tiles_man, result)
+            return result
+        tiles_man.next_step = step_wrapper
+
+    def detach(self, tiles_man):
+        ''' Remove the wrappers, tiles_man uses the original methods again.
+        '''
+        for name in tiles_man.TIMED + ('next_step',):
+            tiles_man.__dict__.pop(name, None)
+
+    def as_dict(self):
+        ''' Return counters and timings as a dictionary (e.g. for JSON export).
+        The histograms contain only the non-empty buckets: {max ns: calls}.
+        '''
+        return {
+            'counters': dict(self.counters),
+            'timings': {name: {'calls': calls, 'total_s': total / 1e9,
+                               'hist': {1 << idx: cnt for idx, cnt in enumerate(hist) if cnt}}
+                        for name, (calls, total, hist) in self.timings.items()},
+        }
+
+    def __str__(self):
+        lines = [f'{name}: {value}' for name, value in sorted(self.counters.items())]
+        for name, (calls, total, _) in self.timings.items():
+            if calls:
+                lines.append(f'{name}: {calls} calls, {total / 1e9:.6f} s, '
+                             f'{total / calls / 1e3:.2f} us/call')
+        return '\n'.join(lines)
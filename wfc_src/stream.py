@@ -0,0 +1,236 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Streaming generation of infinite worlds:
+#
+#   stream = RowStream(tiles_man, width=64, direction='down')
+#   for row in stream.rows(1000):       # or stream.chunks(16) for blocks of rows
+#       ...                             # row = list of width Tile indexes
+#
+#   python -m wfc_src stream --width 64 --count 100000 --out level.txt
+#   python -m wfc_src stream --width 64 --count 100000 --out level.wfcm   (binary, see mapfile.py)
+#
+# Only a window of lookahead + 1 rows is kept in memory (a Tiles Manager of
+# the same engine as tiles_man). The first row of the window is finished:
+# it is yielded, then the window is shifted (shift_up / shift_down), the new
+# row is propagated from its neighbor row and solved. The cost and memory
+# per row are constant (they depend only on the window size).
+#
+#   direction down:   +---------+ row 0       <- yielded, then dropped
+#                     |  window | rows 1..n-2    lookahead (not yielded yet)
+#                     +---------+ row n-1     <- new row (solved)
+#
+# If the new row has no solution, the rows not yielded yet are solved again
+# (the next row to be yielded is set with set_cell), lookahead > 1 gives the
+# solver more freedom to repair the seam.
+#
+# Directions left and right stream columns: the window is solved with the
+# transposed Tiles definitions, (T,R,B,L) -> (L,B,R,T) (transposing a Tile
+# swaps its top-right and bottom-left corners, so the edges stay valid).
+# The yielded columns are lists of Tile indexes from top to bottom.
+#
+# With a chunk cache (see chunks.py), a new row whose neighbor row has the
+# same edges as an already solved one is not solved again: the cached row
+# is dropped in (--cache N, --seed-classes K: K different rows per edges).
+#-------------------------------------------------------------------------------
+""" Streaming Generation Module. """
+
+import argparse
+import contextlib
+import io
+import json
+import time
+
+from .batch import ENGINES, add_atlas_args, get_tiles, load_engine
+
+# Streaming directions: name -> (transposed, new rows on bottom)
+DIRECTIONS = {
+    'down': (False, True),
+    'up': (False, False),
+    'right': (True, True),
+    'left': (True, False),
+}
+
+# ##############################################################################
+class RowStream:
+    """ Streaming generator of rows (or columns) of an infinite world """
+
+    def __init__(self, tiles_man, width, direction='down', lookahead=2, retries=3,
+                 chunk_cache=None, seed=None):
+        """ Init Row Stream
+            tiles_man - Tiles Manager with loaded Tiles (engine and weights of the stream)
+            width - length of the rows (Cells)
+            direction - down, up (rows) or right, left (columns)
+            lookahead - rows solved but not yielded yet
+            retries - attempts to solve a new row
+            chunk_cache - cache of solved rows (see chunks.py), None = no cache
+            seed - seed of the window solver (None = from the OS)
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError(f'Invalid direction: {direction}')
+        if lookahead < 1 or retries < 1:
+            raise ValueError('lookahead and retries must be at least 1')
+        self.transposed, self.forward = DIRECTIONS[direction]
+        self.width = width
+        self.height = lookahead + 1
+        self.retries = retries
+
+        tiles_def = tiles_man.tiles_def
+        if self.transposed:
+            tiles_def = [(left, bottom, right, top) for top, right, bottom, left in tiles_def]
+        self.tiles_def = tiles_def
+        # the window: a Tiles Manager of the same engine
+        self.solver = type(tiles_man)(tiles_man.path, self.height, width)
+        self.solver.set_tiles_def(tiles_def)
+        self.solver.set_weights(tiles_man.tile_weight)
+        self.solver.set_chunk_cache(chunk_cache)
+        self.solver.seed(seed)
+
+        # statistics
+        self.produced = 0       # rows yielded
+        self.resolved = 0       # rows solved again (new row without solution)
+        self.invalid = 0        # rows yielded without a valid solution
+
+    def solve(self):
+        ''' Solve the not collapsed Cells of the window.
+        '''
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.solver.generate()
+
+    def is_valid(self, tiles):
+        ''' Return True if all Cells of the window are collapsed and connected.
+        '''
+        for y_idx, row in enumerate(tiles):
+            for x_idx, tile in enumerate(row):
+                if tile < 0:
+                    return False
+                if x_idx > 0 and self.tiles_def[row[x_idx - 1]][1] != self.tiles_def[tile][3]:
+                    return False
+                if y_idx > 0 and \
+                        self.tiles_def[tiles[y_idx - 1][x_idx]][2] != self.tiles_def[tile][0]:
+                    return False
+        return True
+
+    def solve_new_row(self):
+        ''' Solve the new row of the window, on failure solve again all rows
+        not yielded yet. Return the Tiles of the window.
+        '''
+        self.solve()
+        tiles = get_tiles(self.solver)
+        next_idx = 0 if self.forward else self.height - 1
+        for _ in range(self.retries - 1):
+            if self.is_valid(tiles):
+                return tiles
+            self.resolved += 1
+            next_row = tiles[next_idx]
+            self.solver.clear()
+            for x_idx, tile in enumerate(next_row):
+                self.solver.set_cell(next_idx, x_idx, tile)
+            self.solve()
+            tiles = get_tiles(self.solver)
+        if not self.is_valid(tiles):
+            self.invalid += 1
+        return tiles
+
+    def rows(self, count=None):
+        ''' Yield count (None = infinite) finished rows, lists of Tile indexes.
+        '''
+        self.solver.clear()
+        tiles = self.solve_new_row()
+        produced = 0
+        while count is None or produced < count:
+            # the finished row: first row in the stream direction
+            row = tiles[0] if self.forward else tiles[-1]
+            produced += 1
+            self.produced += 1
+            yield list(row)
+            if count is not None and produced >= count:
+                break
+            if self.forward:
+                self.solver.shift_up()
+            else:
+                self.solver.shift_down()
+            tiles = self.solve_new_row()
+
+    def chunks(self, size, count=None):
+        ''' Yield chunks (lists) of size finished rows, count rows in total.
+        '''
+        chunk = []
+        for row in self.rows(count):
+            chunk.append(row)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def main(argv):
+    ''' Parse command line arguments and stream rows to a text file.
+    '''
+    parser = argparse.ArgumentParser(prog='python -m wfc_src stream',
+                                     description='Streaming generation of long maps.')
+    add_atlas_args(parser)
+    parser.add_argument('--width', type=int, default=64, help='row length (cells)')
+    parser.add_argument('--count', type=int, default=1000, help='number of rows')
+    parser.add_argument('--direction', choices=sorted(DIRECTIONS), default='down',
+                        help='stream direction (left/right: columns)')
+    parser.add_argument('--lookahead', type=int, default=2, help='rows solved ahead')
+    parser.add_argument('--seed', type=int, default=0, help='seed')
+    parser.add_argument('--out', default='stream.txt',
+                        help='output file: .txt (one line per row) or .wfcm / .npy (binary)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='backtrack',
+                        help='solver engine')
+    parser.add_argument('--cache', type=int, default=0,
+                        help='size of the cache of solved rows (0 = no cache)')
+    parser.add_argument('--seed-classes', type=int, default=4,
+                        help='cached rows per edges of the neighbor row')
+    args = parser.parse_args(argv)
+
+    tiles_man = load_engine(args)
+
+    chunk_cache = None
+    if args.cache:
+        from .chunks import ChunkCache  # pylint: disable=import-outside-toplevel
+        chunk_cache = ChunkCache(args.cache, args.seed_classes)
+    stream = RowStream(tiles_man, args.width, args.direction, args.lookahead,
+                       chunk_cache=chunk_cache, seed=args.seed)
+    start = time.time()
+    if args.out.endswith('.txt'):
+        with open(args.out, 'w', encoding='utf-8') as file:
+            for row in stream.rows(args.count):
+                file.write(' '.join(str(val) for val in row) + '\n')
+    else:
+        # binary map file, the rows (or columns) are written into the memory-mapped file
+        from . import mapfile  # pylint: disable=import-outside-toplevel
+        shape = (args.width, args.count) if stream.transposed else (args.count, args.width)
+        data = mapfile.create_map(args.out, shape,
+                                  mapfile.get_meta(tiles_man, args.seed, direction=args.direction))
+        for idx, row in enumerate(stream.rows(args.count)):
+            # up / left: the stream grows towards the first row (column) of the map
+            if not stream.forward:
+                idx = args.count - 1 - idx
+            if stream.transposed:
+                data[:, idx] = mapfile.to_uint16(row)
+            else:
+                data[idx] = mapfile.to_uint16(row)
+        data.flush()
+    total = time.time() - start
+    print(f'Streamed {stream.produced} rows in {total:.2f}s '
+          f'({stream.produced / total:.0f} rows/s), '
+          f'{stream.resolved} rows solved again, {stream.invalid} invalid rows')
+    if chunk_cache is not None:
+        print('Chunk cache:', json.dumps(chunk_cache.get_stats()))
+    return 1 if stream.invalid else 0
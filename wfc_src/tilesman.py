@@ -73,6 +73,42 @@
 #   tiles_def = [ (T0,R0,B0,L0), (T1,R1,B1,L1), (T2,R2,B2,L2), ... ]
 #                 |<-  tile0  ->|<--  tile1  -->|<-- tile2 -->| ...
 #
+# Many Tiles (different images) have the same definition. For the algorithm
+# they are equivalent, so the Tiles with the same definition are grouped in
+# a class and the Cells hold lists of possible classes (not Tiles):
+#
+#   class_def    = [ (T,R,B,L), ... ]       unique definitions (first occurrence order)
+#   class_tiles  = [ [tile, tile, ...], ... ] Tiles of every class
+#   class_weight = [ sum(weights), ... ]    the collapse selects a class with
+#                                           probability proportional to its weight
+#   tile_class   = [ class, ... ]           class of every Tile
+#
+# The Tile (image) of a collapsed Cell is selected from its class only when
+# needed (pick_tile), pseudo-random but always the same for the same Cell.
+#
+# Weights:
+# Every Tile has a weight (frequency), by default 1 (so the weight of a class
+# is its number of Tiles in the atlas), they can be changed with set_weights.
+# The entropy of a Cell is the Shannon entropy of its possible classes:
+#
+#   H = log(sum(w)) - sum(w * log(w)) / sum(w)
+#
+# Every Cell keeps the running sums sum(w) and sum(w * log(w)) of its
+# possible classes, a removed class is subtracted from them, so the entropy
+# is updated in O(1) per removed class. The weighted random selections use
+# the precomputed cumulative weights tables (see build_weights).
+#
+# Random choices:
+# Every solver has its own random generator (self.random, a random.Random),
+# the random module is not used. A map is reproduced by the seed of its
+# solver (seed, before clear), independently of other solvers in the same
+# process (e.g. the window of a stream) or racing in other processes.
+#
+# The Tiles Manager (solver) does not depend on pygame: the atlas is decoded
+# by atlas.py and the Cells are drawn by render.py, both imported only when
+# needed. Without an atlas, the Tiles definitions can be set directly
+# (set_tiles_def) and the result read as a grid of indexes (get_tiles).
+#
 #-------------------------------------------------------------------------------
 # Modification history:
 #
@@ -81,12 +117,17 @@
 #-------------------------------------------------------------------------------
 """ Tiles Manager Module. """
 
+import array
+import bisect
+import heapq
+import itertools
+import math
 import os.path
 import random
 import time
 from functools import wraps
 
-import pygame
+from . import cache
 
 # ##############################################################################
 def timethis(func):
@@ -105,14 +146,27 @@ def timethis(func):
 TY_OUT = 12 #8
 TX_OUT = 12 #8
 
+def mix(salt, y_idx, x_idx):
+    ''' Pseudo-random 32-bit hash of a Cell position (ints or numpy int64 arrays).
+    '''
+    val = salt ^ ((y_idx * 0x9E3779B1) & 0xFFFFFFFF) ^ ((x_idx * 0x85EBCA6B) & 0xFFFFFFFF)
+    val = (val * 0x27D4EB2D) & 0xFFFFFFFF
+    return val ^ (val >> 15)
+
 # ##############################################################################
 class Cell:
     """ Tiles Cell definition """
 
-    def __init__(self, p_list, changed = False):
+    __slots__ = ('processed', 'changed', 'poss_list', 'sum_w', 'sum_wlogw')
+
+    def __init__(self, p_list, sum_w, sum_wlogw, changed = False):
         self.processed = False          # the cell has been processed
         self.changed = changed          # the cell has been changed
-        self.poss_list = list(p_list)   # list of possibilities for this cell
+        # list of possibilities for this cell. The lists are never modified
+        # in place (always replaced), so all new cells share the same list.
+        self.poss_list = p_list
+        self.sum_w = sum_w              # sum of weights of the possible classes
+        self.sum_wlogw = sum_wlogw      # sum of weight * log(weight)
 
     def get_entropy(self):
         ''' Return Cell's entropy (number of possible Tiles for this Cell).
@@ -123,14 +177,44 @@ class Cell:
 class TilesManager:
     """ Tiles Manager """
 
-    def __init__(self, path):
-        """ Init Tales Manager """
+    # Attributes stored in the atlas cache (the decoded atlas and the tables
+    # derived from it, see build_tables)
+    CACHED = ('tiles_def', 'color_dict', 'class_def', 'class_tiles', 'tile_class')
+    # Methods measured if the stats are enabled (see stats.py)
+    TIMED = ('next_step', 'process_cell', 'find_min_entropy_cell', 'collapse_cell',
+             'mark_not_processed')
+    # Solver state saved in checkpoints besides the Cells (see checkpoint.py):
+    # attributes, and lists changed only at their end (saved as deltas)
+    STATE = ('last_y', 'last_x', 'contradictions', 'pick_salt', 'row_offset', 'pinned',
+             'allowed')
+    LOGS = ()
+
+    def __init__(self, path, ty_out=TY_OUT, tx_out=TX_OUT):
+        """ Init Tales Manager
+            path - path prefix of the Tiles image files
+            ty_out, tx_out - size of the output grid (number of Cells)
+        """
         self.path = path
+        self.ty_out = ty_out
+        self.tx_out = tx_out
 
         self.tiles_def = []     # Tiles Definitions
+        self.class_def = []     # Tiles classes: unique definitions (see build_classes)
+        self.class_tiles = []   # Tiles of every class
+        self.tile_class = []    # class of every Tile
+        # Weights (see build_weights)
+        self.tile_weight = []   # weight of every Tile (default 1)
+        self.class_weight = []  # weight of every class (sum of its Tiles weights)
+        self.class_wlogw = []   # weight * log(weight) of every class
+        self.class_cum = []     # cumulative weights of all classes
+        self.class_tile_cum = []    # cumulative weights of the Tiles of every class
+        self.full_w = 0.0       # sums of a Cell with all possibilities
+        self.full_wlogw = 0.0
         self.tiles_img = []     # Tiles Images
-        self.disp_idx = [[0    for x in range(TX_OUT)] for y in range(TY_OUT)]
-        self.disp_img = [[None for x in range(TX_OUT)] for y in range(TY_OUT)]
+        self.atlas_pending = None   # atlas loaded from cache, images not extracted yet
+        self.atlas_files = []   # loaded atlas files (full names)
+        self.disp_idx = [[0    for x in range(self.tx_out)] for y in range(self.ty_out)]
+        self.disp_img = [[None for x in range(self.tx_out)] for y in range(self.ty_out)]
         self.img_many = None
         self.img_none = None
         self.img_last = None
@@ -138,121 +222,181 @@ class TilesManager:
         self.val_entr = []      # Entropy value
         self.last_y = None
         self.last_x = None
+        # Cells changed since the last draw, None = redraw all (see draw)
+        self.dirty = None
+        self.drawn_last = None  # position of the last drawn "last processed" image
 
-        self.tl_idx_list = []     # List of Tiles Definitions Indexes
+        self.tl_idx_list = []     # List of Tiles classes Indexes
 
-        # Generate an empty array (all cells have all possibilities)
-        self.cell_arr = [[Cell(self.tl_idx_list) for x in range(TX_OUT)] for y in range(TY_OUT)]
+        # Tiles selection for the collapsed Cells (see pick_tile)
+        self.pick_salt = 0
+        self.row_offset = 0     # absolute row of the first row (changed by shift)
+        self.pinned = {}        # (absolute row, x) -> Tile set with set_cell
+        self.allowed = {}       # (absolute row, x) -> allowed Tiles (see constraints.py)
+
+        # Entropy index (see index_rebuild)
+        self.heap_chg = []      # not processed and changed cells
+        self.heap_unchg = []    # not processed and not changed cells
+        self.touched = set()    # cells with changed/processed flags set
+
+        self.stats = None       # instrumentation, None = disabled (see enable_stats)
+        self.chunk_cache = None # cache of solved chunks, None = disabled (see chunks.py)
+        self.contradictions = 0 # deadends since the last clear
+        self.random = random.Random()   # random generator of the solver (see seed)
 
-        pygame.font.init() # you have to call this at the start, if you want to use this module.
-        self.myfont = pygame.font.SysFont('Courier New', 16)
+        # Generate an empty array (all cells have all possibilities)
+        self.cell_arr = []
+        self.clear()
 
         self.color_dict = {}
 
-    def get_color_idx(self, surface, x_pos, y_pos):
-        ''' Get color index from surface at a specified position (x_pos, y_pos).
-        If color not already in the dictionary, add it and assign a index.'''
-
-        color_test = tuple(surface.get_at((x_pos, y_pos)))
-        if color_test not in self.color_dict:
-            # Color not in dictionary, add it and assign a index (length)
-            self.color_dict[color_test] = len(self.color_dict)
-            print("Color added: ", color_test, self.color_dict[color_test])
-        return self.color_dict[color_test]
-
-    def decode_tile(self, j, i, surface):
-        """ Decode a Tile """
-        # Tile (T, R, B, L) definitions
-        tile = [0, 0, 0, 0]
-
-        color_idx = self.get_color_idx(surface, 1, 1)
-        if color_idx != 0:
-            tile[0] += (8 * color_idx) # Top
-            tile[3] += (8 * color_idx) # Left
-
-        color_idx = self.get_color_idx(surface, 1, 62)
-        if color_idx != 0:
-            tile[2] += (8 * color_idx)  # Bottom
-            tile[3] += (1 * color_idx)  # Left
-
-        color_idx = self.get_color_idx(surface, 62, 1)
-        if color_idx != 0:
-            tile[0] += (1 * color_idx)  # Top
-            tile[1] += (8 * color_idx)  # Right
-
-        color_idx = self.get_color_idx(surface, 62, 62)
-        if color_idx != 0:
-            tile[1] += (1 * color_idx)  # Right
-            tile[2] += (1 * color_idx)  # Bottom
-
-        self.tiles_def.append(tuple(tile))
-        self.tiles_img.append(surface)
-        print(len(self.tiles_def), j, i, tile)
+    def new_cell(self):
+        ''' Create a new Cell with all possibilities.
+        '''
+        return Cell(self.tl_idx_list, self.full_w, self.full_wlogw)
+
+    def build_tables(self):
+        ''' Precompute the tables derived from the Tiles definitions
+        (the derived Tiles Managers add their own tables).
+        '''
+        self.build_classes()
+
+    def build_classes(self):
+        ''' Group the Tiles with the same definition in classes.
+        '''
+        classes = {}
+        self.class_def = []
+        self.class_tiles = []
+        self.tile_class = []
+        for tile_idx, tile in enumerate(self.tiles_def):
+            if tile not in classes:
+                classes[tile] = len(self.class_def)
+                self.class_def.append(tile)
+                self.class_tiles.append([])
+            self.class_tiles[classes[tile]].append(tile_idx)
+            self.tile_class.append(classes[tile])
+        self.tl_idx_list = list(range(len(self.class_def)))
+        self.build_weights()
+
+    def build_weights(self):
+        ''' Precompute the weights tables of the classes from the Tiles weights
+        (new Tiles get the default weight 1).
+        '''
+        self.tile_weight = self.tile_weight[:len(self.tiles_def)]
+        self.tile_weight += [1.0] * (len(self.tiles_def) - len(self.tile_weight))
+        self.class_weight = [math.fsum(self.tile_weight[idx] for idx in tiles)
+                             for tiles in self.class_tiles]
+        self.class_wlogw = [weight * math.log(weight) for weight in self.class_weight]
+        self.class_cum = list(itertools.accumulate(self.class_weight))
+        self.class_tile_cum = [list(itertools.accumulate(self.tile_weight[idx] for idx in tiles))
+                               for tiles in self.class_tiles]
+        self.full_w = math.fsum(self.class_weight)
+        self.full_wlogw = math.fsum(self.class_wlogw)
+
+    def set_weights(self, weights):
+        ''' Set the weights of the Tiles: a list (weight of every Tile) or a
+        dictionary {Tile index: weight}, the missing Tiles keep their weight.
+        Clears all cells (the weights of the possible classes change).
+        '''
+        items = weights.items() if isinstance(weights, dict) else enumerate(weights)
+        tile_weight = list(self.tile_weight)
+        for tile_idx, weight in items:
+            tile_idx = int(tile_idx)
+            if not 0 <= tile_idx < len(tile_weight):
+                raise ValueError(f'Invalid Tile index: {tile_idx}')
+            if not weight > 0:
+                raise ValueError(f'Invalid weight of Tile {tile_idx}: {weight}')
+            tile_weight[tile_idx] = float(weight)
+        self.tile_weight = tile_weight
+        self.build_weights()
+        self.clear()
+
+    def load_images(self):
+        ''' Extract the Tiles images of an atlas loaded from cache
+        (they are needed only for drawing).
+        '''
+        if self.atlas_pending is None:
+            return
+        from . import atlas  # pylint: disable=import-outside-toplevel
+        fullname, special_img, ty_cnt, tx_cnt = self.atlas_pending
+        self.atlas_pending = None
+        img_surface = atlas.open_atlas(fullname)
+        self.tiles_img += [surface for _, _, surface in
+                           atlas.extract_tiles(img_surface, ty_cnt, tx_cnt)]
+        if special_img:
+            self.set_special(atlas.extract_special(img_surface))
 
     def load_tiles(self, filename, special_img, ty_cnt, tx_cnt):
         """ Load all Tiles from image file, decode them and append to existing list """
+        # images of a previous atlas not extracted yet, keep the order of the Tiles
+        self.load_images()
 
-        # open image
         fullname = os.path.join('', self.path + filename)
-        try:
-            img_surface = pygame.image.load(fullname)
-        except pygame.error as message:
-            print('Cannot load image:', fullname)
-            raise SystemExit(message)
+        self.atlas_files.append(os.path.abspath(fullname))
+
+        # first atlas, already decoded? (see cache.py)
+        key = None
+        if not self.tiles_def and os.path.isfile(fullname):
+            key = cache.atlas_key(fullname, (self.CACHED, special_img, ty_cnt, tx_cnt))
+            data = cache.load(key)
+            if data is not None:
+                for name in self.CACHED:
+                    setattr(self, name, data[name])
+                print("Tiles loaded from cache:", len(self.tiles_def),
+                      "classes:", len(self.class_def))
+                # the images are extracted only if needed (see draw)
+                self.atlas_pending = (fullname, special_img, ty_cnt, tx_cnt)
+                self.tl_idx_list = list(range(len(self.class_def)))
+                self.build_weights()
+                self.set_entropy_thresholds(special_img)
+                return
+
+        # pygame is needed only to decode the atlas
+        from . import atlas  # pylint: disable=import-outside-toplevel
 
-        img_surface = img_surface.convert()
-        #img_rect = img_surface.get_rect()
+        # open image
+        img_surface = atlas.open_atlas(fullname)
 
-        # get reference colorkey (point 0, 0)
-        ref_colorkey = img_surface.get_at((0, 0))
-        img_surface.set_colorkey(ref_colorkey, pygame.RLEACCEL)
+        # Extract and decode every 64x64 Tile from image (all Tiles at once)
+        tiles_pixels = atlas.get_tiles_pixels(atlas.get_pixels(img_surface), ty_cnt, tx_cnt)
+        self.tiles_def += atlas.decode_tiles(self.color_dict, tiles_pixels)
+        self.tiles_img += [surface for _, _, surface in atlas.make_tiles(tiles_pixels)]
 
-        # How many full 64x64 Tiles are in the image
-        #ty_cnt = 9  #int(imgRect[3]/64)
-        #tx_cnt = 10 #int(imgRect[2]/64)
+        self.build_tables()
+        print("Total tiles:", len(self.tiles_def), "classes:", len(self.class_def),
+              "colors:", len(self.color_dict))
+        if key is not None:
+            cache.save(key, {name: getattr(self, name) for name in self.CACHED})
 
-        # Extract every 64x64 Tile from image
-        for j in range(ty_cnt):
-            for i in range(tx_cnt):
+        # Extract special images
+        if special_img:
+            self.set_special(atlas.extract_special(img_surface))
+        self.set_entropy_thresholds(special_img)
 
-                # Tile image
-                surface = pygame.Surface((64, 64))
-                surface.blit(img_surface, (0, 0), ((i * 64), (j * 64), 64, 64))
-                surface.set_colorkey((0, 0, 0))
-                self.decode_tile(j, i, surface)
+    def set_special(self, images):
+        ''' Set the special images (img_many, img_none, img_last, img_entr).
+        '''
+        self.img_many, self.img_none, self.img_last, img_entr = images
+        self.img_entr += img_entr
 
-                surface = pygame.transform.flip(surface, True, False)
-                surface = pygame.transform.rotate(surface, 90)
-                self.decode_tile(j, i, surface)
+    def set_tiles_def(self, tiles_def):
+        ''' Use a list of (T,R,B,L) Tiles definitions instead of an atlas
+        (no images, the Cells can be read with get_tiles).
+        '''
+        self.tiles_def = [tuple(tile) for tile in tiles_def]
+        self.build_tables()
 
-        print("Total colors:", len(self.color_dict))
-        self.tl_idx_list = list(range(len(self.tiles_def)))
+    def print_tiles(self):
+        ''' Print the definitions of all Tiles (index, (T,R,B,L)).
+        '''
+        for tile_idx, tile in enumerate(self.tiles_def):
+            print(tile_idx, tile, 'class', self.tile_class[tile_idx])
 
-        # Extract special images
+    def set_entropy_thresholds(self, special_img):
+        ''' Calculate the entropy threshold for every entropy image.
+        '''
         if special_img:
-            # many possibilities
-            surface = pygame.Surface((64, 64))
-            surface.blit(img_surface, (0, 0), ((0 * 64), (9 * 64), 64, 64))
-            surface.set_colorkey((0, 0, 0))
-            self.img_many = surface
-            # no possibilities
-            surface = pygame.Surface((64, 64))
-            surface.blit(img_surface, (0, 0), ((0 * 64), (9 * 64), 64, 64))
-            surface.set_colorkey((0, 0, 0))
-            self.img_none = surface
-            # last processed
-            surface = pygame.Surface((64, 64))
-            surface.blit(img_surface, (0, 0), ((1 * 64), (9 * 64), 64, 64))
-            surface.set_colorkey((0, 0, 0))
-            self.img_last = surface
-            # entropy images
-            for i in range(5):
-                surface = pygame.Surface((64, 64))
-                surface.blit(img_surface, (0, 0), (((i + 2) * 64), (9 * 64), 64, 64))
-                surface.set_colorkey((0, 0, 0))
-                self.img_entr.append(surface)
-                # calculate threshold for every entropy image
-                self.val_entr.append(int(len(self.tiles_def)/5) * (i + 1))
+            self.val_entr += [int(len(self.class_def)/5) * (i + 1) for i in range(5)]
 
     def process_neighbor_cell(self, y_pos, x_pos, y_rel, x_rel, side_idx, main_set):
         """ Process neighbor cell. Generate the list of new possible Tiles
@@ -270,18 +414,34 @@ class TilesManager:
         len0 = len(lst0)
         # process only cells with more than one possibility
         if len0 > 1:
-            # create a new list, but only with Tiles which can be connected to main cell
-            lst1 = [x for x in lst0 if self.tiles_def[x][side_idx] in main_set]
+            # create a new list, but only with Tiles which can be connected to main cell,
+            # subtract the weights of the removed Tiles
+            lst1 = []
+            sum_w, sum_wlogw = cell.sum_w, cell.sum_wlogw
+            for x in lst0:
+                if self.class_def[x][side_idx] in main_set:
+                    lst1.append(x)
+                else:
+                    sum_w -= self.class_weight[x]
+                    sum_wlogw -= self.class_wlogw[x]
             # deadend detected? (no more valid possibilities)
             if len(lst1) == 0:
                 # create "artificially" the null-cell
                 lst1 = [0]
-                print("Deadend: ", y_pos, x_pos, y_rel, x_rel, side_idx, main_set)
+                self.contradiction(y_pos + y_rel, x_pos + x_rel)
             # set the new list as possibilities for the neighbor cell
             cell.poss_list = lst1
+            if len(lst1) == 1:
+                self.set_sums(cell, lst1[0])
+            else:
+                cell.sum_w, cell.sum_wlogw = sum_w, sum_wlogw
             # mark neighbor as changed if list of possible Tiles for this cell changed
-            if not cell.changed:
-                cell.changed = (len0 != len(lst1))
+            if len0 != len(lst1):
+                cell.changed = True
+                self.touched.add((y_pos + y_rel, x_pos + x_rel))
+                self.index_push(y_pos + y_rel, x_pos + x_rel)
+                if self.dirty is not None:
+                    self.dirty.add((y_pos + y_rel, x_pos + x_rel))
 
     def process_cell(self, y_idx:int, x_idx:int):
         ''' Process cell with coordinates y_idx, x_idx .
@@ -294,10 +454,10 @@ class TilesManager:
         lst = cell.poss_list
 
         # create sets with all possibilities for all sides
-        u_set = {self.tiles_def[tile_idx][0] for tile_idx in lst}
-        r_set = {self.tiles_def[tile_idx][1] for tile_idx in lst}
-        b_set = {self.tiles_def[tile_idx][2] for tile_idx in lst}
-        l_set = {self.tiles_def[tile_idx][3] for tile_idx in lst}
+        u_set = {self.class_def[tile_idx][0] for tile_idx in lst}
+        r_set = {self.class_def[tile_idx][1] for tile_idx in lst}
+        b_set = {self.class_def[tile_idx][2] for tile_idx in lst}
+        l_set = {self.class_def[tile_idx][3] for tile_idx in lst}
 
         # check neighbor cell on top side (j-1,i+0)
         # main cell top side (u_set) vs neighbor cell bottom side (2)
@@ -306,12 +466,12 @@ class TilesManager:
 
         # check neighbor cell on right side (j+0,i+1)
         # main cell right side (r_set) vs neighbor cell left side (3)
-        if x_idx < (TX_OUT - 1):
+        if x_idx < (self.tx_out - 1):
             self.process_neighbor_cell(y_idx, x_idx, 0, 1, 3, r_set)
 
         # check neighbor cell on bottom side (j+1,i+0)
         # main cell bottom side (b_set) vs neighbor cell top side (0)
-        if y_idx < (TY_OUT - 1):
+        if y_idx < (self.ty_out - 1):
             self.process_neighbor_cell(y_idx, x_idx, 1, 0, 0, b_set)
 
         # check neighbor cell on left side (j+0,i-1)
@@ -321,33 +481,133 @@ class TilesManager:
 
         # mark cell as processed
         cell.processed = True
+        self.touched.add((y_idx, x_idx))
+        if self.stats is not None:
+            self.stats.count('propagated')
+
+    def contradiction(self, y_idx, x_idx):
+        ''' A deadend (no more possible Tiles) was detected at Cell (y_idx, x_idx).
+        '''
+        self.contradictions += 1
+        if self.stats is not None:
+            self.stats.contradiction(self, y_idx, x_idx)
+
+    def set_sums(self, cell, class_idx):
+        ''' Set the weights sums of a Cell with the only possibility class_idx.
+        '''
+        cell.sum_w = self.class_weight[class_idx]
+        cell.sum_wlogw = self.class_wlogw[class_idx]
+
+    def get_shannon(self, cell):
+        ''' Return the Shannon entropy of the Cell's possible classes (weighted).
+        '''
+        return math.log(cell.sum_w) - cell.sum_wlogw / cell.sum_w
+
+    def choose_class(self, cell):
+        ''' Select a random class from the Cell's possibilities (weighted).
+        '''
+        lst = cell.poss_list
+        # all possibilities: search in the cumulative weights of all classes
+        if len(lst) == len(self.class_cum):
+            rnd = self.random.random() * self.class_cum[-1]
+            return min(bisect.bisect_right(self.class_cum, rnd), len(lst) - 1)
+        rnd = self.random.random() * cell.sum_w
+        for idx in lst:
+            rnd -= self.class_weight[idx]
+            if rnd < 0:
+                return idx
+        # rounding errors of the running sum
+        return lst[-1]
+
+    def collapse_cell(self, y_idx, x_idx):
+        ''' Collapse the cell (select a random Tile for it).
+        '''
+        cell = self.cell_arr[y_idx][x_idx]
+        val_r = self.choose_class(cell)
+        cell.poss_list = [val_r]
+        self.set_sums(cell, val_r)
+        cell.changed = True
+        self.touched.add((y_idx, x_idx))
+        self.index_push(y_idx, x_idx)
+        if self.dirty is not None:
+            self.dirty.add((y_idx, x_idx))
+        if self.stats is not None:
+            self.stats.count('collapses')
+
+    def entropy_level(self, cell):
+        ''' Return the Shannon entropy of a Cell as integer (0 = collapsed Cell).
+        '''
+        if cell.get_entropy() <= 1:
+            return 0
+        return max(int(self.get_shannon(cell) * (1 << 24)), 0) + 1
+
+    def index_key(self, y_idx, x_idx):
+        ''' Entropy index key of a cell: (entropy, reversed position) packed in one int.
+        '''
+        rev_pos = self.ty_out * self.tx_out - 1 - (y_idx * self.tx_out + x_idx)
+        return (self.entropy_level(self.cell_arr[y_idx][x_idx]) << 32) | rev_pos
+
+    def index_rebuild(self):
+        ''' Rebuild the entropy index from the current cells.
+        The index consists of two lazy-deletion heaps (one for changed, one
+        for not changed cells) with (entropy, reversed position) entries.
+        Every time a cell becomes "not processed" or loses a possibility, a
+        new entry is pushed. Outdated entries are dropped when they reach the
+        top. The reversed position keeps the order of the original full-grid
+        scan: on equal entropy the last cell (highest y, then x) wins.
+        '''
+        self.heap_chg = []
+        self.heap_unchg = []
+        self.touched = set()
+        for j, row in enumerate(self.cell_arr):
+            for i, cell in enumerate(row):
+                if cell.changed or cell.processed:
+                    self.touched.add((j, i))
+                if not cell.processed:
+                    heap = self.heap_chg if cell.changed else self.heap_unchg
+                    heap.append(self.index_key(j, i))
+        heapq.heapify(self.heap_chg)
+        heapq.heapify(self.heap_unchg)
+
+    def index_push(self, y_idx, x_idx):
+        ''' Add the current state of a cell to the entropy index.
+        '''
+        cell = self.cell_arr[y_idx][x_idx]
+        if not cell.processed:
+            heap = self.heap_chg if cell.changed else self.heap_unchg
+            heapq.heappush(heap, self.index_key(y_idx, x_idx))
+            # too many outdated entries, compact the index
+            if len(heap) > 8 * self.ty_out * self.tx_out:
+                self.index_rebuild()
 
     def find_min_entropy_cell(self, changed):
-        ''' Find not processed cell with min entropy (min possible Tiles for it).
-        '''
-        # initially: set min to max entropy (= length of list of all Tiles)
-        min_e = len(self.tiles_def)
-        min_y = None
-        min_x = None
-        for j in range(TY_OUT):
-            for i in range(TX_OUT):
-                # if value less than min and not processed
-                cell = self.cell_arr[j][i]
-                if (min_e >= cell.get_entropy()) and not cell.processed and (cell.changed == changed):
-                    min_e = cell.get_entropy()
-                    min_y = j
-                    min_x = i
-        return min_y, min_x
+        ''' Find not processed cell with min entropy (see entropy_level).
+        '''
+        heap = self.heap_chg if changed else self.heap_unchg
+        max_pos = self.ty_out * self.tx_out - 1
+        while heap:
+            entropy = heap[0] >> 32
+            y_idx, x_idx = divmod(max_pos - (heap[0] & 0xFFFFFFFF), self.tx_out)
+            cell = self.cell_arr[y_idx][x_idx]
+            # entry still valid? (cell state did not change since push)
+            if (not cell.processed) and (cell.changed == changed) \
+                    and (self.entropy_level(cell) == entropy):
+                return y_idx, x_idx
+            heapq.heappop(heap)
+        return None, None
 
     def mark_not_processed(self):
         ''' Mark all not-collapsed cells (with more than one possible Tile) as not processed.
+        Only the cells touched since the last call can have any flag set.
         '''
-        for lst in self.cell_arr:
-            for cell in lst:
-                # if Cell not collapsed, mark cell as not processed and not changed
-                if cell.get_entropy() > 1:
-                    cell.changed = False
-                    cell.processed = False
+        for j, i in self.touched:
+            cell = self.cell_arr[j][i]
+            # if Cell not collapsed, mark cell as not processed and not changed
+            if cell.get_entropy() > 1:
+                cell.changed = False
+                cell.processed = False
+                self.index_push(j, i)
+        self.touched = set()
 
     def next_step(self):
         ''' Next step in collapsing the wave-function.
@@ -367,10 +627,7 @@ class TilesManager:
             # and collapse it (select a random Tile for it).
             min_y, min_x = self.find_min_entropy_cell(changed = False)
             if (min_y is not None) and (min_x is not None):
-                cell = self.cell_arr[min_y][min_x]
-                val_r = random.choice(cell.poss_list)
-                cell.poss_list = [val_r]
-                cell.changed = True
+                self.collapse_cell(min_y, min_x)
             else:
                 print("Finish!")
                 self.last_x = None
@@ -382,23 +639,146 @@ class TilesManager:
     # Extern methods
     # ##########################################################################
 
+    def seed(self, seed=None):
+        ''' Seed the random generator of the solver (int, str, ..., None = from
+        the OS). Call clear afterwards: the same seed and clear generate the
+        same map.
+        '''
+        self.random.seed(seed)
+
     def clear(self):
         """ Clear all cells
         """
-        self.cell_arr = [[Cell(self.tl_idx_list) for x in range(TX_OUT)] for y in range(TY_OUT)]
+        self.cell_arr = [[self.new_cell() for x in range(self.tx_out)] for y in range(self.ty_out)]
+        self.index_rebuild()
+        self.dirty = None
+        self.contradictions = 0
+        self.clear_picks()
+
+    def resize(self, ty_out, tx_out):
+        ''' Change the size of the output grid (number of Cells), clear all cells.
+        '''
+        self.ty_out = ty_out
+        self.tx_out = tx_out
+        self.clear()
+
+    def clear_picks(self):
+        ''' Start a new selection of Tiles for the collapsed Cells.
+        '''
+        self.pick_salt = self.random.getrandbits(32)
+        self.row_offset = 0
+        self.pinned = {}
+        self.allowed = {}
+
+    def shift_picks(self, rows):
+        ''' The Cells moved rows down (negative: up), keep their Tiles.
+        '''
+        self.row_offset -= rows
+        self.pinned = {(y_abs, x_idx): tile for (y_abs, x_idx), tile in self.pinned.items()
+                       if 0 <= y_abs - self.row_offset < self.ty_out}
+        self.allowed = {(y_abs, x_idx): tiles for (y_abs, x_idx), tiles in self.allowed.items()
+                        if 0 <= y_abs - self.row_offset < self.ty_out}
+
+    def pick_tile(self, y_idx, x_idx, class_idx):
+        ''' Return the Tile of class class_idx for the Cell (y_idx, x_idx):
+        the Tile set with set_cell or a pseudo-random Tile of the class (always
+        the same for the Cell, until the next clear), only one of the allowed
+        Tiles of the Cell if any.
+        '''
+        y_abs = y_idx + self.row_offset
+        tile = self.pinned.get((y_abs, x_idx))
+        if tile is not None and self.tile_class[tile] == class_idx:
+            return tile
+        # weighted: search in the cumulative weights of the class Tiles
+        tiles = self.class_tiles[class_idx]
+        cum = self.class_tile_cum[class_idx]
+        allowed = self.allowed.get((y_abs, x_idx))
+        if allowed is not None and any(tile in allowed for tile in tiles):
+            tiles = [tile for tile in tiles if tile in allowed]
+            cum = list(itertools.accumulate(self.tile_weight[tile] for tile in tiles))
+        rnd = mix(self.pick_salt, y_abs, x_idx) / 4294967296 * cum[-1]
+        return tiles[min(bisect.bisect_right(cum, rnd), len(cum) - 1)]
+
+    def has_contradiction(self):
+        ''' Return True if a deadend was detected since the last clear (cheap,
+        can be checked during the generation).
+        '''
+        return self.contradictions > 0
+
+    def count_conflicts(self):
+        ''' Return the number of neighbor collapsed Cells whose edges do not
+        match (the propagation does not check the Cells again once collapsed).
+        '''
+        class_def = self.class_def
+        conflicts = 0
+        prev = None
+        for row in self.get_classes():
+            edges = [class_def[class_idx] if class_idx >= 0 else None for class_idx in row]
+            for left, right in zip(edges, edges[1:]):
+                if left and right and left[1] != right[3]:
+                    conflicts += 1
+            if prev is not None:
+                for top, bottom in zip(prev, edges):
+                    if top and bottom and top[2] != bottom[0]:
+                        conflicts += 1
+            prev = edges
+        return conflicts
+
+    def is_valid(self):
+        ''' Return True if the generated map is correct: no deadend and all
+        neighbor collapsed Cells connected (checks the whole map).
+        '''
+        return not self.has_contradiction() and self.count_conflicts() == 0
+
+    def enable_stats(self, on_step=None, on_contradiction=None):
+        ''' Enable the instrumentation (counters, timings and callbacks,
+        see stats.py). Return the Stats object.
+        '''
+        from .stats import Stats  # pylint: disable=import-outside-toplevel
+        self.disable_stats()
+        self.stats = Stats(on_step, on_contradiction)
+        self.stats.attach(self)
+        return self.stats
+
+    def disable_stats(self):
+        ''' Disable the instrumentation.
+        '''
+        if self.stats is not None:
+            self.stats.detach(self)
+            self.stats = None
+
+    def set_chunk_cache(self, chunk_cache):
+        ''' Set the cache of solved chunks used by generate (None = no cache,
+        see chunks.py).
+        '''
+        self.chunk_cache = chunk_cache
 
     def set_cell(self, y_pos, x_pos, val):
-        """ Set value for a cell at specified position
+        """ Set value (Tile index) for a cell at specified position
+        """
+        self.pinned[(y_pos + self.row_offset, x_pos)] = val
+        self.set_class(y_pos, x_pos, self.tile_class[val])
+
+    def set_class(self, y_pos, x_pos, val):
+        """ Set class for a cell at specified position
         """
         cell = self.cell_arr[y_pos][x_pos]
         cell.poss_list = [val]
+        self.set_sums(cell, val)
         cell.changed = True
         cell.processed = False
+        self.touched.add((y_pos, x_pos))
+        self.index_push(y_pos, x_pos)
+        if self.dirty is not None:
+            self.dirty.add((y_pos, x_pos))
 
     @timethis
     def generate(self):
-        """ Generate
+        """ Generate (with the chunk cache, if set)
         """
+        if self.chunk_cache is not None:
+            self.chunk_cache.solve(self)
+            return
         while self.next_step():
             pass
 
@@ -407,20 +787,28 @@ class TilesManager:
         a new row appears on top.
         """
         del self.cell_arr[-1]
-        self.cell_arr.insert(0, [Cell(self.tl_idx_list) for x in range(TX_OUT)])
+        self.cell_arr.insert(0, [self.new_cell() for x in range(self.tx_out)])
+        self.shift_picks(1)
         # mark all cells as not processed
         for cell in self.cell_arr[1]:
             cell.processed = False
+        # all rows moved, the entropy index must be rebuilt and all cells redrawn
+        self.index_rebuild()
+        self.dirty = None
 
     def shift_up(self):
         """ Shift all cells one row up, the upper row is lost,
         a new row appears on bottom.
         """
         del self.cell_arr[0]
-        self.cell_arr.append([Cell(self.tl_idx_list) for x in range(TX_OUT)])
+        self.cell_arr.append([self.new_cell() for x in range(self.tx_out)])
+        self.shift_picks(-1)
         # mark all cells as not processed
         for cell in self.cell_arr[-2]:
             cell.processed = False
+        # all rows moved, the entropy index must be rebuilt and all cells redrawn
+        self.index_rebuild()
+        self.dirty = None
 
     # ##########################################################################
     def get_entropy_image(self, entropy):
@@ -436,45 +824,126 @@ class TilesManager:
             return self.img_entr[3]
         return self.img_entr[4]
 
-    def draw(self, surface):
-        """ Draw all Tiles on a surface
+    def get_cell_image(self, y_idx, x_idx):
+        ''' Get image of the Cell with coordinates y_idx, x_idx.
+        '''
+        lst = self.cell_arr[y_idx][x_idx].poss_list
+        lst_len = len(lst)
+        if lst_len == 0:
+            return self.img_none
+        if lst_len > 1:
+            #return self.img_many
+            return self.get_entropy_image(lst_len)
+        return self.tiles_img[self.pick_tile(y_idx, x_idx, lst[0])]
+
+    def get_tiles(self):
+        ''' Return the generated map as list of rows of Tile indexes (-1 = not collapsed).
+        '''
+        return [[self.pick_tile(j, i, cell.poss_list[0]) if cell.get_entropy() == 1 else -1
+                 for i, cell in enumerate(row)] for j, row in enumerate(self.cell_arr)]
+
+    def cell_mask(self, cell):
+        ''' Return the possibilities of a Cell as bitmask.
+        '''
+        if cell.poss_list is self.tl_idx_list:
+            return (1 << len(self.tl_idx_list)) - 1
+        mask = 0
+        for idx in cell.poss_list:
+            mask |= 1 << idx
+        return mask
+
+    def mask_cell(self, mask, sum_w, sum_wlogw):
+        ''' Create a Cell with the possibilities of a bitmask.
+        '''
+        if mask == (1 << len(self.tl_idx_list)) - 1:
+            return Cell(self.tl_idx_list, sum_w, sum_wlogw)
+        return Cell([idx for idx in range(mask.bit_length()) if (mask >> idx) & 1],
+                    sum_w, sum_wlogw)
+
+    def set_masks(self, masks):
+        ''' Set the possibilities of Cells, {(y, x): classes bitmask}, already
+        propagated to a fixed point (see constraints.py): no Cell is left to
+        be processed, the next step collapses.
+        '''
+        sums = {}   # mask -> weights sums (few different masks)
+        for (y_idx, x_idx), mask in masks.items():
+            if mask not in sums:
+                classes = [idx for idx in range(mask.bit_length()) if (mask >> idx) & 1]
+                sums[mask] = (math.fsum(self.class_weight[idx] for idx in classes),
+                              math.fsum(self.class_wlogw[idx] for idx in classes))
+            cell = self.mask_cell(mask, *sums[mask])
+            # collapsed Cell: nothing to propagate
+            cell.processed = not mask & (mask - 1)
+            self.cell_arr[y_idx][x_idx] = cell
+        self.index_rebuild()
+        self.dirty = None
+
+    def get_state(self):
+        ''' Return the solver state besides the Cells (dictionary, see STATE).
+        '''
+        state = {name: getattr(self, name) for name in self.STATE}
+        state['random'] = self.random.getstate()
+        return state
+
+    def set_state(self, state):
+        ''' Restore the solver state besides the Cells (see get_state).
+        '''
+        for name in self.STATE:
+            setattr(self, name, state[name])
+        self.random.setstate(state['random'])
+
+    def get_state_rows(self):
+        ''' Return the state of the Cells, one bytes object per row: for every
+        Cell the possibilities bitmask and the flags, then the weights sums.
+        '''
+        size = (len(self.tl_idx_list) + 7) // 8
+        rows = []
+        for row in self.cell_arr:
+            data = bytearray()
+            sums = array.array('d')
+            for cell in row:
+                data += self.cell_mask(cell).to_bytes(size, 'little')
+                data.append(cell.processed | (cell.changed << 1))
+                sums.append(cell.sum_w)
+                sums.append(cell.sum_wlogw)
+            rows.append(bytes(data) + sums.tobytes())
+        return rows
+
+    def set_state_rows(self, rows):
+        ''' Restore the Cells (see get_state_rows) and rebuild the entropy index.
+        '''
+        size = (len(self.tl_idx_list) + 7) // 8
+        step = size + 1
+        self.cell_arr = []
+        for data in rows:
+            sums = array.array('d')
+            sums.frombytes(data[step * self.tx_out:])
+            row = []
+            for x_idx in range(self.tx_out):
+                pos = x_idx * step
+                cell = self.mask_cell(int.from_bytes(data[pos:pos + size], 'little'),
+                                      sums[2 * x_idx], sums[2 * x_idx + 1])
+                cell.processed = bool(data[pos + size] & 1)
+                cell.changed = bool(data[pos + size] & 2)
+                row.append(cell)
+            self.cell_arr.append(row)
+        self.index_rebuild()
+        self.dirty = None
+
+    def get_classes(self):
+        ''' Return the classes of the Cells as list of rows (-1 = not collapsed).
+        '''
+        return [[cell.poss_list[0] if cell.get_entropy() == 1 else -1 for cell in row]
+                for row in self.cell_arr]
+
+    def get_masks(self):
+        ''' Return the possibilities of the Cells as list of rows of classes bitmasks.
+        '''
+        return [[self.cell_mask(cell) for cell in row] for row in self.cell_arr]
+
+    def draw(self, surface, background=None):
+        """ Draw the Tiles changed since the last call on a (pygame) surface,
+        see render.draw. Return the list of updated rectangles.
         """
-        for j in range(TY_OUT):
-            for i in range(TX_OUT):
-                cell = self.cell_arr[j][i]
-                lst = cell.poss_list
-                lst_len = len(lst)
-                img = None
-                if lst_len == 0:
-                    img = self.img_none
-                elif lst_len > 1:
-                    #img = self.img_many
-                    img = self.get_entropy_image(lst_len)
-                else:
-                    img = self.tiles_img[lst[0]]
-                if img is not None:
-                    surface.blit(img, ((i * 64), (j * 64)))
-
-                # Last processed
-                if (self.last_x is not None) and (self.last_y is not None):
-                    surface.blit(self.img_last, ((self.last_x * 64), (self.last_y * 64)))
-
-                # text: possibilities
-                #textsurface = self.myfont.render(str(lst_len), False, (200, 200, 200))
-                #if lst_len <= 0:
-                #    textsurface = self.myfont.render("X", False, (200, 200, 200))
-                #elif lst_len > 1:
-                #    textsurface = self.myfont.render("?", False, (200, 200, 200))
-                #else:
-                #    textsurface = self.myfont.render(str(lst[0]), False, (200, 200, 200))
-                #surface.blit(textsurface, ((i * 64) + 4, (j * 64)))
-
-                # text: processed
-                #if(cell.processed):
-                #    textsurface = self.myfont.render("P", False, (150, 150, 150))
-                #    surface.blit(textsurface, ((i * 64), (j * 64) + 16))
-
-                # text: changed
-                #if(cell.changed):
-                #    textsurface = self.myfont.render("C", False, (150, 150, 150))
-                #    surface.blit(textsurface, ((i * 64), (j * 64) + 32))
+        from . import render  # pylint: disable=import-outside-toplevel
+        return render.draw(self, surface, background)
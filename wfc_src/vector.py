@@ -0,0 +1,445 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Vector Tiles Manager:
+# The whole wave-function is a numpy boolean array of shape (H, W, T):
+#
+#   wave[y, x, t] = True  ->  Tile t is still possible for Cell (y, x)
+#
+# For every side of every Cell, the set of possible edge definitions on that
+# side is kept in a second array (shape H x W x 4 x C, C = number of edge
+# definitions). It is the matrix product of the wave with the one-hot table
+# of Tiles edges (T x 4C), updated only for the changed Cells.
+#
+# Instead of processing the Cells one by one, the constraints are propagated
+# with vectorized sweeps over all Cells next to a Cell changed in the
+# previous sweep (the frontier):
+#
+#   1. Take the edges of the four neighbors in four directions: the top side
+#      of a Cell must match the bottom side of the Cell above it, etc.
+#   2. A Tile remains possible only if all its four edges are allowed by the
+#      four neighbors (matrix product of the allowed edges with the transposed
+#      one-hot table counts the allowed edges of every Tile).
+#   3. Mask the wave with the remaining Tiles, the changed Cells are the
+#      frontier for the next sweep.
+#
+# The Cells of the frontier next to each other are swept again even if
+# collapsed: they were changed in the same sweep (masked with the previous
+# edges of each other) or collapsed in the same step and could conflict.
+#
+# The sweeps are repeated (one per next_step) until nothing changes. Then
+# the Cells with the lowest (Shannon) entropy are collapsed. The weights
+# sums of the changed Cells are matrix products of their possible classes
+# with the weights (one product per sweep for all Cells, instead of the
+# running sums of the other Tiles Managers). The grid is divided in
+# blocks of block_size x block_size Cells and in every second block (by
+# rows and columns, alternating) the Cell with the lowest entropy collapses.
+# The collapsed Cells are at least block_size Cells apart, but the effects of
+# their collapses can still meet and conflict. Such a step is speculative:
+# the wave is saved before it, and if the propagation hits a deadend before
+# the fixed point, the wave is restored and only the Cell with the lowest
+# entropy of the step is collapsed (as the other Tiles Managers do). The next
+# step tries the blocks again.
+#-------------------------------------------------------------------------------
+""" Vector (numpy) Tiles Manager Module. """
+
+import numpy as np
+
+from .tilesman import TilesManager, TX_OUT, TY_OUT, mix
+
+# ##############################################################################
+class VectorTilesManager(TilesManager):
+    """ Tiles Manager using a numpy array for the whole wave-function """
+
+    CACHED = TilesManager.CACHED + ('edges', 'edge_cnt')
+    TIMED = ('next_step', 'propagate', 'collapse')
+    STATE = TilesManager.STATE + ('front', 'phase')
+
+    def __init__(self, path, ty_out=TY_OUT, tx_out=TX_OUT, block_size=8):
+        """ Init Vector Tiles Manager """
+        self.block_size = block_size
+        self.wave = np.ones((ty_out, tx_out, 0), dtype=bool)
+        self.entropy = np.zeros((ty_out, tx_out), dtype=np.int32)
+        self.shannon = np.zeros((ty_out, tx_out))   # Shannon entropy of every Cell
+        self.codes = np.zeros((ty_out, tx_out, 4, 0), dtype=bool)
+        # coordinates (y-array, x-array) of the Cells changed in the last sweep
+        self.front = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        self.phase = 0          # blocks phase for the next collapse
+        # (wave, entropy, shannon, codes, phase) saved before a multi-Cell collapse
+        self.undo = None
+        self.single = False     # the last multi-Cell collapse was undone, collapse one Cell
+        self.rng = np.random.default_rng(0)    # seeded from self.random by clear
+        self.weight = np.zeros(0)       # weight of every class
+        self.wlogw = np.zeros(0)        # weight * log(weight) of every class
+        self.inv_weight = np.zeros(0)   # 1 / weight of every class
+
+        # Tiles edges one-hot table, for every side C edge definitions (see build_edges)
+        self.edges = np.zeros((0, 0), dtype=np.float32)
+        self.edge_cnt = 0
+        super().__init__(path, ty_out, tx_out)
+
+    def build_edges(self):
+        ''' Precompute the edge definition tables for all loaded Tiles.
+        '''
+        tiles = np.array(self.class_def, dtype=np.int64).reshape(-1, 4)
+        edges, edge_idx = np.unique(tiles, return_inverse=True)
+        self.edge_cnt = len(edges)
+
+        # edges[t, side * C + c] = 1 if the Tile t has edge definition c on side
+        self.edges = np.zeros((len(tiles), 4 * self.edge_cnt), dtype=np.float32)
+        for side_idx in range(4):
+            cols = side_idx * self.edge_cnt + edge_idx.reshape(-1, 4)[:, side_idx]
+            self.edges[np.arange(len(tiles)), cols] = 1.0
+
+    def build_tables(self):
+        ''' Precompute the tables derived from the Tiles definitions.
+        '''
+        super().build_tables()
+        self.build_edges()
+
+    def side_codes(self, poss):
+        ''' Return a (..., 4, C) boolean array: the edge definitions
+        possible on every side for the (..., T) possible Tiles.
+        '''
+        codes = poss.astype(np.float32) @ self.edges
+        return (codes > 0.5).reshape(poss.shape[:-1] + (4, self.edge_cnt))
+
+    def get_shannon_arr(self, poss):
+        ''' Return the Shannon entropy for the (..., T) possible Tiles.
+        '''
+        sum_w = poss @ self.weight
+        sum_wlogw = poss @ self.wlogw
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shannon = np.log(sum_w) - sum_wlogw / sum_w
+        return np.where(poss.sum(axis=-1) > 1, np.maximum(shannon, 0.0), 0.0)
+
+    def update_cells(self, c_y, c_x, poss):
+        ''' Set the possible Tiles of the Cells (c_y, c_x) and add them to the front.
+        '''
+        self.wave[c_y, c_x] = poss
+        self.entropy[c_y, c_x] = poss.sum(axis=-1)
+        self.shannon[c_y, c_x] = self.get_shannon_arr(poss)
+        self.codes[c_y, c_x] = self.side_codes(poss)
+        if self.dirty is not None:
+            self.dirty.update(zip(np.atleast_1d(c_y).tolist(), np.atleast_1d(c_x).tolist()))
+        self.front = (np.concatenate((self.front[0], np.atleast_1d(c_y))),
+                      np.concatenate((self.front[1], np.atleast_1d(c_x))))
+
+    def propagate(self):
+        ''' One propagation sweep over the not collapsed neighbors of the
+        Cells changed in the last sweep (front). Return False if there
+        was nothing to propagate.
+        '''
+        f_y, f_x = self.front
+        if len(f_y) == 0:
+            # fixed point: the last collapse is kept
+            self.undo = None
+            return False
+        self.front = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+
+        # not collapsed neighbors of the front, and the Cells of the front next to
+        # each other (changed in the same sweep or collapsed in the same step)
+        cand = np.zeros((self.ty_out, self.tx_out), dtype=bool)
+        cand[f_y[f_y > 0] - 1, f_x[f_y > 0]] = True
+        cand[f_y[f_y < self.ty_out - 1] + 1, f_x[f_y < self.ty_out - 1]] = True
+        cand[f_y[f_x > 0], f_x[f_x > 0] - 1] = True
+        cand[f_y[f_x < self.tx_out - 1], f_x[f_x < self.tx_out - 1] + 1] = True
+        front = np.zeros((self.ty_out, self.tx_out), dtype=bool)
+        front[f_y, f_x] = True
+        c_y, c_x = np.nonzero(cand & ((self.entropy > 1) | front))
+        if len(c_y) == 0:
+            return True
+        if self.stats is not None:
+            self.stats.count('propagated', len(c_y))
+
+        # allowed edges on every side, derived from the neighbor on that side
+        allowed = np.ones((len(c_y), 4, self.edge_cnt), dtype=np.float32)
+        sel = c_y > 0                   # top vs bottom of the cell above
+        allowed[sel, 0] = self.codes[c_y[sel] - 1, c_x[sel], 2]
+        sel = c_x < self.tx_out - 1          # right vs left of the cell on the right
+        allowed[sel, 1] = self.codes[c_y[sel], c_x[sel] + 1, 3]
+        sel = c_y < self.ty_out - 1          # bottom vs top of the cell below
+        allowed[sel, 2] = self.codes[c_y[sel] + 1, c_x[sel], 0]
+        sel = c_x > 0                   # left vs right of the cell on the left
+        allowed[sel, 3] = self.codes[c_y[sel], c_x[sel] - 1, 1]
+
+        # a Tile remains possible if all its four edges are allowed
+        old = self.wave[c_y, c_x]
+        sides_ok = allowed.reshape(len(c_y), -1) @ self.edges.T
+        new = old & (sides_ok > 3.5)
+
+        # deadend detected? (no more valid possibilities)
+        dead = ~new.any(axis=1)
+        if dead.any() and self.undo is not None:
+            # the Cells collapsed together conflict
+            self.restore_undo()
+            return True
+        if dead.any():
+            for d_y, d_x in zip(c_y[dead].tolist(), c_x[dead].tolist()):
+                self.contradiction(d_y, d_x)
+            # create "artificially" the null-cell
+            new[dead] = False
+            new[dead, 0] = True
+
+        changed = (new != old).any(axis=1)
+        if changed.any():
+            self.update_cells(c_y[changed], c_x[changed], new[changed])
+            # the null-cells do not constrain their neighbors
+            self.front = (c_y[changed & ~dead], c_x[changed & ~dead])
+        return True
+
+    def collapse(self):
+        ''' Collapse the Cells with lowest entropy (one per block).
+        Return False if all Cells are collapsed.
+        '''
+        blk = self.block_size
+        # entropy with a small random fraction (random choice on equal entropy)
+        score = np.where(self.entropy > 1,
+                         self.shannon + 1e-6 * self.rng.random(self.entropy.shape), np.inf)
+        if not np.isfinite(score).any():
+            return False
+
+        # pad to full blocks and find the min entropy in every block
+        n_by, n_bx = -(-self.ty_out // blk), -(-self.tx_out // blk)
+        padded = np.full((n_by * blk, n_bx * blk), np.inf)
+        padded[:self.ty_out, :self.tx_out] = score
+        blocks = padded.reshape(n_by, blk, n_bx, blk).transpose(0, 2, 1, 3).reshape(n_by, n_bx, -1)
+        pos = blocks.argmin(axis=2)
+        val = np.take_along_axis(blocks, pos[..., None], axis=2)[..., 0]
+
+        # take the next blocks phase which still has not collapsed cells
+        for _ in range(4):
+            p_y, p_x = divmod(self.phase, 2)
+            self.phase = (self.phase + 1) % 4
+            sel = np.isfinite(val[p_y::2, p_x::2])
+            if sel.any():
+                break
+        b_y, b_x = np.nonzero(sel)
+        b_y, b_x = b_y * 2 + p_y, b_x * 2 + p_x
+        c_y = b_y * blk + pos[b_y, b_x] // blk
+        c_x = b_x * blk + pos[b_y, b_x] % blk
+        if self.single:
+            # after an undone collapse: only the Cell with the lowest entropy
+            best = int(score[c_y, c_x].argmin())
+            c_y, c_x = c_y[best:best + 1], c_x[best:best + 1]
+            self.single = False
+        elif len(c_y) > 1:
+            self.undo = (self.wave.copy(), self.entropy.copy(), self.shannon.copy(),
+                         self.codes.copy(), (self.phase - 1) % 4)
+
+        # select a random class from the possible ones for every selected cell,
+        # weighted: the max of random^(1/weight) (Efraimidis-Spirakis)
+        poss = self.wave[c_y, c_x]
+        keys = self.rng.random(poss.shape) ** self.inv_weight
+        tiles = np.where(poss, keys, -1.0).argmax(axis=1)
+        poss[:] = False
+        poss[np.arange(len(tiles)), tiles] = True
+        self.update_cells(c_y, c_x, poss)
+        if self.stats is not None:
+            self.stats.count('collapses', len(c_y))
+
+        self.last_y, self.last_x = int(c_y[-1]), int(c_x[-1])
+        return True
+
+    def restore_undo(self):
+        ''' Restore the wave saved before the last multi-Cell collapse, the
+        next collapse is a single Cell.
+        '''
+        entropy = self.entropy
+        self.wave, self.entropy, self.shannon, self.codes, self.phase = self.undo
+        self.undo = None
+        self.single = True
+        self.front = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        if self.dirty is not None:
+            c_y, c_x = np.nonzero(entropy != self.entropy)
+            self.dirty.update(zip(c_y.tolist(), c_x.tolist()))
+        if self.stats is not None:
+            self.stats.count('undone')
+
+    def next_step(self):
+        ''' Next step in collapsing the wave-function: one propagation sweep
+        or (if nothing to propagate) collapse.
+        '''
+        if self.propagate():
+            return True
+        if not self.collapse():
+            print("Finish!")
+            self.last_x = None
+            self.last_y = None
+            return False
+        return True
+
+    # ##########################################################################
+    # Extern methods
+    # ##########################################################################
+
+    def clear(self):
+        """ Clear all cells
+        """
+        tiles_cnt = len(self.tl_idx_list)
+        self.wave = np.ones((self.ty_out, self.tx_out, tiles_cnt), dtype=bool)
+        self.entropy = np.full((self.ty_out, self.tx_out), tiles_cnt, dtype=np.int32)
+        self.weight = np.asarray(self.class_weight, dtype=np.float64)
+        self.wlogw = np.asarray(self.class_wlogw, dtype=np.float64)
+        self.inv_weight = 1.0 / self.weight
+        self.shannon = np.full((self.ty_out, self.tx_out),
+                               self.get_shannon_arr(np.ones(tiles_cnt, dtype=bool)))
+        self.codes = np.zeros((self.ty_out, self.tx_out, 4, self.edge_cnt), dtype=bool)
+        self.codes[...] = self.side_codes(np.ones(tiles_cnt, dtype=bool))
+        self.front = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        self.phase = 0
+        self.undo = None
+        self.single = False
+        self.rng = np.random.default_rng(self.random.getrandbits(32))
+        self.dirty = None
+        self.contradictions = 0
+        self.clear_picks()
+
+    def set_class(self, y_pos, x_pos, val):
+        """ Set class for a cell at specified position
+        """
+        poss = np.zeros(len(self.tl_idx_list), dtype=bool)
+        poss[val] = True
+        self.update_cells(y_pos, x_pos, poss)
+
+    def shift_down(self):
+        """ Shift all cells one row down, the bottom row is lost,
+        a new row appears on top.
+        """
+        for arr in (self.wave, self.entropy, self.shannon, self.codes):
+            arr[1:] = arr[:-1].copy()
+        self.shift_picks(1)
+        self.update_cells(np.zeros(self.tx_out, dtype=np.intp), np.arange(self.tx_out),
+                          np.ones((self.tx_out, len(self.tl_idx_list)), dtype=bool))
+        self.dirty = None
+        # the new row is constrained by the row below it
+        self.front = (np.ones(self.tx_out, dtype=np.intp), np.arange(self.tx_out))
+
+    def shift_up(self):
+        """ Shift all cells one row up, the upper row is lost,
+        a new row appears on bottom.
+        """
+        for arr in (self.wave, self.entropy, self.shannon, self.codes):
+            arr[:-1] = arr[1:].copy()
+        self.shift_picks(-1)
+        self.update_cells(np.full(self.tx_out, self.ty_out - 1, dtype=np.intp),
+                          np.arange(self.tx_out),
+                          np.ones((self.tx_out, len(self.tl_idx_list)), dtype=bool))
+        self.dirty = None
+        # the new row is constrained by the row above it
+        self.front = (np.full(self.tx_out, self.ty_out - 2, dtype=np.intp), np.arange(self.tx_out))
+
+    # ##########################################################################
+    def get_cell_image(self, y_idx, x_idx):
+        ''' Get image of the Cell with coordinates y_idx, x_idx.
+        '''
+        entropy = self.entropy[y_idx, x_idx]
+        if entropy == 0:
+            return self.img_none
+        if entropy > 1:
+            return self.get_entropy_image(entropy)
+        return self.tiles_img[self.pick_tile(y_idx, x_idx, int(self.wave[y_idx, x_idx].argmax()))]
+
+    def get_tiles(self):
+        ''' Return the (H, W) array of Tile indexes (-1 for not collapsed Cells).
+        '''
+        classes = self.wave.argmax(axis=2)
+        # pick_tile for all Cells: Tiles and cumulative weights of every class
+        # padded to the same length
+        cnt = np.array([len(tiles) for tiles in self.class_tiles])
+        class_tiles = np.zeros((len(cnt), cnt.max()), dtype=np.int64)
+        class_cum = np.full((len(cnt), cnt.max()), np.inf)
+        for class_idx, tiles in enumerate(self.class_tiles):
+            class_tiles[class_idx, :len(tiles)] = tiles
+            class_cum[class_idx, :len(tiles)] = self.class_tile_cum[class_idx]
+        y_abs = np.arange(self.ty_out, dtype=np.int64)[:, None] + self.row_offset
+        x_idx = np.arange(self.tx_out, dtype=np.int64)[None, :]
+        total = class_cum[np.arange(len(cnt)), cnt - 1][classes]
+        rnd = mix(self.pick_salt, y_abs, x_idx) / 4294967296 * total
+        # bisect_right: number of cumulative weights <= rnd
+        pos = np.minimum((class_cum[classes] <= rnd[..., None]).sum(axis=2), cnt[classes] - 1)
+        tiles = np.take_along_axis(class_tiles[classes], pos[..., None], axis=2)[..., 0]
+        # the pinned Tiles and the Cells with allowed Tiles
+        for y_abs, x_idx in list(self.pinned) + list(self.allowed):
+            y_idx = y_abs - self.row_offset
+            tiles[y_idx, x_idx] = self.pick_tile(y_idx, x_idx, int(classes[y_idx, x_idx]))
+        return np.where(self.entropy == 1, tiles, -1)
+
+    def get_classes(self):
+        ''' Return the classes of the Cells as list of rows (-1 = not collapsed).
+        '''
+        return np.where(self.entropy == 1, self.wave.argmax(axis=2), -1).tolist()
+
+    def get_masks(self):
+        ''' Return the possibilities of the Cells as list of rows of classes bitmasks.
+        '''
+        bits = np.packbits(self.wave, axis=-1, bitorder='little')
+        return [[int.from_bytes(cell.tobytes(), 'little') for cell in row] for row in bits]
+
+    def set_masks(self, masks):
+        ''' Set the possibilities of Cells, {(y, x): classes bitmask}, already
+        propagated to a fixed point (see constraints.py): the front is empty.
+        '''
+        if not masks:
+            return
+        tiles_cnt = len(self.tl_idx_list)
+        size = (tiles_cnt + 7) // 8
+        c_y, c_x = (np.array(pos, dtype=np.intp) for pos in zip(*masks))
+        bits = np.frombuffer(b''.join(mask.to_bytes(size, 'little') for mask in masks.values()),
+                             dtype=np.uint8).reshape(len(masks), size)
+        self.update_cells(c_y, c_x, np.unpackbits(bits, axis=1, count=tiles_cnt,
+                                                  bitorder='little').astype(bool))
+        self.front = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+        self.dirty = None
+
+    def get_state(self):
+        ''' Return the solver state besides the Cells (dictionary, see STATE).
+        '''
+        state = super().get_state()
+        state['rng'] = self.rng.bit_generator.state
+        state['undo'] = self.undo
+        state['single'] = self.single
+        return state
+
+    def set_state(self, state):
+        ''' Restore the solver state besides the Cells (see get_state).
+        '''
+        super().set_state(state)
+        self.rng = np.random.default_rng()
+        self.rng.bit_generator.state = state['rng']
+        self.undo = state.get('undo')
+        self.single = state.get('single', False)
+
+    def get_state_rows(self):
+        ''' Return the state of the Cells, one bytes object per row: the
+        possible classes (bits) and the Shannon entropy of every Cell.
+        '''
+        return [np.packbits(self.wave[y_idx], axis=-1).tobytes() + self.shannon[y_idx].tobytes()
+                for y_idx in range(self.ty_out)]
+
+    def set_state_rows(self, rows):
+        ''' Restore the Cells (see get_state_rows), the derived arrays are recomputed.
+        '''
+        tiles_cnt = len(self.tl_idx_list)
+        size = (tiles_cnt + 7) // 8
+        bits = np.frombuffer(b''.join(row[:size * self.tx_out] for row in rows), dtype=np.uint8)
+        self.wave = np.unpackbits(bits.reshape(self.ty_out, self.tx_out, size), axis=-1,
+                                  count=tiles_cnt).astype(bool)
+        self.shannon = np.frombuffer(b''.join(row[size * self.tx_out:] for row in rows),
+                                     dtype=np.float64).reshape(self.ty_out, self.tx_out).copy()
+        self.entropy = self.wave.sum(axis=-1).astype(np.int32)
+        self.codes = self.side_codes(self.wave)
+        self.dirty = None
@@ -14,9 +14,18 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #-------------------------------------------------------------------------------
 """ Wave Function Collapse Main """
+import time
+
 import pygame
 
-from . import tilesman
+from . import mapfile, tilesman
+from .constraints import constrain
+from .solver import SolverThread
+
+# Target frame rate of the viewer
+FPS = 60
+# Part of every frame used for the solver steps in animation mode (key 1)
+STEP_BUDGET = 0.75 / FPS
 
 # ###############################################################################
 # Main
@@ -24,8 +33,10 @@ from . import tilesman
 class WFC:
     """ Wave Function Collapse """
 
-    def __init__(self, width, height, path):
+    def __init__(self, width, height, path, ty_out=None, tx_out=None):
         """ Init Module
+            width, height - window size (pixels)
+            ty_out, tx_out - grid size (Cells), default: as many 64x64 Tiles as fit in the window
         """
         self.width = width
         self.height = height
@@ -37,17 +48,32 @@ class WFC:
         self.quit_flag = False
 
         # create tiles
-        self.tiles_man = tilesman.TilesManager(path)
+        if ty_out is None:
+            ty_out = height // 64
+        if tx_out is None:
+            tx_out = width // 64
+        self.tiles_man = tilesman.TilesManager(path, ty_out, tx_out)
         self.tiles_man.load_tiles('/../resources/tiles_64x64_9.png', True, ty_cnt=9, tx_cnt=13)
-        #self.tiles_man.printTiles()
+        #self.tiles_man.print_tiles()
         self.tiles_man.clear()
+        # instant mode (key 2) solves in a background thread
+        self.solver = SolverThread(self.tiles_man)
 
     def display(self):
-        """ Draw scene on the surface.
+        """ Draw scene on the surface (only the changed Tiles).
+        Return the list of changed rectangles.
         """
-        # display background
-        self.surface.fill(self.background)
-        self.tiles_man.draw(self.surface)
+        return self.solver.draw(self.surface, self.background)
+
+    def set_input(self, tiles_man):
+        """ Clear and set the input set (some predefined Cells).
+        """
+        tiles_man.clear()
+        # all Cells set at once and propagated before the first collapse
+        report = constrain(tiles_man, tiles={(3, 3): 104, (3, 4): 6, (4, 3): 26, (4, 4): 30,
+                                             (9, 9): 48, (9, 8): 46})
+        if not report['feasible']:
+            print('Infeasible input set, Cells without possibility:', report['conflicts'])
 
     def run(self):
         """ Create a pygame surface until it is closed.
@@ -56,7 +82,7 @@ class WFC:
         pygame.display.flip()
 
         # Initialize clock
-        #clock = pygame.time.Clock()
+        clock = pygame.time.Clock()
         auto = False
 
         while not self.quit_flag:
@@ -64,7 +90,8 @@ class WFC:
             # Computes how many milliseconds have passed since previous call
             # The argument framerate makes the function to delay to keep the game running slower.
             # ex: clock.tick(60) -> doesn't run faster than 60 frames/sec (16ms)
-            #clock.tick(60)
+            clock.tick(FPS)
+            frame_start = time.perf_counter()
             #clock.tick(15)
             for event in pygame.event.get():
 
@@ -76,36 +103,54 @@ class WFC:
                         self.quit_flag = True
 
                 elif event.type == pygame.KEYDOWN:
+                    # the Tiles Manager can be changed only if the solver thread is stopped
+                    running = self.solver.running()
+                    if event.key in (pygame.K_c, pygame.K_q, pygame.K_r, pygame.K_0,
+                                     pygame.K_1, pygame.K_DOWN, pygame.K_UP):
+                        self.solver.cancel()
                     if event.key == pygame.K_c:
+                        # clear (and restart, if solving)
                         self.tiles_man.clear()
+                        if running:
+                            self.solver.start()
                     if event.key == pygame.K_q:
+                        auto = False
                         self.tiles_man.next_step()
                     if event.key == pygame.K_r:
-                        self.tiles_man.clear()
-                        self.tiles_man.set_cell(3, 3, 104)
-                        self.tiles_man.set_cell(3, 4, 6)
-                        self.tiles_man.set_cell(4, 3, 26)
-                        self.tiles_man.set_cell(4, 4, 30 )
-
-                        self.tiles_man.set_cell(9, 9, 48)
-                        self.tiles_man.set_cell(9, 8, 46)
+                        self.set_input(self.tiles_man)
+                        if running:
+                            self.solver.start()
 
                     elif event.key == pygame.K_0:
                         auto = False
                     elif event.key == pygame.K_1:
                         auto = True
                     elif event.key == pygame.K_2:
-                        self.tiles_man.generate()
+                        auto = False
+                        self.solver.start()
                     elif event.key == pygame.K_DOWN:
                         self.tiles_man.shift_down()
-                        self.tiles_man.generate()
+                        self.solver.start()
                     elif event.key == pygame.K_UP:
                         self.tiles_man.shift_up()
-                        self.tiles_man.generate()
+                        self.solver.start()
                     elif event.key == pygame.K_s:
                         pygame.image.save(self.surface, 'out.png')
+                    elif event.key == pygame.K_m:
+                        # Tile indexes (binary map file), the solver continues after saving
+                        self.solver.cancel()
+                        mapfile.save_map('out.wfcm', self.tiles_man.get_tiles(),
+                                         mapfile.get_meta(self.tiles_man))
+                        if running:
+                            self.solver.start()
 
             if auto:
-                auto = self.tiles_man.next_step()
-            self.display()
-            pygame.display.flip()
+                # steps until the time budget of this frame is spent
+                while auto and (time.perf_counter() - frame_start < STEP_BUDGET):
+                    auto = self.tiles_man.next_step()
+            # push only the changed areas to the screen
+            rects = self.display()
+            if rects:
+                pygame.display.update(rects)
+
+        self.solver.cancel()
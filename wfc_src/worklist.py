@@ -0,0 +1,196 @@
+# This file is part of the WFC distribution.
+# Copyright (c) 2022 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# Worklist Tiles Manager:
+# Bitset Tiles Manager with queue based (AC-3 style) propagation.
+#
+# Instead of sweeping over the grid for "changed and not processed" Cells and
+# resetting the flags of all Cells after every pass, the Cells which lost
+# possibilities are appended to a queue (worklist). Only these Cells are
+# processed; a Cell is queued again every time its list of possibilities
+# shrinks. The propagation ends (fixed point) when the queue is empty, then
+# the Cell with the lowest entropy collapses and is added to the queue.
+#
+# Revising one neighbor costs a few AND/OR operations per edge definition
+# (see bitset.py), so the time per collapse depends only on how many Cells
+# are affected by it and not on the size of the grid.
+#
+# The Cells state (flags) in this mode:
+#   not collapsed Cell:  processed = False, changed = False
+#   collapsed Cell:      processed = True  (never selected for collapse again)
+#-------------------------------------------------------------------------------
+""" Worklist Tiles Manager Module. """
+
+from collections import deque
+
+from .bitset import BitsetTilesManager
+from .tilesman import TX_OUT, TY_OUT
+
+# Neighbors: (y_rel, x_rel, neighbor side_idx), in the order of the directions
+# (0=top, 1=right, 2=bottom, 3=left) used by BitsetTilesManager.allowed_mask
+NEIGHBORS = ((-1, 0, 2), (0, 1, 3), (1, 0, 0), (0, -1, 1))
+
+# ##############################################################################
+class WorklistTilesManager(BitsetTilesManager):
+    """ Bitset Tiles Manager with worklist propagation """
+
+    STATE = BitsetTilesManager.STATE + ('queue',)
+
+    def __init__(self, path, ty_out=TY_OUT, tx_out=TX_OUT):
+        """ Init Worklist Tiles Manager """
+        self.queue = deque()    # Cells (y, x) to be processed
+        self.queued = set()     # Cells already in queue
+        super().__init__(path, ty_out, tx_out)
+
+    def enqueue(self, y_idx, x_idx):
+        ''' Add cell to the worklist (if not already there).
+        '''
+        if (y_idx, x_idx) not in self.queued:
+            self.queued.add((y_idx, x_idx))
+            self.queue.append((y_idx, x_idx))
+
+    def process_neighbor_cell(self, y_pos, x_pos, y_rel, x_rel, side_idx, main_set):
+        """ Process neighbor cell. Remove from the neighbor cell all Tiles
+            which are not in main_set, queue the neighbor if it changed.
+            y_pos - y-position of the main cell
+            x_pos - x-position of the main cell
+            y_rel - y-relative-position of the neighbor cell
+            x_rel - x-relative-position of the neighbor cell
+            side_idx - index of the neighbor side to be cheked (0=top, 1=right, 2=bottom, 3=left)
+            main_set - bitmask of Tiles which can be connected to the main cell
+        """
+        y_nb, x_nb = y_pos + y_rel, x_pos + x_rel
+        cell = self.cell_arr[y_nb][x_nb]
+        # process only cells with more than one possibility
+        if cell.entropy > 1:
+            mask = cell.poss_mask & main_set
+            # deadend detected? (no more valid possibilities)
+            if mask == 0:
+                # create "artificially" the null-cell
+                mask = 1
+                self.contradiction(y_nb, x_nb)
+            if mask != cell.poss_mask:
+                removed = cell.poss_mask & ~mask
+                cell.poss_mask = mask
+                cell.entropy = bin(mask).count('1')
+                self.remove_weights(cell, removed)
+                if cell.entropy == 1:
+                    cell.processed = True
+                else:
+                    self.index_push(y_nb, x_nb)
+                self.enqueue(y_nb, x_nb)
+                if self.dirty is not None:
+                    self.dirty.add((y_nb, x_nb))
+
+    def process_cell(self, y_idx:int, x_idx:int):
+        ''' Process cell with coordinates y_idx, x_idx .
+            Check four neighbor cells (top, right, bottom, left) and remove Tiles
+            which cannot be connected to this (center) cell.
+        '''
+        mask = self.cell_arr[y_idx][x_idx].poss_mask
+        for dir_idx, (y_rel, x_rel, side_idx) in enumerate(NEIGHBORS):
+            if (0 <= y_idx + y_rel < self.ty_out) and (0 <= x_idx + x_rel < self.tx_out):
+                self.process_neighbor_cell(y_idx, x_idx, y_rel, x_rel, side_idx,
+                                           self.allowed_mask(dir_idx, mask))
+        if self.stats is not None:
+            self.stats.count('propagated')
+
+    def next_step(self):
+        ''' Next step in collapsing the wave-function: process the next cell
+        from the worklist or (if empty) collapse the cell with min entropy.
+        '''
+        if self.queue:
+            min_y, min_x = self.queue.popleft()
+            self.queued.discard((min_y, min_x))
+            self.process_cell(min_y, min_x)
+            self.last_x = min_x
+            self.last_y = min_y
+            return True
+
+        # Find cell with minimal number of possibilities
+        # and collapse it (select a random Tile for it).
+        min_y, min_x = self.find_min_entropy_cell(changed = False)
+        if (min_y is not None) and (min_x is not None):
+            self.collapse_cell(min_y, min_x)
+            return True
+
+        print("Finish!")
+        self.last_x = None
+        self.last_y = None
+        return False
+
+    def collapse_cell(self, y_idx, x_idx):
+        ''' Collapse the cell (select a random Tile for it).
+        '''
+        self.set_class(y_idx, x_idx, self.choose_class(self.cell_arr[y_idx][x_idx]))
+        if self.stats is not None:
+            self.stats.count('collapses')
+
+    # ##########################################################################
+    # Extern methods
+    # ##########################################################################
+
+    def clear(self):
+        """ Clear all cells
+        """
+        super().clear()
+        self.queue = deque()
+        self.queued = set()
+
+    def set_class(self, y_pos, x_pos, val):
+        """ Set class for a cell at specified position
+        """
+        cell = self.cell_arr[y_pos][x_pos]
+        cell.poss_list = [val]
+        self.set_sums(cell, val)
+        cell.changed = False
+        cell.processed = True
+        self.enqueue(y_pos, x_pos)
+        if self.dirty is not None:
+            self.dirty.add((y_pos, x_pos))
+
+    def requeue_row(self, y_idx):
+        ''' Queue all cells of a row (after shift), mark collapsed cells as processed.
+        '''
+        for x_idx, cell in enumerate(self.cell_arr[y_idx]):
+            cell.changed = False
+            cell.processed = (cell.entropy == 1)
+            self.enqueue(y_idx, x_idx)
+
+    def shift_down(self):
+        """ Shift all cells one row down, the bottom row is lost,
+        a new row appears on top.
+        """
+        super().shift_down()
+        self.queue = deque()
+        self.queued = set()
+        self.requeue_row(1)
+
+    def shift_up(self):
+        """ Shift all cells one row up, the upper row is lost,
+        a new row appears on bottom.
+        """
+        super().shift_up()
+        self.queue = deque()
+        self.queued = set()
+        self.requeue_row(self.ty_out - 2)
+
+    def set_state(self, state):
+        ''' Restore the solver state besides the Cells (see get_state).
+        '''
+        super().set_state(state)
+        self.queue = deque(self.queue)
+        self.queued = set(self.queue)